@@ -1,12 +1,61 @@
 # agents/base_agent.py
 from spade.agent import Agent
+from spade.template import Template
+import asyncio
 import datetime
+import uuid
+
+from rng import RandomStreams
+
+# Template para behaviours que não lêem mensagens: o SPADE entrega cada
+# mensagem a todos os behaviours sem template, e estes nunca a consumiriam.
+NO_MESSAGES = Template(metadata={"protocol": "no-messages"})
+
+# duração de um tick quando não há ambiente (o relógio é o env.time)
+SECONDS_PER_TICK = 0.2
+
 
 class FactoryAgent(Agent):
     def __init__(self, jid, password, env=None):
         super().__init__(jid, password)
         self.env = env
 
+        # geradores aleatórios por agente/finalidade (seed do ambiente, se houver)
+        self.random_streams = getattr(env, "random_streams", None) or RandomStreams()
+
+        # perda de mensagens simulada (FaultInjector): fração descartada até ao tick lossy_until
+        self.loss_rate = 0.0
+        self.lossy_until = 0
+
+    def current_tick(self):
+        """Tick atual da simulação (env.time); 0 sem ambiente."""
+        return self.env.time if self.env is not None else 0
+
+    def new_thread_id(self, kind="cnp"):
+        """Thread ID único para uma nova conversa (sem colisões entre rondas)."""
+        if self.env is not None:
+            return self.env.new_conversation_id(f"{kind}-{self.name}")
+        return f"{kind}-{self.name}-{uuid.uuid4().hex}"
+
+    async def wait_ticks(self, n=1, poll=0.05):
+        """Espera `n` ticks do relógio da simulação (env.time)."""
+        if self.env is None:
+            await asyncio.sleep(n * SECONDS_PER_TICK)
+            return
+        target = self.env.time + n
+        while self.env.time < target:
+            await asyncio.sleep(poll)
+
+    def random_stream(self, purpose):
+        """Gerador reprodutível próprio deste agente para `purpose` (ex.: "failures")."""
+        return self.random_streams.stream(f"{self.name}/{purpose}")
+
+    def message_lost(self, msg=None):
+        """True se uma mensagem recebida deve ser descartada (perda simulada)."""
+        if self.env is None or self.env.time >= self.lossy_until:
+            return False
+        return self.random_stream("message_loss").random() < self.loss_rate
+
     async def log(self, msg: str):
         """Log message with timestamp and agent name."""
         now = datetime.datetime.now().strftime("%H:%M:%S")
@@ -1,10 +1,12 @@
 # agents/machine_cnp_agent.py
 # -*- coding: utf-8 -*-
 from agents.base_agent import FactoryAgent
+from conversations import ConversationMailbox
+from recipes import DEFAULT_STAGE_TIMES, FULL_PIPELINE, ChangeoverScheduler
+from reputation import SupplierReputation
 from spade.behaviour import CyclicBehaviour
 from spade.message import Message
-import asyncio
-import random
+from collections import OrderedDict
 
 
 class MachineCNPAgent(FactoryAgent):
@@ -15,7 +17,10 @@ class MachineCNPAgent(FactoryAgent):
       - processa jobs num pipeline de etapas (cutting, mixing, baking, packaging)
       - pode avariar aleatoriamente (falha interna)
       - pede reparação ao MaintenanceAgent
-    (Passo A: ainda sem delegação de jobs entre máquinas)
+      - delega jobs para outras máquinas por leilão (bids de carga)
+      - quando está livre, rouba jobs da fila de máquinas mais carregadas
+      - opcional (station_mode): cada capability é uma estação própria e a
+        máquina processa vários jobs em pipeline, um por estação
     """
 
     def __init__(
@@ -25,53 +30,95 @@ class MachineCNPAgent(FactoryAgent):
         env=None,
         suppliers=None,
         batch=None,
-        cfp_timeout=3,
-        inform_timeout=5,
+        cfp_timeout=15,
+        inform_timeout=25,
         name="Machine",
         maintenance=None,
         failure_rate=0.05,
         capabilities=None,
+        steal_threshold=1,
+        station_mode=False,
+        batch_policy=None,
+        late_delivery_ticks=20,
+        max_pending_deliveries=8,
+        supplier_top_k=None,
+        recipes=None,
     ):
         super().__init__(jid, password, env=env)
 
         # --- CNP / fornecimento ---
         self.suppliers = suppliers or []
         self.batch = batch or {"flour": 10, "sugar": 5, "butter": 3}
+        # prazos em ticks (env.time)
         self.cfp_timeout = cfp_timeout
         self.inform_timeout = inform_timeout
         self.agent_name = name
 
+        # reputação dos fornecedores: CFP só aos top-k prováveis vencedores (None = todos)
+        self.reputation = SupplierReputation(top_k=supplier_top_k, rng=self.random_stream("reputation"))
+
+        # respostas separadas por conversa (thread); mensagens sem ronda aberta são descartadas.
+        # TTL em ticks: cobre a ronda toda (propostas + INFORM); entregas atrasadas renovam-no
+        self.mailbox = ConversationMailbox(
+            self.current_tick, ttl=cfp_timeout + inform_timeout + 10,
+            keep_unrouted=False, drop=self.message_lost,
+        )
+
         # --- manutenção / falhas ---
         self.maintenance = maintenance or (env and getattr(env, "maintenance_agent", None))
         self.failure_rate = failure_rate
         self.is_failed = False
         self.repair_ticks_remaining = 0  # usado pelo Environment
+        # retirada de serviço: não é reparada e os jobs sem outra máquina perdem-se
+        self.retired = False
         self.is_machine = True  # usado para identificar máquinas no env
 
         # --- pipeline de produção ---
         # capacidade vêm do MAIN (ou default para todas)
         self.capabilities = capabilities or ["cutting", "mixing", "baking", "packaging"]
 
-        # full factory pipeline (universal reference)
-        full_pipeline = ["cutting", "mixing", "baking", "packaging"]
-
         # pipeline for this machine = only stages it is capable of doing
-        self.pipeline_stages = [stage for stage in full_pipeline if stage in self.capabilities]
+        self.pipeline_stages = [stage for stage in FULL_PIPELINE if stage in self.capabilities]
 
         # stage times (only for supported stages)
-        default_times = {
-            "cutting": 2,
-            "mixing": 3,
-            "baking": 4,
-            "packaging": 2,
-        }
-        self.stage_times = {stage: default_times[stage] for stage in self.pipeline_stages}
+        self.stage_times = {stage: DEFAULT_STAGE_TIMES[stage] for stage in self.pipeline_stages}
+
+        # produtos (RecipeBook opcional): receita, etapas e tempos por produto,
+        # changeover ao mudar de produto e fila agrupada por produto
+        self.recipes = recipes
+        self.scheduler = ChangeoverScheduler(recipes) if recipes is not None else None
+        self.setup_product = None  # produto para que a máquina está configurada
 
         # estado dos jobs
         self.job_queue = []                 # jobs à espera de começar
         self.current_job = None             # job atualmente em processamento
         self.current_stage_ticks_remaining = 0
 
+        # work stealing: tamanho mínimo da fila de outra máquina para roubar
+        self.steal_threshold = steal_threshold
+
+        # modo estações: etapa → {"job": job, "ticks": ticks restantes} ou None
+        # (current_job não é usado neste modo)
+        self.station_mode = station_mode
+        self.stations = {stage: None for stage in self.pipeline_stages}
+        # no modo estações cada estação tem o seu setup (setup_product não é usado)
+        self.station_setup = {stage: None for stage in self.pipeline_stages}
+
+        # tamanho adaptativo das encomendas (AdaptiveBatchPolicy); None = 1 unidade por ronda
+        self.batch_policy = batch_policy
+
+        # entregas atrasadas (INFORM não chegou no inform_timeout):
+        # thread_id → {"supplier", "units", "round_start", "deadline", "queried"}
+        # ao fim de late_delivery_ticks pergunta ao fornecedor (QUERY-REF) uma vez e depois desiste
+        self.late_delivery_ticks = late_delivery_ticks
+        self.max_pending_deliveries = max_pending_deliveries
+        self.pending_deliveries = OrderedDict()
+
+        # produção por encomenda (env.backlog): thread_id → (order_id, unidades reclamadas)
+        self.claims = {}
+        # produto pedido em cada ronda CNP em curso (com recipes)
+        self.round_products = {}
+
     # ------------------------------------------------------------------
     # SPADE setup
     # ------------------------------------------------------------------
@@ -89,22 +136,111 @@ class MachineCNPAgent(FactoryAgent):
     # ------------------------------------------------------------------
     # Gestão de Jobs / Pipeline
     # ------------------------------------------------------------------
-    def create_job_after_delivery(self):
+    def create_job_after_delivery(self, thread_id=None, units=1):
         """
-        Cria um novo job com ID global vindo do ambiente.
+        Cria job(s) com ID global vindo do ambiente para as `units` entregues.
+        Com batch_policy, as unidades podem ser divididas em vários jobs
+        (se houver máquinas livres) ou ficar num só job maior.
+        A conversa CNP (thread_id) que originou a entrega fica associada aos jobs no tracer.
         """
-        new_id = self.env.get_new_job_id()
+        if self.batch_policy is not None:
+            sizes = self.batch_policy.split(units, self.idle_peers())
+        else:
+            sizes = [units]
+        claim = self.claims.pop(thread_id, None)
+        product = self.round_products.pop(thread_id, None)
+        bill = self.recipes.product(product).ingredients if product and self.recipes else self.batch
+
+        jobs = []
+        for i, size in enumerate(sizes):
+            new_id = self.env.get_new_job_id()
+
+            job = {
+                "id": new_id,
+                "pipeline": self.job_pipeline(product),
+                "current_stage_idx": 0,
+                "batch": {k: v * size for k, v in bill.items()},
+                "units": size,
+                "order": claim[0] if claim else None,
+                "product": product,
+            }
 
-        job = {
-            "id": new_id,
-            "pipeline": list(self.pipeline_stages),
-            "current_stage_idx": 0,
-            "batch": self.batch.copy(),
-        }
+            self.job_queue.append(job)
+            jobs.append(job)
 
-        self.job_queue.append(job)
-        return job
+            keep = i < len(sizes) - 1
+            self.env.tracer.bind(
+                thread_id, new_id, self.env.time, keep=keep, units=size, pipeline=job["pipeline"]
+            )
+            self.env.tracer.job_event(new_id, "queued", self.env.time)
+        self.env.activate_machine(self)
+        return jobs
+
+    def job_pipeline(self, product=None):
+        """Etapas que esta máquina faz para o produto (todas as suas, sem recipes)."""
+        if self.recipes is None or product is None:
+            return list(self.pipeline_stages)
+        return self.recipes.pipeline(product, self.capabilities)
+
+    def can_produce(self, product):
+        """True se a máquina faz alguma etapa do produto (produto sem receita → False)."""
+        if self.recipes is not None and product is not None and product not in self.recipes.products:
+            return False
+        return bool(self.job_pipeline(product))
+
+    def setup_of(self, stage):
+        """Produto para que está configurada a estação da etapa (a máquina, fora do modo estações)."""
+        if self.station_mode:
+            return self.station_setup.get(stage)
+        return self.setup_product
+
+    def stage_time(self, stage, product=None):
+        """Ticks por unidade de uma etapa (tempos do produto, se houver recipes)."""
+        if self.recipes is None or product is None:
+            return self.stage_times.get(stage, 0)
+        return self.recipes.stage_time(product, self.agent_name, stage)
+
+    def stage_ticks(self, stage, units=1, product=None):
+        """Duração de uma etapa para um job de `units` unidades."""
+        return self.stage_time(stage, product) * units
+
+    def next_product(self):
+        """Produto a pedir na próxima ronda CNP (None sem recipes)."""
+        if self.recipes is None:
+            return None
+        return self.recipes.choose(self.capabilities, rng=self.random_stream("products"))
+
+    def idle_peers(self):
+        """Outras máquinas saudáveis, sem trabalho, capazes da nossa primeira etapa."""
+        first = self.pipeline_stages[0]
+        return sum(
+            1 for other in self.env.agents
+            if other is not self
+            and getattr(other, "is_machine", False)
+            and not other.is_failed
+            and not other.has_work()
+            and other.can_handle(first)
+        )
+
+
+    async def on_tick(self):
+        """
+        Chamado pelo Environment em cada tick (o único relógio) enquanto a
+        máquina tem jobs: progresso da etapa atual (ou das estações) e
+        início do próximo job da fila. As falhas aleatórias (failure_rate)
+        são agendadas pelo ambiente.
+        """
+        if self.is_failed or self.env is None:
+            return
+
+        if self.station_mode:
+            await self.process_stations_tick()
+            return
 
+        if self.current_job is not None:
+            await self.process_current_job_tick()
+        if self.current_job is None:
+            await self.maybe_start_next_job()
 
     async def process_current_job_tick(self):
         """
@@ -130,304 +266,755 @@ class MachineCNPAgent(FactoryAgent):
             if job["current_stage_idx"] < len(job["pipeline"]) - 1:
                 job["current_stage_idx"] += 1
                 next_stage = job["pipeline"][job["current_stage_idx"]]
-                self.current_stage_ticks_remaining = self.stage_times[next_stage]
+                self.current_stage_ticks_remaining = self.stage_ticks(
+                    next_stage, job.get("units", 1), job.get("product")
+                )
+                if self.env is not None:
+                    self.env.tracer.stage_end(job["id"], self.env.time)
+                    self.env.tracer.stage_start(job["id"], next_stage, self.agent_name, self.env.time)
                 await self.log(f"[JOB] Job {job['id']} entrou na etapa {next_stage}")
             else:
                 # job concluído
                 await self.log(f"[JOB] Job {job['id']} concluído!")
-                if self.env is not None:
-                    self.env.metrics["jobs_completed"] += 1
+                self.record_completion(job)
                 self.current_job = None
                 self.current_stage_ticks_remaining = 0
 
-        await asyncio.sleep(1)
+    def record_completion(self, job):
+        """Métricas, tracer e encomenda (se houver) de um job concluído."""
+        if self.env is None:
+            return
+        self.env.metrics["jobs_completed"] += 1
+        self.env.metrics["units_completed"] += job.get("units", 1)
+        self.env.tracer.stage_end(job["id"], self.env.time)
+        if self.batch_policy is not None:
+            # ticks por unidade que o job passou nesta máquina (mesmo relógio da latência)
+            trace = self.env.tracer.jobs.get(job["id"], {})
+            ticks = sum(
+                s["end"] - s["start"] for s in trace.get("stages", [])
+                if s["machine"] == self.agent_name and s["end"] is not None
+            )
+            if ticks > 0:
+                self.batch_policy.observe_work(ticks / job.get("units", 1))
+        self.env.tracer.job_event(job["id"], "completed", self.env.time)
+        if job.get("order") is not None and self.env.backlog is not None:
+            self.env.backlog.complete(job["order"], job.get("units", 1), self.env.time)
+
+    def start_job(self, job, stage, ticks):
+        """Coloca o job em execução (job atual ou estação da etapa)."""
+        if self.recipes is not None:
+            # mudança de produto: a máquina tem de ser reconfigurada antes da etapa
+            product = job.get("product")
+            changeover = self.recipes.changeover(self.setup_of(stage), product)
+            if changeover and self.env is not None:
+                self.env.metrics["changeovers"] += 1
+                self.env.metrics["changeover_ticks"] += changeover
+            ticks += changeover
+            if product is not None:
+                if self.station_mode:
+                    self.station_setup[stage] = product
+                else:
+                    self.setup_product = product
+        if self.station_mode:
+            self.stations[stage] = {"job": job, "ticks": ticks}
+        else:
+            self.current_job = job
+            self.current_stage_ticks_remaining = ticks
+        if self.env is not None:
+            self.env.tracer.stage_start(job["id"], stage, self.agent_name, self.env.time)
+
+    def pop_startable_job(self):
+        """
+        Tira da fila o próximo job se a sua etapa puder começar já:
+        o primeiro (FIFO) ou, com recipes, o escolhido pelo ChangeoverScheduler.
+        """
+        if not self.job_queue:
+            return None
+
+        def can_start(job):
+            return self.can_start_job(job["pipeline"][job["current_stage_idx"]])
+
+        if self.scheduler is not None:
+            idx = self.scheduler.select(
+                self.job_queue, lambda job: self.setup_of(job["pipeline"][job["current_stage_idx"]]), can_start
+            )
+        else:
+            idx = 0 if can_start(self.job_queue[0]) else None
+        if idx is None:
+            return None
+
+        job = self.job_queue.pop(idx)
+        stage = job["pipeline"][job["current_stage_idx"]]
+        ticks = job.pop("stage_ticks_remaining", None)
+        self.start_job(job, stage, ticks or self.stage_ticks(stage, job.get("units", 1), job.get("product")))
+        return job
 
     async def maybe_start_next_job(self):
         """
         Se não houver job em execução mas existir job em fila,
-        começa o próximo job na primeira etapa do pipeline.
-        """
-        if self.current_job is None and self.job_queue:
-            self.current_job = self.job_queue.pop(0)
-            stage = self.current_job["pipeline"][0]
-            self.current_stage_ticks_remaining = self.stage_times[stage]
-            await self.log(f"[JOB] Início do job {self.current_job['id']} etapa={stage}")
-            await asyncio.sleep(1)
-            return True
-        return False
-
-    async def try_delegate_current_job(self):
+        começa o próximo job na etapa em que ficou (jobs delegados
+        podem chegar a meio do pipeline).
         """
-        Tenta passar o job atual para outra máquina compatível.
+        job = self.pop_startable_job()
+        if job is None:
+            return False
+        stage = job["pipeline"][job["current_stage_idx"]]
+        await self.log(f"[JOB] Início do job {job['id']} etapa={stage}")
+        return True
 
-        Critérios:
-        - outra máquina: is_machine == True
-        - não está falhada
-        - está livre (current_job is None)
-        - tem capability para a etapa atual
+    async def process_stations_tick(self):
         """
-        if self.current_job is None:
-            return
+        Modo estações: avança um tick em todas as estações ocupadas.
+        As estações são percorridas de jusante para montante, para que um
+        job possa passar para a estação seguinte assim que esta fica livre.
+        Um job que acabou a etapa e tem a estação seguinte ocupada fica
+        bloqueado onde está. No fim, entram jobs da fila nas estações livres.
+        """
+        for stage in reversed(self.pipeline_stages):
+            slot = self.stations[stage]
+            if slot is None:
+                continue
 
-        job = self.current_job
-        stage_idx = job["current_stage_idx"]
-        stage = job["pipeline"][stage_idx]
+            if slot["ticks"] > 0:
+                slot["ticks"] -= 1
+            if slot["ticks"] > 0:
+                continue
+
+            job = slot["job"]
+            if job["current_stage_idx"] < len(job["pipeline"]) - 1:
+                next_stage = job["pipeline"][job["current_stage_idx"] + 1]
+                if self.stations[next_stage] is not None:
+                    continue  # bloqueado: estação seguinte ocupada
+                self.stations[stage] = None
+                job["current_stage_idx"] += 1
+                if self.env is not None:
+                    self.env.tracer.stage_end(job["id"], self.env.time)
+                self.start_job(
+                    job, next_stage, self.stage_ticks(next_stage, job.get("units", 1), job.get("product"))
+                )
+                await self.log(f"[STATION] Job {job['id']} passou para a estação {next_stage}")
+            else:
+                self.stations[stage] = None
+                await self.log(f"[STATION] Job {job['id']} concluído!")
+                self.record_completion(job)
+
+        # alimentar estações livres a partir da fila (ordem FIFO)
+        while True:
+            job = self.pop_startable_job()
+            if job is None:
+                break
+            stage = job["pipeline"][job["current_stage_idx"]]
+            await self.log(f"[STATION] Início do job {job['id']} na estação {stage}")
 
-        # Procurar outra máquina candidata
+    # ------------------------------------------------------------------
+    # Delegação por leilão (bids entre máquinas)
+    # ------------------------------------------------------------------
+    def job_remaining_ticks(self, job):
+        """Ticks que faltam a um job em fila para terminar nesta máquina."""
+        idx = job["current_stage_idx"]
+        stage = job["pipeline"][idx]
+        units = job.get("units", 1)
+        product = job.get("product")
+        total = job.get("stage_ticks_remaining") or self.stage_ticks(stage, units, product)
+        for next_stage in job["pipeline"][idx + 1:]:
+            total += self.stage_ticks(next_stage, units, product)
+        return total
+
+    def running_jobs(self):
+        """Lista de (job, ticks restantes na etapa) dos jobs em execução."""
+        if self.station_mode:
+            return [(s["job"], s["ticks"]) for s in self.stations.values() if s is not None]
+        if self.current_job is None:
+            return []
+        return [(self.current_job, self.current_stage_ticks_remaining)]
+
+    def running_backlog_ticks(self):
+        """Ticks até os jobs em execução terminarem."""
+        remaining = []
+        for job, ticks in self.running_jobs():
+            total = ticks
+            for stage in job["pipeline"][job["current_stage_idx"] + 1:]:
+                total += self.stage_ticks(stage, job.get("units", 1), job.get("product"))
+            remaining.append(total)
+        # em modo estações os jobs avançam em paralelo
+        return max(remaining, default=0) if self.station_mode else sum(remaining)
+
+    def queued_job_cost(self, job):
+        """Quanto um job em fila atrasa os que vêm atrás dele."""
+        if self.station_mode:
+            # em pipeline, cada job ocupa a estação mais lenta (bottleneck)
+            return max(self.stage_times.values()) * job.get("units", 1)
+        return self.job_remaining_ticks(job)
+
+    def estimated_backlog_ticks(self):
+        """Trabalho pendente (jobs em execução + fila), em ticks."""
+        return self.running_backlog_ticks() + sum(self.queued_job_cost(j) for j in self.job_queue)
+
+    def can_start_job(self, stage):
+        """True se um job na etapa `stage` pode começar já."""
+        if self.station_mode:
+            return self.stations.get(stage, True) is None
+        return self.current_job is None
+
+    def delegation_bid(self, stage, units=1, product=None):
+        """
+        Bid para receber um job de `units` unidades que está na etapa `stage`.
+        Valor = ticks estimados até o job terminar aqui
+        (fila + job atual + etapas restantes no nosso pipeline).
+        Devolve None se a máquina não pode aceitar o job.
+        """
+        if self.is_failed or not self.can_handle(stage):
+            return None
+        pipeline = self.job_pipeline(product)
+        if stage not in pipeline:
+            return None
+
+        idx = pipeline.index(stage)
+        own_work = sum(self.stage_ticks(s, units, product) for s in pipeline[idx:])
+        if self.recipes is not None:
+            # no modo estações o job muda de setup em cada estação por onde passa
+            stages = pipeline[idx:] if self.station_mode else [stage]
+            own_work += sum(self.recipes.changeover(self.setup_of(s), product) for s in stages)
+        return self.estimated_backlog_ticks() + own_work
+
+    def run_delegation_auction(self, stage, units=1, product=None):
+        """
+        Ronda de bids entre as outras máquinas.
+        Devolve (máquina vencedora, bid) ou (None, None).
+        """
+        bids = []
         for other in self.env.agents:
             if other is self:
                 continue
             if not getattr(other, "is_machine", False):
                 continue
-            if getattr(other, "is_failed", False):
-                continue
-            if not other.can_handle(stage):
-                continue
-            if getattr(other, "current_job", None) is not None:
-                continue  # já ocupada
+            bid = other.delegation_bid(stage, units, product)
+            if bid is not None:
+                bids.append((bid, other.agent_name, other))
 
-            # pipeline da máquina de destino
-            dest_pipeline = other.pipeline_stages
+        if not bids:
+            return None, None
 
-            # etapa atual do job
-            current_stage = job["pipeline"][stage_idx]
+        bid, _, winner = min(bids, key=lambda b: (b[0], b[1]))
+        return winner, bid
 
-            # garantir que a etapa atual existe no pipeline do destinatário
-            if current_stage not in dest_pipeline:
-                # segurança máxima — nunca deveria acontecer por causa de can_handle(),
-                # mas deixamos para garantir solidez
-                continue
+    def accept_delegated_job(self, job, stage, ticks_remaining=None):
+        """
+        Recebe um job delegado, adaptado ao nosso pipeline.
+        Se estivermos livres começa já; caso contrário vai para a fila.
+        Devolve True se o job começou logo.
+        """
+        pipeline = self.job_pipeline(job.get("product"))
+        dest_stage_idx = pipeline.index(stage)
+        new_job = {
+            **job,
+            "pipeline": pipeline,
+            "current_stage_idx": dest_stage_idx,
+            "batch": job["batch"].copy(),
+        }
+        new_job.pop("stage_ticks_remaining", None)
+        self.env.activate_machine(self)
+        if ticks_remaining and ticks_remaining > 0:
+            ticks = ticks_remaining
+        else:
+            ticks = self.stage_ticks(stage, job.get("units", 1), job.get("product"))
+
+        if self.can_start_job(stage):
+            self.start_job(new_job, stage, ticks)
+            return True
 
-            # índice da etapa atual no pipeline do destinatário
-            dest_stage_idx = dest_pipeline.index(current_stage)
+        new_job["stage_ticks_remaining"] = ticks
+        self.job_queue.append(new_job)
+        self.env.tracer.job_event(new_job["id"], "queued", self.env.time)
+        return False
 
-            # criar job adaptado ao pipeline da máquina destino
-            new_job = {
-                "id": job["id"],
-                "pipeline": list(dest_pipeline),
-                "current_stage_idx": dest_stage_idx,
-                "batch": job["batch"].copy(),
-            }
+    def trace_hop(self, job_id, dest, interrupted=False):
+        """Regista no tracer a saída de um job desta máquina para `dest`."""
+        if interrupted:
+            self.env.tracer.stage_end(job_id, self.env.time, interrupted=True)
+        self.env.tracer.hop(job_id, self.agent_name, dest.agent_name, self.env.time)
 
-            other.current_job = new_job
+    async def try_delegate_current_job(self):
+        """
+        Leiloa o(s) job(s) em execução entre as outras máquinas compatíveis
+        (em modo estações, um leilão por estação ocupada).
+
+        Cada máquina saudável com capability para a etapa atual licita
+        com o tempo estimado até concluir o job (ver delegation_bid).
+        O vencedor aceita o job mesmo que esteja ocupado (vai para a fila).
+        Se nenhuma máquina puder licitar, o job volta à cabeça da nossa fila
+        (com os ticks que faltam) à espera da reparação; só se perde se a
+        máquina estiver retirada de serviço.
+        """
+        running = self.running_jobs()
 
-            # transferir também o tempo restante da etapa
-            if getattr(self, "current_stage_ticks_remaining", 0) > 0:
-                other.current_stage_ticks_remaining = self.current_stage_ticks_remaining
-            else:
-                # fallback: tempo normal da etapa nessa máquina
-                other.current_stage_ticks_remaining = other.stage_times[stage]
+        # limpar os jobs desta máquina
+        self.current_job = None
+        self.current_stage_ticks_remaining = 0
+        self.stations = {stage: None for stage in self.pipeline_stages}
+
+        kept = []
+        for job, ticks in running:
+            if ticks <= 0:
+                # etapa já concluída (job bloqueado à espera da estação seguinte):
+                # não se repete; leiloa-se a etapa seguinte (ou o job termina)
+                self.env.tracer.stage_end(job["id"], self.env.time)
+                if job["current_stage_idx"] >= len(job["pipeline"]) - 1:
+                    self.record_completion(job)
+                    continue
+                job["current_stage_idx"] += 1
+                ticks = None
+            if not await self._delegate_running_job(job, ticks):
+                kept.append(job)
 
-            # limpar o job desta máquina
-            self.current_job = None
-            self.current_stage_ticks_remaining = 0
+        # sem outra máquina capaz: retomam aqui depois da reparação, à frente da fila
+        self.job_queue = kept + self.job_queue
 
-            # garantir que não existe cópia deste job na queue
-            self.job_queue = [j for j in self.job_queue if j["id"] != job["id"]]
+    async def lose_job(self, job):
+        """Job perdido (máquina retirada, sem outra que o faça): a encomenda volta ao backlog."""
+        self.env.metrics["jobs_lost"] += 1
+        self.env.tracer.job_event(job["id"], "lost", self.env.time)
+        if job.get("order") is not None and self.env.backlog is not None:
+            # materiais perdidos: é preciso repetir
+            self.env.backlog.release(job["order"], job.get("units", 1))
+        await self.log(f"[DELEGATE] Nenhuma máquina pode assumir o job {job['id']}. Job perdido.")
+
+    async def _delegate_running_job(self, job, ticks):
+        """Leiloa um job em execução. Devolve False se ficou nesta máquina (à espera da reparação)."""
+        stage = job["pipeline"][job["current_stage_idx"]]
 
-            # métricas e logs
-            self.env.metrics["jobs_delegated"] += 1
+        winner, bid = self.run_delegation_auction(stage, job.get("units", 1), job.get("product"))
+
+        if winner is None:
+            if ticks is not None:
+                self.env.tracer.stage_end(job["id"], self.env.time, interrupted=True)
+            if self.retired:
+                await self.lose_job(job)
+                return True
+            if ticks and ticks > 0:
+                job["stage_ticks_remaining"] = ticks
+            self.env.tracer.job_event(job["id"], "queued", self.env.time)
             await self.log(
-                f"[DELEGATE] Job {job['id']} (etapa={stage}) delegado para {other.agent_name}."
-            )
-            await other.log(
-                f"[DELEGATE] Recebi job {job['id']} da máquina {self.agent_name}, retomando etapa {stage}."
+                f"[DELEGATE] Nenhuma máquina disponível para o job {job['id']} na etapa {stage}: "
+                f"fica em fila até à reparação."
             )
-            return
+            return False
 
-        # Se não encontrámos nenhuma máquina candidata: job perdido
-        self.env.metrics["jobs_lost"] += 1
+        self.trace_hop(job["id"], winner, interrupted=True)
+        started = winner.accept_delegated_job(job, stage, ticks_remaining=ticks)
+
+        # garantir que não existe cópia deste job na queue
+        self.job_queue = [j for j in self.job_queue if j["id"] != job["id"]]
+
+        # métricas e logs
+        self.env.metrics["jobs_delegated"] += 1
+        where = "em execução" if started else "em fila"
         await self.log(
-            f"[DELEGATE] Nenhuma máquina disponível para assumir job {job['id']} na etapa {stage}. Job perdido."
+            f"[DELEGATE] Job {job['id']} (etapa={stage}) delegado para {winner.agent_name} "
+            f"(bid={bid}, {where})."
         )
-        self.current_job = None
-        self.current_stage_ticks_remaining = 0
+        await winner.log(
+            f"[DELEGATE] Recebi job {job['id']} da máquina {self.agent_name}, etapa {stage} ({where})."
+        )
+        return True
 
     async def try_delegate_queued_jobs(self):
         """
-        Tenta delegar jobs que estão na fila (job_queue) para outras máquinas disponíveis.
-        Cada job é delegado apenas se:
-        - a máquina destino não está falhada
-        - está livre
-        - tem a capability da primeira etapa do pipeline
+        Leiloa os jobs em fila (job_queue) entre as outras máquinas.
+
+        - Se esta máquina está falhada, cada job vai para o melhor bid
+          (se ninguém puder licitar, fica à espera da reparação).
+        - Se está saudável, o job só sai se o bid do outro for melhor
+          do que o tempo que o job ainda esperaria aqui.
         """
         if not self.job_queue:
             return
 
         remaining_queue = []
+        # tempo que um job ainda esperaria nesta máquina (job atual + fila à frente)
+        own_wait = self.running_backlog_ticks()
 
         for job in self.job_queue:
-            stage = job["pipeline"][0]  # primeira etapa do job
-            delegated = False
+            stage = job["pipeline"][job["current_stage_idx"]]
+            own_bid = own_wait + self.queued_job_cost(job)
 
-            for other in self.env.agents:
-                if other is self:
-                    continue
-                if not getattr(other, "is_machine", False):
-                    continue
-                if getattr(other, "is_failed", False):
-                    continue
-                if getattr(other, "current_job", None) is not None:
-                    continue
-                if not other.can_handle(stage):
-                    continue
+            winner, bid = self.run_delegation_auction(stage, job.get("units", 1), job.get("product"))
+
+            if winner is None and self.retired:
+                await self.lose_job(job)
+                continue
+
+            # ninguém licita (fica na fila até à reparação) ou o nosso tempo é melhor
+            if winner is None or (not self.is_failed and bid >= own_bid):
+                remaining_queue.append(job)
+                own_wait = own_bid
+                continue
+
+            self.trace_hop(job["id"], winner)
+            started = winner.accept_delegated_job(
+                job, stage, ticks_remaining=job.get("stage_ticks_remaining")
+            )
+            where = "em execução" if started else "em fila"
+
+            await self.log(
+                f"[DELEGATE-QUEUE] Job {job['id']} delegado para {winner.agent_name} (bid={bid}, {where})."
+            )
+            await winner.log(
+                f"[DELEGATE-QUEUE] Recebi job {job['id']} da fila da máquina {self.agent_name} ({where})."
+            )
 
-                # pipeline adaptado para a máquina destino
-                dest_pipeline = other.pipeline_stages
-                dest_stage_idx = dest_pipeline.index(stage)
+            self.env.metrics["jobs_delegated"] += 1
 
-                new_job = {
-                    "id": job["id"],
-                    "pipeline": list(dest_pipeline),
-                    "current_stage_idx": dest_stage_idx,
-                    "batch": job["batch"].copy(),
-                }
+        self.job_queue = remaining_queue
 
-                other.current_job = new_job
-                other.current_stage_ticks_remaining = other.stage_times[stage]
 
-                await self.log(f"[DELEGATE-QUEUE] Job {job['id']} delegado para {other.agent_name}.")
-                await other.log(f"[DELEGATE-QUEUE] Recebi job {job['id']} da fila da máquina {self.agent_name}.")
+    async def try_steal_job(self):
+        """
+        Work stealing: uma máquina livre rouba um job compatível do fim
+        da fila da máquina mais carregada (o dono consome pelo início,
+        por isso os dois lados nunca disputam o mesmo job).
+        Só rouba se o job terminar mais cedo aqui do que lá.
+        Devolve True se roubou um job.
+        """
+        if self.is_failed or self.job_queue or not self.can_start_job(self.pipeline_stages[0]):
+            return False
 
-                self.env.metrics["jobs_delegated"] += 1
-                delegated = True
+        best = None
+        for other in self.env.agents:
+            if other is self or not getattr(other, "is_machine", False):
+                continue
+            if len(other.job_queue) < self.steal_threshold:
+                continue
+
+            # procurar a partir do fim da fila o primeiro job compatível
+            for pos in range(len(other.job_queue) - 1, -1, -1):
+                job = other.job_queue[pos]
+                stage = job["pipeline"][job["current_stage_idx"]]
+                if stage not in self.job_pipeline(job.get("product")):
+                    continue
+
+                # tempo até o job terminar na vítima (tudo o que está à frente + o próprio job)
+                victim_ticks = other.running_backlog_ticks() + sum(
+                    other.queued_job_cost(j) for j in other.job_queue[:pos + 1]
+                )
+                if other.is_failed:
+                    victim_ticks += other.repair_ticks_remaining or 1
+
+                own_ticks = self.delegation_bid(stage, job.get("units", 1), job.get("product"))
+                gain = victim_ticks - own_ticks
+                if gain > 0 and (best is None or gain > best[0]):
+                    best = (gain, other, pos, stage)
                 break
 
-            if not delegated:
-                remaining_queue.append(job)
+        if best is None:
+            return False
 
-        self.job_queue = remaining_queue
+        _, victim, pos, stage = best
+        job = victim.job_queue.pop(pos)
+        victim.trace_hop(job["id"], self)
+        self.accept_delegated_job(job, stage, ticks_remaining=job.get("stage_ticks_remaining"))
 
+        self.env.metrics["jobs_stolen"] += 1
+        await self.log(
+            f"[STEAL] {self.agent_name} roubou job {job['id']} (etapa={stage}) da fila de {victim.agent_name}."
+        )
+        return True
 
     def can_handle(self, stage):
         return stage in self.capabilities
-    
 
-    # ------------------------------------------------------------------
-    # CNP Behaviour
-    # ------------------------------------------------------------------
-    class CNPInitiator(CyclicBehaviour):
-        async def run(self):
-            agent = self.agent
+    def has_work(self):
+        """True se há job em execução, em fila, ou reparação pendente."""
+        return (
+            bool(self.running_jobs())
+            or bool(self.job_queue)
+            or self.is_failed
+            or self.repair_ticks_remaining > 0
+        )
 
-            # 0) se a máquina já está falhada, não faz nada neste tick
-            if agent.is_failed:
-                await asyncio.sleep(1)
-                return
+    def end_conversation(self, thread_id):
+        self.mailbox.close(thread_id)
+        self.pending_deliveries.pop(thread_id, None)
+        self.round_products.pop(thread_id, None)
+        claim = self.claims.pop(thread_id, None)
+        if claim is not None:
+            # ronda sem entrega: as unidades voltam ao backlog
+            self.env.backlog.release(*claim)
+        if self.env is not None:
+            self.env.termination.end(thread_id)
+
+    def defer_delivery(self, thread_id, supplier, units, round_start):
+        """Mantém a conversa aberta à espera de uma entrega atrasada."""
+        while len(self.pending_deliveries) >= self.max_pending_deliveries:
+            oldest = next(iter(self.pending_deliveries))
+            self.delivery_failed(oldest, self.pending_deliveries[oldest]["supplier"])
+
+        self.pending_deliveries[thread_id] = {
+            "supplier": supplier,
+            "units": units,
+            "round_start": round_start,
+            "deadline": self.env.time + self.late_delivery_ticks,
+            "queried": False,
+        }
+        self.mailbox.open(thread_id)  # renova o TTL da caixa
 
-            # 1) Falha aleatória
-            if random.random() < agent.failure_rate:
-                agent.is_failed = True
-                agent.env.metrics["machine_failures"] += 1
-                await agent.log(f"[FAILURE] {agent.agent_name} avariou! A tentar delegar job atual...")
+    def delivery_failed(self, thread_id, supplier):
+        self.env.metrics["deliveries_lost"] += 1
+        self.reputation.observe_delivery(supplier, False, self.env.time)
+        self.end_conversation(thread_id)
 
-                # tentar delegar o job atual para outra máquina compatível
-                await agent.try_delegate_current_job()
-                await agent.try_delegate_queued_jobs()
+    async def on_delivery(self, thread_id, reply, units, round_start, supplier):
+        """Entrega confirmada (pelo robot ou, em reenvio, pelo fornecedor): cria os jobs."""
+        await self.log(f"[DELIVERY] Recebido INFORM de {reply.sender}: {reply.body}")
 
-                # notificar manutenção
-                if agent.maintenance:
-                    await agent.maintenance.receive_failure(agent)
+        self.env.metrics["cnp_accepts"] += 1
+        self.reputation.observe_delivery(supplier, True, self.env.time)
+        if self.batch_policy is not None:
+            self.batch_policy.observe_delivery(self.env.time - round_start)
 
-                return
+        # criar job(s) após o robot entregar os materiais
+        jobs = self.create_job_after_delivery(thread_id, units=units)
+        await self.log(
+            f"[JOB] Criado(s) job(s) {[j['id'] for j in jobs]} "
+            f"({units} unidade(s)) após entrega via ROBOT."
+        )
+        self.end_conversation(thread_id)
+
+    async def poll_pending_deliveries(self, behaviour):
+        """Verifica (sem bloquear) as entregas atrasadas: INFORM, FAILURE ou prazo."""
+        for thread_id in list(self.pending_deliveries):
+            entry = self.pending_deliveries[thread_id]
+            msg = await self.mailbox.receive(behaviour, thread_id, timeout=0.05)
+            pf = msg.metadata.get("performative") if msg else None
+
+            if pf == "inform":
+                await self.on_delivery(thread_id, msg, entry["units"], entry["round_start"], entry["supplier"])
+            elif pf == "failure":
+                await self.log(f"[CNP] Entrega {thread_id} falhou ({msg.body}).")
+                self.delivery_failed(thread_id, entry["supplier"])
+            elif self.env.time >= entry["deadline"]:
+                if not entry["queried"]:
+                    q = Message(to=entry["supplier"])
+                    q.set_metadata("performative", "query-ref")
+                    q.set_metadata("protocol", "cnp")
+                    q.thread = thread_id
+                    q.body = "delivery_status"
+                    await behaviour.send(q)
+                    entry["queried"] = True
+                    entry["deadline"] = self.env.time + self.late_delivery_ticks
+                    self.mailbox.open(thread_id)
+                else:
+                    await self.log(f"[CNP] Entrega {thread_id} sem resposta → desistir.")
+                    self.delivery_failed(thread_id, entry["supplier"])
+
+    # ------------------------------------------------------------------
+    # Ronda CNP em passos (usados pelo CNPInitiator e pelo memprofile.py)
+    # ------------------------------------------------------------------
+    async def prepare_round(self, behaviour):
+        """
+        Trabalho antes de uma ronda: entregas atrasadas, delegação da fila e
+        work stealing. Devolve True se a máquina deve pedir material agora
+        (máquina, ou a primeira estação, livre e fila vazia).
+        """
+        # 1) entregas atrasadas de rondas anteriores
+        if self.pending_deliveries:
+            await self.poll_pending_deliveries(behaviour)
 
+        # 2) jobs em fila: passá-los a quem os acabe mais cedo (começam em on_tick)
+        if self.job_queue:
+            await self.try_delegate_queued_jobs()
 
-            # 2) Pipeline: se há job atual, avançar um tick
-            if agent.current_job is not None:
-                await agent.process_current_job_tick()
-                return
+        if self.job_queue or not self.can_start_job(self.pipeline_stages[0]):
+            return False
 
-            # 3) Se não há job em execução, tentar iniciar um da fila
-            if await agent.maybe_start_next_job():
-                return
-            
-            # tentar delegar jobs pendentes da fila
-            await agent.try_delegate_queued_jobs()
+        # 3) Fila vazia: roubar trabalho a uma máquina mais carregada
+        return not await self.try_steal_job()
 
-            # 4) Se não há jobs para processar, fazer ciclo de CNP normal
-            body = (
-                f"ingredients: flour={agent.batch['flour']}, "
-                f"sugar={agent.batch['sugar']}, butter={agent.batch['butter']}"
+    async def open_round(self, behaviour):
+        """
+        Abre uma ronda CNP: reserva unidades do backlog (se houver), envia o
+        CFP aos fornecedores escolhidos pela reputação e devolve o estado da
+        ronda. Devolve None se não há encomendas para esta máquina.
+        """
+        units = self.batch_policy.order_units(self) if self.batch_policy else 1
+
+        # produção por encomenda: só se compra material para unidades encomendadas
+        claim = None
+        product = self.next_product()
+        if self.env is not None and self.env.backlog is not None:
+            backlog = self.env.backlog
+            claim = backlog.claim(
+                units if self.batch_policy else None,
+                accept=lambda order: self.can_produce(order["product"]),
             )
+            if claim is None:
+                return None
+            units = claim[1]
+            product = backlog.product_of(claim[0])
+
+        bill = self.recipes.product(product).ingredients if product and self.recipes else self.batch
+        ingredients = "ingredients: " + ", ".join(f"{k}={v}" for k, v in bill.items())
+        body = ingredients + (f"; product={product}" if product else "") + f"; units={units}"
+        now = self.env.time if self.env is not None else 0
+
+        thread_id = self.new_thread_id("cnp")
+        if claim is not None:
+            self.claims[thread_id] = claim
+        if product is not None:
+            self.round_products[thread_id] = product
+        if self.env is not None:
+            # conversa em aberto até a ronda resolver (entrega, falha ou sem propostas)
+            self.env.termination.begin(thread_id, self.agent_name, self.env.time)
+            self.env.tracer.conversation_event(thread_id, "cfp_issued", self.env.time)
+        self.mailbox.open(thread_id)
+
+        targets = self.reputation.select(self.suppliers, now)
+        for supplier in targets:
+            msg = Message(to=supplier)
+            msg.set_metadata("performative", "cfp")
+            msg.set_metadata("protocol", "cnp")
+            msg.thread = thread_id
+            msg.body = body
+
+            await behaviour.send(msg)
+            await self.log(f"[{self.agent_name}] CFP enviado a {supplier}: {msg.body}")
 
-            for supplier in agent.suppliers:
-                msg = Message(to=supplier)
-                msg.set_metadata("performative", "cfp")
-                msg.set_metadata("protocol", "cnp")
-
-                if agent.env is not None:
-                    msg.thread = f"cnp-{agent.agent_name}-{agent.env.time}"
-                else:
-                    msg.thread = f"cnp-{agent.agent_name}-{random.randint(0, 9999)}"
-
-                msg.body = body
-
-                await self.send(msg)
-                await agent.log(f"[{agent.agent_name}] CFP enviado a {supplier}: {msg.body}")
-                await asyncio.sleep(0.1)
-
-            if agent.env is not None:
-                agent.env.metrics["cnp_cfp"] += 1
-
-            # recolher propostas
-            proposals = []
-            timeout = asyncio.get_event_loop().time() + agent.cfp_timeout
-
-            while asyncio.get_event_loop().time() < timeout:
-                reply = await self.receive(timeout=0.5)
-                if reply:
-                    pf = reply.metadata.get("performative")
-                    if pf == "propose":
-                        data = reply.body.split(";")
-                        lead = int(data[0].split("=")[1])
-                        cost = int(data[1].split("=")[1])
-                        proposals.append((str(reply.sender), lead, cost))
-                        await agent.log(
-                            f"[CNP] PROPOSE de {reply.sender}: lead={lead}, cost={cost}"
-                        )
-                    elif pf == "refuse":
-                        await agent.log(f"[CNP] REFUSE de {reply.sender}: {reply.body}")
-
-            if not proposals:
-                await agent.log("[CNP] Nenhuma proposta. Aguardando refill...")
-                await asyncio.sleep(random.uniform(5, 8))
-                return
+        if self.env is not None:
+            self.env.metrics["cnp_cfp"] += 1
+            self.env.metrics["cfp_messages"] += len(targets)
+
+        return {
+            "thread": thread_id,
+            "targets": targets,
+            "claim": claim,
+            "ingredients": ingredients,
+            "start": now,
+            "proposals": [],
+            "replied": set(),
+            "winner": None,
+        }
 
-            # escolher vencedor (custo mínimo)
-            winner = min(proposals, key=lambda p: p[2])
-            losers = [p for p in proposals if p != winner]
+    async def receive_proposals(self, behaviour, rnd, timeout):
+        """
+        Lê as respostas ao CFP já chegadas (só as desta ronda).
+        Devolve True quando todos os fornecedores responderam.
+        """
+        while len(rnd["replied"]) < len(rnd["targets"]):
+            reply = await self.mailbox.receive(behaviour, rnd["thread"], timeout=timeout)
+            if reply is None:
+                return False
+            sender = str(reply.sender).split("/")[0]  # JID sem resource
+            rnd["replied"].add(sender)
+            pf = reply.metadata.get("performative")
+            if pf == "propose":
+                data = dict(kv.strip().split("=") for kv in reply.body.split(";") if "=" in kv)
+                lead = int(data["lead_time"])
+                cost = int(data["cost"])
+                offered = int(data.get("units", 1))
+                rnd["proposals"].append((sender, lead, cost, offered))
+                self.reputation.observe_proposal(sender, cost / offered, lead, rnd["start"])
+                await self.log(f"[CNP] PROPOSE de {reply.sender}: lead={lead}, cost={cost}, units={offered}")
+            elif pf == "refuse":
+                self.reputation.observe_refusal(sender, rnd["start"])
+                await self.log(f"[CNP] REFUSE de {reply.sender}: {reply.body}")
+        return True
+
+    async def award_round(self, behaviour, rnd):
+        """
+        Fecha a recolha de propostas: aceita a de menor custo por unidade e
+        rejeita as restantes. Devolve False (conversa terminada) sem propostas.
+        """
+        thread_id = rnd["thread"]
+
+        # quem não respondeu a tempo conta como recusa
+        for supplier in rnd["targets"]:
+            if supplier not in rnd["replied"]:
+                self.reputation.observe_refusal(supplier, rnd["start"])
+
+        if not rnd["proposals"]:
+            self.end_conversation(thread_id)
+            await self.log("[CNP] Nenhuma proposta. Aguardando refill...")
+            return False
+
+        winner = min(rnd["proposals"], key=lambda p: p[2] / p[3])
+        await self.log(f"[CNP] VENCEDOR: {winner[0]} cost={winner[2]} units={winner[3]}")
+
+        claim = rnd["claim"]
+        if claim is not None and winner[3] < claim[1]:
+            # o fornecedor só serve parte: o resto volta ao backlog
+            self.env.backlog.release(claim[0], claim[1] - winner[3])
+            self.claims[thread_id] = (claim[0], winner[3])
+
+        for s, _, _, _ in rnd["proposals"]:
+            msg = Message(to=s)
+            msg.set_metadata("performative", "accept-proposal" if s == winner[0] else "reject-proposal")
+            msg.set_metadata("protocol", "cnp")
+            msg.thread = thread_id
+            msg.body = f"accepted; {rnd['ingredients']}; units={winner[3]}" if s == winner[0] else "rejected"
+            await behaviour.send(msg)
+        if self.env is not None:
+            self.env.tracer.conversation_event(thread_id, "proposal_accepted", self.env.time)
+        rnd["winner"] = winner
+        return True
+
+    async def receive_delivery(self, behaviour, rnd, timeout):
+        """INFORM/FAILURE da entrega já chegado (None se ainda não); PROPOSE/REFUSE atrasados são ignorados."""
+        while True:
+            msg = await self.mailbox.receive(behaviour, rnd["thread"], timeout=timeout)
+            if msg is None or msg.metadata.get("performative") in ("inform", "failure"):
+                return msg
+
+    async def close_round(self, rnd, reply):
+        """Fim da ronda: jobs com a entrega, falha, ou entrega pendente sem resposta."""
+        thread_id, winner = rnd["thread"], rnd["winner"]
+        if reply is not None and reply.metadata.get("performative") == "inform":
+            await self.on_delivery(thread_id, reply, winner[3], rnd["start"], winner[0])
+        elif reply is not None:
+            await self.log(f"[CNP] Entrega falhou ({reply.body}).")
+            self.delivery_failed(thread_id, winner[0])
+        else:
+            # a entrega pode ainda chegar: não perder a conversa
+            await self.log("[CNP] Timeout à espera de INFORM → entrega pendente.")
+            self.defer_delivery(thread_id, winner[0], winner[3], rnd["start"])
 
-            await agent.log(f"[CNP] VENCEDOR: {winner[0]} cost={winner[2]}")
+    # ------------------------------------------------------------------
+    # CNP Behaviour
+    # ------------------------------------------------------------------
+    class CNPInitiator(CyclicBehaviour):
+        async def run(self):
+            agent = self.agent
 
-            # rejeitar restantes
-            for s, _, _ in losers:
-                rej = Message(to=s)
-                rej.set_metadata("performative", "reject-proposal")
-                rej.set_metadata("protocol", "cnp")
-                rej.body = "rejected"
-                await self.send(rej)
+            # 0) se a máquina já está falhada, não faz nada neste tick
+            #    (falhas aleatórias e produção avançam no relógio do ambiente)
+            if agent.is_failed:
+                await agent.wait_ticks(1)
+                return
 
-            # aceitar vencedor
-            acc = Message(to=winner[0])
-            acc.set_metadata("performative", "accept-proposal")
-            acc.set_metadata("protocol", "cnp")
-            acc.body = "accepted"
-            await self.send(acc)
+            # 1-3) entregas atrasadas, delegação da fila, work stealing
+            if not await agent.prepare_round(self):
+                await agent.wait_ticks(1)
+                return
 
-            # esperar INFORM (entrega)
-            reply = await self.receive(timeout=agent.inform_timeout)
+            # 4) Se não há jobs para processar, fazer ciclo de CNP normal
+            rnd = await agent.open_round(self)
+            if rnd is None:
+                await agent.wait_ticks(1)
+                return
 
-            if reply and reply.metadata.get("performative") == "inform":
-                await agent.log(f"[DELIVERY] Recebido INFORM de {reply.sender}: {reply.body}")
+            # recolher propostas (termina cedo se todos responderem)
+            deadline = agent.env.time + agent.cfp_timeout
+            while agent.env.time < deadline and not await agent.receive_proposals(self, rnd, timeout=0.5):
+                pass
 
-                if agent.env is not None:
-                    agent.env.metrics["cnp_accepts"] += 1
+            if not await agent.award_round(self, rnd):
+                await agent.wait_ticks(agent.random_stream("backoff").randint(5, 8))
+                return
 
-                # criar job após o robot entregar os materiais
-                job = agent.create_job_after_delivery()
-                await agent.log(f"[JOB] Criado job {job['id']} após entrega via ROBOT.")
+            # esperar INFORM (entrega) nesta conversa
+            reply = None
+            deadline = agent.env.time + agent.inform_timeout
+            while reply is None and agent.env.time < deadline:
+                reply = await agent.receive_delivery(self, rnd, timeout=0.5)
 
-            else:
-                await agent.log("[CNP] Timeout à espera de INFORM (robot não entregou a tempo).")
-                
-            await asyncio.sleep(random.uniform(3, 6))
+            await agent.close_round(rnd, reply)
+            await agent.wait_ticks(agent.random_stream("backoff").randint(3, 6))
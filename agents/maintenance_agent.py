@@ -1,13 +1,11 @@
 # agents/maintenance_agent.py
-import asyncio
-from spade.behaviour import CyclicBehaviour
 from agents.base_agent import FactoryAgent
-import random
 
 class MaintenanceAgent(FactoryAgent):
     """
     Recebe falhas e agenda reparações.
-    Não conclui reparações — isso é feito pelo Environment.
+    Inicia uma reparação por tick (on_tick, chamado pelo Environment);
+    não conclui reparações — isso é feito pelo Environment.
     """
 
     def __init__(self, jid, password, env):
@@ -16,6 +14,11 @@ class MaintenanceAgent(FactoryAgent):
 
     async def receive_failure(self, machine):
         """Chamado quando uma máquina falha."""
+        # máquina retirada de serviço: não é reparada
+        if getattr(machine, "retired", False):
+            await self.log(f"[MAINTENANCE] {machine.agent_name} retirada de serviço. Sem reparação.")
+            return
+
         # se já está em reparação → ignora duplicado
         if getattr(machine, "repair_ticks_remaining", 0) > 0:
             await self.log(
@@ -24,6 +27,7 @@ class MaintenanceAgent(FactoryAgent):
             return
 
         # se já está falhada e não reparada, ok
+        # (o ambiente já a está a visitar: fail_machine chamou watch_machine)
         machine.is_failed = True
 
         await self.log(f"[MAINTENANCE] Falha recebida de {machine.agent_name}.")
@@ -32,27 +36,25 @@ class MaintenanceAgent(FactoryAgent):
 
 
 
-    class RepairHandler(CyclicBehaviour):
-        async def run(self):
-            # Se há reparações por iniciar
-            if self.agent.repair_queue:
-                machine = self.agent.repair_queue.pop(0)
-
-                # Escolher tempo de reparação
-                repair_time = random.randint(3, 8)
-                machine.repair_ticks_remaining = repair_time
-                machine.is_failed = True  # garantir estado consistente
+    async def on_tick(self):
+        """Chamado pelo Environment em cada tick: inicia a próxima reparação."""
+        # Se há reparações por iniciar
+        if self.repair_queue:
+            machine = self.repair_queue.pop(0)
 
+            # Escolher tempo de reparação
+            # um stream por máquina: não depende da ordem das avarias
+            repair_time = self.random_stream(f"repairs/{machine.agent_name}").randint(3, 8)
+            machine.repair_ticks_remaining = repair_time
+            machine.is_failed = True  # garantir estado consistente
 
-                await self.agent.log(
-                    f"[MAINTENANCE] Reparação iniciada para {machine.agent_name} "
-                    f"({repair_time} ticks)."
-                )
 
-            await asyncio.sleep(1)
+            await self.log(
+                f"[MAINTENANCE] Reparação iniciada para {machine.agent_name} "
+                f"({repair_time} ticks)."
+            )
 
     async def setup(self):
         self.env.set_maintenance_agent(self)
         await self.log("MaintenanceAgent ativo e pronto.")
-        self.add_behaviour(self.RepairHandler())
 
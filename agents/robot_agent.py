@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from agents.base_agent import FactoryAgent
+from agents.base_agent import FactoryAgent, NO_MESSAGES
 from spade.behaviour import CyclicBehaviour
 from spade.message import Message
 
 import asyncio
 import json
 import ast
-import random
 
 
 class RobotAgent(FactoryAgent):
@@ -15,9 +14,17 @@ class RobotAgent(FactoryAgent):
     Agente de transporte (robot/worker).
 
     - Recebe CFPs dos fornecedores para tarefas de entrega de materiais.
-    - Responde com PROPOSE (custo) ou REFUSE (se estiver ocupado).
-    - Quando recebe ACCEPT-PROPOSAL, simula o transporte e,
-      no fim, envia um INFORM de 'transport_done' de volta ao fornecedor.
+    - Responde com PROPOSE (custo = distância real no layout, a partir do
+      fim do percurso da rota por vizinho mais próximo) ou REFUSE (se a
+      rota estiver cheia).
+    - A proposta inclui o ETA (ticks até a entrega estar feita, depois do
+      resto da rota), que o fornecedor usa como prazo do transporte.
+    - CANCEL do fornecedor (transporte re-leiloado ou já entregue por outro
+      robot) retira a tarefa da rota se ainda não tiver começado.
+    - Quando recebe ACCEPT-PROPOSAL, junta a tarefa à rota; as entregas são
+      encadeadas por vizinho mais próximo e, no fim de cada uma, confirma a
+      entrega diretamente à máquina (INFORM 'delivered_materials' na conversa
+      CNP da máquina) e envia ao fornecedor um INFORM 'transport_done' (ack).
 
     Importante: agora o robot propaga SEMPRE o metadata 'thread'
     (quando existir no pedido), para que o Supplier consiga
@@ -32,6 +39,8 @@ class RobotAgent(FactoryAgent):
         name="Robot",
         max_load=100,
         speed=1.0,
+        location=None,
+        max_route=3,
     ):
         super().__init__(jid, password, env=env)
         self.agent_name = name
@@ -43,9 +52,21 @@ class RobotAgent(FactoryAgent):
         self.busy = False
         self.current_task = None
 
+        # posição atual no layout (JID do último local visitado)
+        self.location = location or str(jid)
+        # entregas aceites e ainda por fazer
+        self.route = []
+        self.max_route = max_route
+
+        # fora de serviço até este tick (FaultInjector: robot_outage)
+        self.out_of_service_until = 0
+
     async def setup(self):
+        if self.env is not None:
+            self.env.register_agent(self)
         await self.log(f"[ROBOT] {self.agent_name} pronto para receber tarefas.")
         self.add_behaviour(self.TransportManagerBehaviour())
+        self.add_behaviour(self.DeliveryBehaviour(), template=NO_MESSAGES)
 
     # ------------------------- Helpers -------------------------
 
@@ -60,9 +81,93 @@ class RobotAgent(FactoryAgent):
         except Exception:
             return None
 
+    # ------------------------- Rotas -------------------------
+
+    def _task_stops(self, task):
+        """Locais de recolha e entrega de uma tarefa."""
+        return task.get("pickup") or task.get("from_supplier"), task.get("to_machine")
+
+    def _nearest_index(self, position, tasks):
+        """Índice da tarefa com a recolha mais perto de `position` (vizinho mais próximo)."""
+        pickups = [self._task_stops(t)[0] for t in tasks]
+        return pickups.index(self.env.layout.nearest(position, pickups))
+
+    def planned_tour(self):
+        """Tarefas da rota pela ordem em que vão ser feitas (a de pop_next_task)."""
+        tasks = [e["task"] for e in self.route]
+        layout = getattr(self.env, "layout", None)
+        if layout is None or self.location is None:
+            return tasks
+        position = self._task_stops(self.current_task)[1] if self.current_task is not None else self.location
+        tour = []
+        while tasks:
+            task = tasks.pop(self._nearest_index(position, tasks))
+            tour.append(task)
+            position = self._task_stops(task)[1]
+        return tour
+
+    def route_end_location(self):
+        """Onde o robot fica depois de cumprir a rota atual (fim do percurso por vizinho mais próximo)."""
+        tour = self.planned_tour()
+        if tour:
+            return self._task_stops(tour[-1])[1]
+        if self.current_task is not None:
+            return self._task_stops(self.current_task)[1]
+        return self.location
+
+    def task_travel(self, origin, task):
+        """Distância de `origin` até à recolha + distância da entrega."""
+        layout = getattr(self.env, "layout", None)
+        pickup, dropoff = self._task_stops(task)
+        if layout is None or origin is None:
+            return task.get("distance", 1)
+        return layout.route_distance([origin, pickup, dropoff])
+
+    def travel_ticks(self, distance):
+        layout = getattr(self.env, "layout", None)
+        if layout is not None:
+            return layout.travel_ticks(distance, self.speed)
+        return max(1, round(distance / self.speed))
+
+    def eta_ticks(self, task):
+        """Ticks até `task` estar entregue, se for juntada ao fim da rota atual."""
+        tasks = ([self.current_task] if self.current_task is not None else [])
+        tasks += self.planned_tour() + [task]
+        layout = getattr(self.env, "layout", None)
+        if layout is None or self.location is None:
+            return sum(self.travel_ticks(int(t.get("distance", 1))) for t in tasks)
+        stops = [self.location]
+        for t in tasks:
+            stops.extend(self._task_stops(t))
+        return self.travel_ticks(layout.route_distance(stops))
+
+    def cancel_task(self, thread_id):
+        """Retira da rota a tarefa do transporte `thread_id` (se ainda não começou)."""
+        for entry in self.route:
+            if entry["thread"] == thread_id:
+                self.route.remove(entry)
+                return True
+        return False
+
+    def pop_next_task(self):
+        """
+        Heurística de vizinho mais próximo: a próxima entrega é a que
+        tem a recolha mais perto da posição atual do robot.
+        """
+        layout = getattr(self.env, "layout", None)
+        if layout is None or self.location is None:
+            return self.route.pop(0)
+        return self.route.pop(self._nearest_index(self.location, [e["task"] for e in self.route]))
+
+    def is_down(self):
+        return self.env is not None and self.env.time < self.out_of_service_until
+
+    # ------------------------- CNP -------------------------
+
     async def build_proposal(self, msg):
         """
         Processa uma CFP e devolve PROPOSE/REFUSE (sem enviar).
+        O custo é a distância real: fim da rota atual → fornecedor → máquina.
         Propaga o metadata 'thread' se existir.
         """
         task = self._parse_task(msg.body)
@@ -70,8 +175,8 @@ class RobotAgent(FactoryAgent):
             await self.log(f"[ROBOT] {self.agent_name} CFP com body inválido: {msg.body}")
             return None
 
-        # Se já estiver ocupado, recusa
-        if self.busy:
+        # Se a rota já está cheia (ou o robot está fora de serviço), recusa
+        if len(self.route) >= self.max_route or self.is_down():
             reply = Message(to=str(msg.sender))
             reply.set_metadata("protocol", msg.metadata.get("protocol", "cnp"))
             reply.set_metadata("performative", "refuse")
@@ -79,12 +184,12 @@ class RobotAgent(FactoryAgent):
             th = msg.metadata.get("thread")
             if th is not None:
                 reply.set_metadata("thread", th)
-            reply.body = "busy"
+            reply.body = "out_of_service" if self.is_down() else "busy"
             return reply
 
-        # Custo simples
-        distance = task.get("distance", 1)
-        cost = max(1, distance * random.randint(3, 5))
+        distance = self.task_travel(self.route_end_location(), task)
+        cost = max(1, distance)
+        eta = self.eta_ticks(task)
 
         reply = Message(to=str(msg.sender))
         reply.set_metadata("protocol", msg.metadata.get("protocol", "cnp"))
@@ -93,58 +198,106 @@ class RobotAgent(FactoryAgent):
         th = msg.metadata.get("thread")
         if th is not None:
             reply.set_metadata("thread", th)
-        reply.body = f"cost={cost};distance={distance}"
+        reply.body = f"cost={cost};distance={distance};eta={eta}"
 
         await self.log(
-            f"[ROBOT] {self.agent_name} CFP recebido → PROPOSE cost={cost}, distance={distance}"
+            f"[ROBOT] {self.agent_name} CFP recebido → PROPOSE cost={cost}, distance={distance}, eta={eta} "
+            f"(rota={len(self.route)})"
         )
         return reply
 
-    async def execute_task_and_build_informs(self, msg):
-        """
-        Após ACCEPT-PROPOSAL: simula transporte e devolve os INFORM(s).
-        Garante que o INFORM inclui o mesmo 'thread' do pedido.
-        """
+    async def enqueue_task(self, msg):
+        """Após ACCEPT-PROPOSAL: junta a tarefa à rota do robot."""
         task = self._parse_task(msg.body)
         if task is None:
             await self.log(
                 f"[ROBOT] {self.agent_name} ACCEPT-PROPOSAL com body inválido: {msg.body}"
             )
+            return
+
+        # thread do ACCEPT → vai também no INFORM
+        thread_id = msg.metadata.get("thread")
+        if thread_id is None:
+            # fallback: tenta buscar do body da task
+            thread_id = task.get("thread")
+
+        self.route.append({
+            "task": task,
+            "supplier": str(msg.sender),
+            "protocol": msg.metadata.get("protocol", "cnp"),
+            "thread": thread_id,
+            "accepted_at": self.env.time if self.env is not None else 0,
+        })
+        await self.log(f"[ROBOT] {self.agent_name} ACCEPT recebido → tarefa na rota ({len(self.route)}): {task}")
+
+    async def execute_next_delivery(self):
+        """
+        Executa a próxima entrega da rota (vizinho mais próximo)
+        e devolve o(s) INFORM(s) a enviar.
+        """
+        if not self.route:
             return []
 
-        self.busy = True
-        self.current_task = task
+        entry, distance = self.start_next_delivery()
 
-        await self.log(f"[ROBOT] {self.agent_name} ACCEPT recebido → iniciar entrega: {task}")
+        # Simula transporte (em ticks do relógio da simulação)
+        await self.wait_ticks(self.travel_ticks(distance))
 
-        # Simula transporte
-        distance = task.get("distance", 1)
-        travel_time = max(1.0, distance * self.speed)
-        await asyncio.sleep(travel_time)
+        return await self.finish_delivery(entry, distance)
 
-        supplier_jid = str(msg.sender)
+    def start_next_delivery(self):
+        """Tira da rota a próxima entrega e começa-a. Devolve (entrada da rota, distância)."""
+        entry = self.pop_next_task()
+        self.busy = True
+        self.current_task = entry["task"]
+        return entry, self.task_travel(self.location, entry["task"])
+
+    async def finish_delivery(self, entry, distance):
+        """Chegada ao destino: métricas e INFORMs para a máquina e o fornecedor."""
+        task = entry["task"]
+        pickup, dropoff = self._task_stops(task)
+
+        if dropoff is not None:
+            self.location = dropoff
+
+        if self.env is not None:
+            self.env.metrics["robot_travel_distance"] += distance
+            self.env.metrics["deliveries"] += 1
+            self.env.metrics["delivery_latency_ticks"] += self.env.time - entry["accepted_at"]
+            self.env.tracer.conversation_event(task.get("conversation"), "delivered", self.env.time)
+
+        informs = []
+
+        # confirmação direta à máquina (sem passar pelo fornecedor)
+        if dropoff is not None and task.get("conversation") is not None:
+            delivered = Message(to=dropoff)
+            delivered.set_metadata("protocol", entry["protocol"])
+            delivered.set_metadata("performative", "inform")
+            delivered.thread = task["conversation"]
+            delivered.body = f"delivered_materials: {task.get('batch')}"
+            informs.append(delivered)
+
+        # ack ao fornecedor (só limpa pending_transports)
+        supplier_jid = entry["supplier"]
         inform = Message(to=supplier_jid)
-        inform.set_metadata("protocol", msg.metadata.get("protocol", "cnp"))
+        inform.set_metadata("protocol", entry["protocol"])
         inform.set_metadata("performative", "inform")
-        # thread do ACCEPT → vai também no INFORM
-        thread_id = msg.metadata.get("thread")
-        if thread_id is None:
-            # fallback: tenta buscar do body da task
-            thread_id = task.get("thread")
-        if thread_id is not None:
-            inform.set_metadata("thread", str(thread_id))
+        if entry["thread"] is not None:
+            inform.set_metadata("thread", str(entry["thread"]))
         inform.body = "transport_done"
+        informs.append(inform)
 
         await self.log(
-            f"[ROBOT] {self.agent_name} entrega concluída → INFORM 'transport_done' enviado para {supplier_jid}"
+            f"[ROBOT] {self.agent_name} entrega concluída ({pickup} → {dropoff}, distância={distance}) "
+            f"→ INFORM enviado para {dropoff} e 'transport_done' para {supplier_jid}"
         )
 
         self.busy = False
         self.current_task = None
 
-        return [inform]
+        return informs
 
-    # ------------------------- Behaviour -------------------------
+    # ------------------------- Behaviours -------------------------
 
     class TransportManagerBehaviour(CyclicBehaviour):
         async def run(self):
@@ -152,6 +305,8 @@ class RobotAgent(FactoryAgent):
                 msg = await self.receive(timeout=0.2)
                 if not msg:
                     break
+                if self.agent.message_lost(msg):
+                    continue
 
                 protocol = msg.metadata.get("protocol")
                 pf = msg.metadata.get("performative")
@@ -167,9 +322,14 @@ class RobotAgent(FactoryAgent):
                     await self.agent.log(
                         f"[ROBOT] {self.agent.agent_name} recebeu ACCEPT-PROPOSAL de {msg.sender}"
                     )
-                    informs = await self.agent.execute_task_and_build_informs(msg)
-                    for inf in informs:
-                        await self.send(inf)
+                    await self.agent.enqueue_task(msg)
+
+                elif pf == "cancel":
+                    cancelled = self.agent.cancel_task(msg.metadata.get("thread"))
+                    await self.agent.log(
+                        f"[ROBOT] {self.agent.agent_name} CANCEL de {msg.sender} "
+                        f"({'tarefa retirada da rota' if cancelled else 'já em curso ou concluída'})"
+                    )
 
                 elif pf == "reject-proposal":
                     # Propaga thread no log apenas para consistência
@@ -179,3 +339,14 @@ class RobotAgent(FactoryAgent):
 
             await asyncio.sleep(0.1)
 
+    class DeliveryBehaviour(CyclicBehaviour):
+        """Percorre a rota: uma entrega de cada vez, enquanto houver tarefas."""
+
+        async def run(self):
+            if not self.agent.route or self.agent.is_down():
+                await self.agent.wait_ticks(1)
+                return
+
+            informs = await self.agent.execute_next_delivery()
+            for inf in informs:
+                await self.send(inf)
@@ -6,31 +6,57 @@ from agents.base_agent import FactoryAgent
 class SupervisorAgent(FactoryAgent):
     """
     Agente Supervisor:
-    - Executa o ciclo de tempo global (tick do ambiente).
+    - Acompanha o relógio global (o tick é feito apenas pelo loop principal).
     - Efetua reabastecimento periódico de um fornecedor (stock refill).
     - Regista métricas e estado geral do sistema.
     """
 
     def __init__(self, jid, password, env=None,
-                 supply_refill_every=10, refill_amount=None, supply_agent_ref=None):
+                 supply_refill_every=10, refill_amount=None, supply_agent_ref=None,
+                 max_refills=None):
         super().__init__(jid, password, env)
         self.supply_refill_every = supply_refill_every
         self.refill_amount = refill_amount or {"flour": 40, "sugar": 20, "butter": 12}
         self.supply_agent_ref = supply_agent_ref
+        self.is_supervisor = True
+
+        # None = refill sem limite
+        self.max_refills = max_refills
+        self.refills_done = 0
+
+    def refill_pending(self):
+        """True se ainda vão acontecer refills (usado na deteção de terminação)."""
+        if not self.supply_agent_ref or not any(self.refill_amount.values()):
+            return False
+        return self.max_refills is None or self.refills_done < self.max_refills
 
     class Ticker(CyclicBehaviour):
+        async def on_start(self):
+            self.last_tick = self.agent.env.time
+
         async def run(self):
             agent = self.agent
             env = agent.env
 
-            # ✅ Corrigido: tick é uma coroutine assíncrona
-            await env.tick()
-            t = env.time
+            # sem tick novo → esperar (o relógio é avançado pelo main)
+            if env.time == self.last_tick:
+                await asyncio.sleep(0.1)
+                return
+
+            # processar todos os ticks desde a última execução (nenhum refill é saltado)
+            for t in range(self.last_tick + 1, env.time + 1):
+                await self.on_tick(t)
+            self.last_tick = env.time
+
+        async def on_tick(self, t):
+            agent = self.agent
+            env = agent.env
 
             # 🧺 Refill periódico de fornecedor
-            if agent.supply_agent_ref and t % agent.supply_refill_every == 0:
+            if agent.refill_pending() and t % agent.supply_refill_every == 0:
                 for k, v in agent.refill_amount.items():
                     agent.supply_agent_ref.stock[k] += v
+                agent.refills_done += 1
                 await agent.log(
                     f"[t={t}] Refill fornecedor: +{agent.refill_amount} | "
                     f"stock fornecedor={agent.supply_agent_ref.stock}"
@@ -49,16 +75,12 @@ class SupervisorAgent(FactoryAgent):
                     f"cnp_accepts={m['cnp_accepts']}"
                 )
 
-            # ⏳ Espera entre ticks
-            await asyncio.sleep(1)
-
     async def setup(self):
         """Inicializa o supervisor e inicia o comportamento periódico."""
+        if self.env is not None:
+            self.env.register_agent(self)
         await self.log(
             f"iniciado. refill_cada={self.supply_refill_every} ticks | "
             f"refill={self.refill_amount}"
         )
         self.add_behaviour(self.Ticker())
-
-
-
@@ -1,32 +1,249 @@
 # agents/supply_cnp_agent.py
 from agents.base_agent import FactoryAgent
+from conversations import ConversationMailbox
 from spade.behaviour import CyclicBehaviour
 from spade.message import Message
-import random
+import re
 import ast
+from collections import OrderedDict
+
+from batching import STOCK_PER_UNIT, supplier_units
 
 
 class SupplyCNPAgent(FactoryAgent):
     def __init__(self, jid, password, env=None, name="Supplier",
-                 stock_init=None, capacity=None):
+                 stock_init=None, capacity=None, transport_ttl=30,
+                 max_transport_retries=2, max_pending=64, max_delivered=256, robot_cfp_ticks=3):
         super().__init__(jid, password, env)
         self.agent_name = name
+        self.is_supplier = True  # usado para identificar fornecedores no env
         self.stock = stock_init or {"flour": 50, "sugar": 30, "butter": 20}
         self.capacity = capacity or {"flour": 50, "sugar": 30, "butter": 20}
 
-        # Armazena entregas pendentes: thread_id → task_info
-        self.pending_transports = {}
+        # Entregas pendentes: thread_id (leilão de robots) → task_info.
+        # Limitado a max_pending; o prazo de cada transporte é o ETA proposto
+        # pelo robot (rota completa) + transport_ttl ticks de folga. Sem
+        # 'transport_done' até lá, o transporte é re-leiloado (até
+        # max_transport_retries, o robot anterior recebe CANCEL) e depois a
+        # máquina é avisada da falha.
+        self.pending_transports = OrderedDict()
+        self.transport_ttl = transport_ttl
+        self.max_transport_retries = max_transport_retries
+        self.max_pending = max_pending
+
+        # leilão de robots: propostas durante robot_cfp_ticks ticks, e no máximo
+        # robot_cfp_ticks esperas seguidas sem resposta (com o relógio parado,
+        # como no memprofile.py, uma proposta perdida não prende o fornecedor)
+        self.robot_cfp_ticks = robot_cfp_ticks
+
+        # entregas concluídas: conversa da máquina → batch (para responder a QUERY-REF)
+        self.delivered = OrderedDict()
+        self.max_delivered = max_delivered
+
+        # caixa geral: pedidos das máquinas; caixas por thread: leilões de robots
+        self.mailbox = ConversationMailbox(self.current_tick, drop=self.message_lost)
 
     async def setup(self):
+        if self.env is not None:
+            self.env.register_agent(self)
         await self.log(f"(CNP Participant {self.agent_name}) stock inicial={self.stock} cap/pedido={self.capacity}")
         self.add_behaviour(self.Participant())
 
+    def can_supply(self):
+        """True se há stock para responder a mais um pedido (10 de cada)."""
+        return supplier_units(self.stock) >= 1
+
+    def remember_delivery(self, conversation, batch):
+        self.delivered[conversation] = batch
+        self.delivered.move_to_end(conversation)
+        while len(self.delivered) > self.max_delivered:
+            self.delivered.popitem(last=False)
+
+    def find_superseding(self, thread_id):
+        """Transporte pendente que substituiu o transporte `thread_id` (re-leilão) ou None."""
+        for pending_thread, info in self.pending_transports.items():
+            if thread_id in info["superseded"]:
+                return pending_thread
+        return None
+
+    def find_pending(self, conversation):
+        """Thread do transporte em curso para uma conversa da máquina (ou None)."""
+        for thread_id, info in self.pending_transports.items():
+            if info["conversation"] == conversation:
+                return thread_id
+        return None
+
+    @staticmethod
+    def parse_bill(body):
+        """Ingredientes por unidade no body ('ingredients: flour=10, sugar=5; ...'); {} se não houver."""
+        match = re.search(r"ingredients:\s*([^;]*)", body or "")
+        if not match:
+            return {}
+        pairs = (kv.split("=") for kv in match.group(1).split(",") if "=" in kv)
+        return {k.strip(): int(v) for k, v in pairs}
+
+    @staticmethod
+    def parse_units(body):
+        """Unidades pedidas/aceites no body ('...; units=3'); 1 por omissão."""
+        match = re.search(r"units=(\d+)", body or "")
+        return max(1, int(match.group(1))) if match else 1
+
     # =============================================================
     #  CNP PARTICIPANT BEHAVIOUR
     # =============================================================
     class Participant(CyclicBehaviour):
+        async def notify_machine(self, machine, conversation, performative, body):
+            reply = Message(to=machine)
+            reply.set_metadata("performative", performative)
+            reply.set_metadata("protocol", "cnp")
+            reply.thread = conversation
+            reply.body = body
+            await self.send(reply)
+
+        async def cancel_transport(self, robot, thread_id):
+            if robot is None:
+                return
+            cancel = Message(to=robot)
+            cancel.set_metadata("performative", "cancel")
+            cancel.set_metadata("protocol", "cnp")
+            cancel.set_metadata("thread", thread_id)
+            await self.send(cancel)
+
+        async def dispatch_transport(self, task, retries=0, superseded=()):
+            """
+            Leilão de robots para uma tarefa de entrega (thread novo por tentativa).
+            Devolve True se algum robot aceitou; a tarefa fica em pending_transports
+            até chegar o 'transport_done' ou expirar. `superseded`: threads das
+            tentativas anteriores (um ack tardio de uma delas também conta).
+            """
+            agent = self.agent
+            env = agent.env
+            thread_id = agent.new_thread_id("sup")
+            task = dict(task, thread=thread_id)
+
+            proposals = []
+            agent.mailbox.open(thread_id)
+            env.termination.begin(thread_id, agent.agent_name, env.time)
+
+            for robot_jid in env.robots:
+                m = Message(to=robot_jid)
+                m.set_metadata("performative", "cfp")
+                m.set_metadata("protocol", "cnp")
+                m.set_metadata("thread", thread_id)
+                m.body = str(task)
+
+                await self.send(m)
+                await agent.log(f"[SUPPLY → ROBOT] CFP enviado a {robot_jid}: {task}")
+
+            # --- recolher propostas (termina cedo se todos os robots responderem) ---
+            replied = set()
+            timeout = env.time + agent.robot_cfp_ticks
+            idle = 0
+            while env.time < timeout and len(replied) < len(env.robots) and idle < agent.robot_cfp_ticks:
+                rep = await agent.mailbox.receive(self, thread_id, timeout=0.5)
+                if rep is None:
+                    idle += 1
+                    continue
+                idle = 0
+                replied.add(str(rep.sender).split("/")[0])
+                if rep.metadata.get("performative") == "propose":
+                    raw = rep.body.strip()
+                    data = dict(kv.split("=") for kv in raw.split(";") if "=" in kv)
+                    cost = int(data["cost"])
+                    eta = int(data.get("eta", data.get("distance", 1)))
+                    proposals.append((str(rep.sender), cost, raw, eta))
+
+                    await agent.log(
+                        f"[SUPPLY] PROPOSE robot={rep.sender} cost={cost} raw={raw}"
+                    )
+
+            # leilão fechado: o 'transport_done' do robot chega depois pela caixa geral
+            agent.mailbox.close(thread_id)
+
+            # Guardar no pending_transports (também sem robot: volta a tentar mais tarde)
+            while len(agent.pending_transports) >= agent.max_pending:
+                old_thread, old = agent.pending_transports.popitem(last=False)
+                env.termination.end(old_thread)
+                await self.cancel_transport(old["robot"], old_thread)
+                await self.notify_machine(old["machine"], old["conversation"], "failure", "transport_dropped")
+            agent.pending_transports[thread_id] = {
+                "machine": task["to_machine"],
+                "conversation": task["conversation"],
+                "batch": task["batch"],
+                "task": task,
+                "robot": None,
+                "created_at": env.time,
+                "deadline": env.time + 1,  # sem robot: nova tentativa no tick seguinte
+                "retries": retries,
+                "superseded": list(superseded),
+            }
+
+            if not proposals:
+                await agent.log("[SUPPLY] Nenhum robot respondeu → nova tentativa mais tarde.")
+                return False
+
+            # Escolher robot vencedor: quem entrega mais cedo (rota em curso + esta
+            # viagem); o custo marginal só desempata
+            winner = min(proposals, key=lambda x: (x[3], x[1]))
+            winner_jid = winner[0]
+            agent.pending_transports[thread_id]["robot"] = winner_jid
+            agent.pending_transports[thread_id]["deadline"] = env.time + winner[3] + agent.transport_ttl
+
+            # enviar rejects
+            for r, _, _, _ in proposals:
+                if r != winner_jid:
+                    rej = Message(to=r)
+                    rej.set_metadata("performative", "reject-proposal")
+                    rej.set_metadata("protocol", "cnp")
+                    rej.set_metadata("thread", thread_id)
+                    await self.send(rej)
+
+            # enviar accept a quem ganhou
+            acc = Message(to=winner_jid)
+            acc.set_metadata("performative", "accept-proposal")
+            acc.set_metadata("protocol", "cnp")
+            acc.set_metadata("thread", thread_id)
+            acc.body = str(task)
+            await self.send(acc)
+
+            env.tracer.conversation_event(task["conversation"], "robot_dispatched", env.time)
+            await agent.log(f"[SUPPLY] Robot selecionado: {winner_jid} para fazer entrega.")
+            return True
+
+        async def sweep_pending_transports(self):
+            """Re-leiloa transportes expirados; desiste ao fim de max_transport_retries."""
+            agent = self.agent
+            env = agent.env
+            expired = [t for t, info in agent.pending_transports.items() if env.time >= info["deadline"]]
+            for thread_id in expired:
+                info = agent.pending_transports.pop(thread_id)
+                env.termination.end(thread_id)
+
+                if info["conversation"] in agent.delivered:
+                    continue  # já entregue por outra tentativa: não duplicar
+
+                # o robot atrasado deixa de fazer esta entrega (se ainda não a começou)
+                await self.cancel_transport(info["robot"], thread_id)
+
+                if info["retries"] < agent.max_transport_retries:
+                    env.metrics["transport_retries"] += 1
+                    await agent.log(
+                        f"[SUPPLY] Transporte {thread_id} sem confirmação → nova tentativa "
+                        f"({info['retries'] + 1}/{agent.max_transport_retries})."
+                    )
+                    await self.dispatch_transport(
+                        info["task"], retries=info["retries"] + 1,
+                        superseded=info["superseded"] + [thread_id],
+                    )
+                else:
+                    await agent.log(f"[SUPPLY] Transporte {thread_id} falhou → avisar {info['machine']}.")
+                    await self.notify_machine(info["machine"], info["conversation"], "failure", "transport_failed")
+
         async def run(self):
-            msg = await self.receive(timeout=1)
+            if self.agent.env is not None:
+                await self.sweep_pending_transports()
+
+            msg = await self.agent.mailbox.receive(self, timeout=1)
             if not msg:
                 return
 
@@ -34,54 +251,63 @@ class SupplyCNPAgent(FactoryAgent):
 
             # =========================================================
             # 1. ROBOT → INFORM (transport_done)
+            #    ack assíncrono: o robot já confirmou a entrega à máquina
             # =========================================================
             if pf == "inform" and msg.body == "transport_done":
                 thread_id = msg.metadata.get("thread")
 
                 if thread_id not in self.agent.pending_transports:
-                    await self.agent.log("[SUPPLY] ERRO: entrega sem referência (thread ausente/desconhecida).")
-                    return
+                    # ack tardio de uma tentativa re-leiloada: a entrega está feita,
+                    # a tentativa em curso é cancelada
+                    replacement = self.agent.find_superseding(thread_id)
+                    if replacement is None:
+                        await self.agent.log(f"[SUPPLY] 'transport_done' de {thread_id} sem transporte pendente (ignorado).")
+                        return
+                    await self.cancel_transport(self.agent.pending_transports[replacement]["robot"], replacement)
+                    thread_id = replacement
 
                 info = self.agent.pending_transports.pop(thread_id)
-                machine = info["machine"]
-                batch = info["batch"]
-
-                # Enviar INFORM final à máquina
-                reply = Message(to=machine)
-                reply.set_metadata("performative", "inform")
-                reply.set_metadata("protocol", "cnp")
-                reply.body = f"delivered_materials: {batch}"
-                await self.send(reply)
-
-                await self.agent.log(f"[SUPPLY] Materiais entregues por robot. INFORM enviado para máquina {machine}.")
-                self.agent.env.metrics["cnp_accepts"] += 1
+                self.agent.remember_delivery(info["conversation"], info["batch"])
+
+                await self.agent.log(f"[SUPPLY] Robot confirmou entrega à máquina {info['machine']}.")
+                self.agent.env.termination.end(thread_id)
                 return
 
             # =========================================================
             # 2. MACHINE → CFP
             # =========================================================
             if pf == "cfp":
-                # Se stock insuficiente → refuse
-                if any(v < 10 for v in self.agent.stock.values()):
+                # receita pedida (por unidade): ingrediente que não temos ou stock curto → refuse
+                bill = self.agent.parse_bill(msg.body)
+                available = supplier_units(self.agent.stock, bill)
+                if available < 1:
+                    missing = [k for k in bill if k not in self.agent.stock]
+                    reason = "missing_ingredient" if missing else "insufficient_stock"
                     refuse = Message(to=str(msg.sender))
                     refuse.set_metadata("protocol", "cnp")
                     refuse.set_metadata("performative", "refuse")
-                    refuse.body = "insufficient_stock"
+                    refuse.thread = msg.thread
+                    refuse.body = reason
                     await self.send(refuse)
-                    await self.agent.log(f"[CNP/{self.agent.agent_name}] REFUSE (insufficient_stock)")
+                    await self.agent.log(f"[CNP/{self.agent.agent_name}] REFUSE ({reason})")
                     return
 
-                lead_time = random.randint(2, 6)
-                cost = random.randint(15, 22)
+                # oferecer as unidades pedidas que o stock permitir
+                units = min(self.agent.parse_units(msg.body), available)
+                # um stream por máquina: as ofertas não dependem da ordem das CFPs
+                rng = self.agent.random_stream(f"offers/{str(msg.sender).split('/')[0]}")
+                lead_time = rng.randint(2, 6)
+                cost = rng.randint(15, 22) * units
 
                 propose = Message(to=str(msg.sender))
                 propose.set_metadata("protocol", "cnp")
                 propose.set_metadata("performative", "propose")
-                propose.body = f"lead_time={lead_time}; cost={cost}"
+                propose.thread = msg.thread
+                propose.body = f"lead_time={lead_time}; cost={cost}; units={units}"
                 await self.send(propose)
 
                 await self.agent.log(
-                    f"[CNP/{self.agent.agent_name}] PROPOSE lead_time={lead_time}, cost={cost}"
+                    f"[CNP/{self.agent.agent_name}] PROPOSE lead_time={lead_time}, cost={cost}, units={units}"
                 )
                 return
 
@@ -92,79 +318,49 @@ class SupplyCNPAgent(FactoryAgent):
                 machine_jid = str(msg.sender)
                 await self.agent.log(f"[SUPPLY] Pedido aceite da máquina {machine_jid} → delegar robot")
 
-                # retira stock
-                for k in self.agent.stock.keys():
-                    self.agent.stock[k] = max(0, self.agent.stock[k] - 10)
+                # retira do stock a receita × unidades (sem receita: STOCK_PER_UNIT de cada)
+                units = self.agent.parse_units(msg.body)
+                bill = self.agent.parse_bill(msg.body) or {k: STOCK_PER_UNIT for k in self.agent.stock}
+                if supplier_units(self.agent.stock, bill) < units:
+                    # o stock foi gasto entre a proposta e o accept
+                    await self.notify_machine(machine_jid, msg.thread, "failure", "insufficient_stock")
+                    return
+                batch = {k: q * units for k, q in bill.items()}
+                for k, q in batch.items():
+                    self.agent.stock[k] -= q
 
-                # Criar tarefa de entrega
-                thread_id = f"cnp-{self.agent.agent_name}-{random.randint(1000,9999)}"
+                # Criar tarefa de entrega (o thread do leilão é atribuído em dispatch_transport)
+                layout = getattr(self.agent.env, "layout", None)
+                pickup = str(self.agent.jid)
                 task = {
                     "type": "deliver_materials",
                     "from_supplier": self.agent.agent_name,
+                    "pickup": pickup,
                     "to_machine": machine_jid,
-                    "batch": self.agent.capacity.copy(),
-                    "distance": 1,
-                    "thread": thread_id
+                    "batch": batch,
+                    "units": units,
+                    "distance": layout.distance(pickup, machine_jid) if layout else 1,
+                    # conversa CNP da máquina: o robot confirma a entrega
+                    # diretamente nela (e o tracer de jobs usa-a)
+                    "conversation": msg.thread,
                 }
 
-                # Enviar CFP aos robots
-                proposals = []
-
-                for robot_jid in self.agent.env.robots:
-                    m = Message(to=robot_jid)
-                    m.set_metadata("performative", "cfp")
-                    m.set_metadata("protocol", "cnp")
-                    m.set_metadata("thread", thread_id)
-                    m.body = str(task)
-
-                    await self.send(m)
-                    await self.agent.log(f"[SUPPLY → ROBOT] CFP enviado a {robot_jid}: {task}")
-
-                # --- recolher propostas ---
-                timeout = self.agent.env.time + 3
-                while self.agent.env.time < timeout:
-                    rep = await self.receive(timeout=0.5)
-                    if rep and rep.metadata.get("performative") == "propose":
-                        raw = rep.body.strip()
-                        cost = int(raw.split("=")[1].split(";")[0])
-                        proposals.append((str(rep.sender), cost, raw))
-
-                        await self.agent.log(
-                            f"[SUPPLY] PROPOSE robot={rep.sender} cost={cost} raw={raw}"
-                        )
-
-                if not proposals:
-                    await self.agent.log("[SUPPLY] Nenhum robot respondeu → impossível entregar.")
-                    return
-
-                # Escolher robot vencedor
-                winner = min(proposals, key=lambda x: x[1])
-                winner_jid = winner[0]
-
-                # Guardar no pending_transports
-                self.agent.pending_transports[thread_id] = {
-                    "machine": machine_jid,
-                    "batch": self.agent.capacity.copy()
-                }
+                await self.dispatch_transport(task)
+                return
 
-                # enviar rejects
-                for r, _, _ in proposals:
-                    if r != winner_jid:
-                        rej = Message(to=r)
-                        rej.set_metadata("performative", "reject-proposal")
-                        rej.set_metadata("protocol", "cnp")
-                        rej.set_metadata("thread", thread_id)
-                        await self.send(rej)
-
-                # enviar accept a quem ganhou
-                acc = Message(to=winner_jid)
-                acc.set_metadata("performative", "accept-proposal")
-                acc.set_metadata("protocol", "cnp")
-                acc.set_metadata("thread", thread_id)
-                acc.body = str(task)
-                await self.send(acc)
-
-                await self.agent.log(f"[SUPPLY] Robot selecionado: {winner_jid} para fazer entrega.")
+            # =========================================================
+            # 3b. MACHINE → QUERY-REF (entrega atrasada: o que aconteceu?)
+            # =========================================================
+            if pf == "query-ref":
+                conversation = msg.thread
+                machine_jid = str(msg.sender)
+                if conversation in self.agent.delivered:
+                    # o INFORM perdeu-se: reenviar
+                    batch = self.agent.delivered[conversation]
+                    await self.notify_machine(machine_jid, conversation, "inform", f"delivered_materials: {batch}")
+                elif self.agent.find_pending(conversation) is None:
+                    await self.notify_machine(machine_jid, conversation, "failure", "unknown_conversation")
+                # ainda em transporte: a máquina continua à espera
                 return
 
             # =========================================================
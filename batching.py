@@ -0,0 +1,78 @@
+# batching.py
+# -*- coding: utf-8 -*-
+import math
+
+# stock retirado ao fornecedor por unidade encomendada (de cada ingrediente)
+STOCK_PER_UNIT = 10
+
+
+def supplier_units(stock, bill=None):
+    """
+    Quantas unidades completas um fornecedor consegue servir com este stock:
+    de `bill` (ingrediente → quantidade por unidade; ingrediente em falta → 0)
+    ou, sem bill, STOCK_PER_UNIT de cada ingrediente em stock.
+    """
+    if bill:
+        return min(stock.get(k, 0) // q for k, q in bill.items() if q > 0)
+    if not stock:
+        return 0
+    return min(v // STOCK_PER_UNIT for v in stock.values())
+
+
+class AdaptiveBatchPolicy:
+    """
+    Decide quantas unidades pedir em cada ronda CNP (e como dividir em jobs).
+
+    - Latência de entrega observada (média exponencial, em ticks): se as
+      entregas demoram, pede-se o suficiente para cobrir o tempo até à
+      próxima entrega (lei de Little: unidades ≈ latência / ticks por unidade).
+    - Ticks por unidade observados nos jobs concluídos (etapas medidas em
+      env.time, com changeovers e bloqueios); até haver observações usa a
+      soma dos stage_times da máquina.
+    - Profundidade da fila: o trabalho já em fila é descontado.
+    - Stock dos fornecedores: nunca mais do que o melhor fornecedor consegue servir.
+    - Na entrega, as unidades são divididas em jobs de 1 unidade se houver
+      máquinas livres para os roubar/receber; caso contrário ficam num só job.
+    """
+
+    def __init__(self, min_units=1, max_units=4, alpha=0.3):
+        self.min_units = min_units
+        self.max_units = max_units
+        self.alpha = alpha
+        self.latency_ema = None
+        self.work_ema = None
+
+    def _ema(self, old, value):
+        return float(value) if old is None else old + self.alpha * (value - old)
+
+    def observe_delivery(self, latency_ticks):
+        self.latency_ema = self._ema(self.latency_ema, latency_ticks)
+
+    def observe_work(self, ticks_per_unit):
+        self.work_ema = self._ema(self.work_ema, ticks_per_unit)
+
+    def order_units(self, machine):
+        """Unidades a pedir na próxima ronda."""
+        work_per_unit = self.work_ema or sum(machine.stage_times.values()) or 1
+        queued_ticks = sum(machine.queued_job_cost(j) for j in machine.job_queue)
+
+        if self.latency_ema is None:
+            wanted = self.min_units
+        else:
+            wanted = math.ceil((self.latency_ema - queued_ticks) / work_per_unit)
+
+        best_stock = 0
+        for a in machine.env.agents:
+            if getattr(a, "is_supplier", False):
+                best_stock = max(best_stock, supplier_units(a.stock))
+
+        units = max(self.min_units, min(self.max_units, wanted))
+        return max(1, min(units, best_stock)) if best_stock else self.min_units
+
+    def split(self, units, idle_peers):
+        """Tamanhos dos jobs a criar a partir de `units` entregues."""
+        if units <= 1 or idle_peers <= 0:
+            return [units]
+        parts = min(units, idle_peers + 1)
+        base, extra = divmod(units, parts)
+        return [base + 1 if i < extra else base for i in range(parts)]
@@ -0,0 +1,68 @@
+# bootstrap.py
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+
+class AgentBootstrapper:
+    """
+    Arranque e paragem de conjuntos de agentes em paralelo.
+
+    - No máximo `concurrency` agentes a ligar/registar ao mesmo tempo
+      (não sobrecarregar o servidor XMPP).
+    - Guarda o tempo de arranque de cada agente e mostra um resumo.
+    """
+
+    def __init__(self, concurrency=50, auto_register=True):
+        self.concurrency = concurrency
+        self.auto_register = auto_register
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+        self.timings = {}  # JID → segundos até ficar ativo
+
+    async def _start_one(self, agent):
+        async with self._semaphore:
+            t0 = time.perf_counter()
+            await agent.start(auto_register=self.auto_register)
+            self.timings[str(agent.jid)] = time.perf_counter() - t0
+
+    async def _stop_one(self, agent):
+        async with self._semaphore:
+            await agent.stop()
+
+    async def start(self, agents, label="agentes"):
+        """Arranca todos os agentes em paralelo; falha se algum não arrancar."""
+        agents = list(agents)
+        t0 = time.perf_counter()
+        results = await asyncio.gather(
+            *(self._start_one(a) for a in agents), return_exceptions=True
+        )
+        elapsed = time.perf_counter() - t0
+
+        errors = [(a, r) for a, r in zip(agents, results) if isinstance(r, BaseException)]
+        started = [str(a.jid) for a in agents if str(a.jid) in self.timings]
+        slowest = max(started, key=self.timings.get, default=None)
+
+        print(
+            f"[BOOT] {len(agents) - len(errors)}/{len(agents)} {label} ativos em {elapsed:.2f}s "
+            f"(concorrência={self.concurrency}"
+            + (f", mais lento={slowest} {self.timings[slowest]:.2f}s)" if slowest else ")")
+        )
+
+        if errors:
+            for a, err in errors:
+                print(f"[BOOT] Falha ao arrancar {a.jid}: {err!r}")
+            raise errors[0][1]
+
+    async def stop(self, agents, label="agentes"):
+        """Pára todos os agentes em paralelo (erros são apenas reportados)."""
+        agents = list(agents)
+        t0 = time.perf_counter()
+        results = await asyncio.gather(
+            *(self._stop_one(a) for a in agents), return_exceptions=True
+        )
+        for a, r in zip(agents, results):
+            if isinstance(r, BaseException):
+                print(f"[BOOT] Falha ao parar {a.jid}: {r!r}")
+
+        print(f"[BOOT] {len(agents)} {label} parados em {time.perf_counter() - t0:.2f}s")
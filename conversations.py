@@ -0,0 +1,128 @@
+# conversations.py
+# -*- coding: utf-8 -*-
+from collections import OrderedDict, deque
+
+
+def conversation_id(msg):
+    """Thread ID de uma mensagem (atributo thread ou metadata 'thread')."""
+    return getattr(msg, "thread", None) or msg.metadata.get("thread")
+
+
+class ConversationMailbox:
+    """
+    Caixas de correio por conversa (thread ID) dentro de um agente.
+
+    - Uma conversa é aberta pelo iniciador antes de enviar o pedido;
+      as respostas com esse thread ficam na caixa dessa conversa.
+    - Mensagens sem conversa aberta vão para a caixa geral (None),
+      ou são descartadas se `keep_unrouted=False` (agentes que só
+      conversam como iniciadores).
+    - Cada caixa tem tamanho limitado; há um máximo de conversas abertas
+      (a mais antiga é descartada) e as conversas expiram após `ttl` ticks.
+    - `clock()` dá o tick atual (env.time do agente): TTLs e timeouts de
+      receive() contam no mesmo relógio que os prazos CNP.
+    - Mensagens de conversas já fechadas/expiradas são tratadas como
+      mensagens sem conversa aberta: descartadas com keep_unrouted=False
+      (ex.: PROPOSE atrasado de uma ronda anterior da máquina) e, caso
+      contrário, entregues na caixa geral (ex.: o 'transport_done' de um
+      leilão de robots já fechado, no fornecedor).
+    - `drop(msg)` opcional: mensagens para as quais devolve True são
+      descartadas à chegada (perda simulada de mensagens).
+    """
+
+    def __init__(self, clock, max_messages=32, max_conversations=256, ttl=50,
+                 default_size=256, keep_unrouted=True, drop=None):
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.keep_unrouted = keep_unrouted
+        self.clock = clock
+        self.drop = drop
+
+        # thread_id → {"queue": deque, "expires": instante}
+        self.conversations = OrderedDict()
+        self.default = deque(maxlen=default_size)
+        self.dropped = 0
+
+    # ------------------------- conversas -------------------------
+
+    def open(self, thread_id, ttl=None):
+        if thread_id in self.conversations:
+            self.conversations.move_to_end(thread_id)
+        else:
+            while len(self.conversations) >= self.max_conversations:
+                _, old = self.conversations.popitem(last=False)
+                self.dropped += len(old["queue"])
+            self.conversations[thread_id] = {"queue": deque(maxlen=self.max_messages)}
+        self.conversations[thread_id]["expires"] = self.clock() + (ttl or self.ttl)
+
+    def close(self, thread_id):
+        box = self.conversations.pop(thread_id, None)
+        if box is not None:
+            self.dropped += len(box["queue"])
+
+    def is_open(self, thread_id):
+        return thread_id in self.conversations
+
+    def expire(self):
+        """Fecha conversas cujo TTL passou. Devolve quantas fechou."""
+        now = self.clock()
+        stale = [t for t, box in self.conversations.items() if box["expires"] <= now]
+        for t in stale:
+            self.close(t)
+        return len(stale)
+
+    # ------------------------- mensagens -------------------------
+
+    def put(self, msg):
+        """Encaminha a mensagem para a caixa da sua conversa ou para a geral."""
+        if self.drop is not None and self.drop(msg):
+            self.dropped += 1
+            return
+        thread_id = conversation_id(msg)
+        box = self.conversations.get(thread_id)
+        if box is not None:
+            if len(box["queue"]) == box["queue"].maxlen:
+                self.dropped += 1
+            box["queue"].append(msg)
+            return
+        if not self.keep_unrouted:
+            self.dropped += 1
+            return
+        if len(self.default) == self.default.maxlen:
+            self.dropped += 1
+        self.default.append(msg)
+
+    def pop(self, thread_id=None):
+        """Próxima mensagem da conversa (ou da caixa geral), sem esperar."""
+        if thread_id is None:
+            queue = self.default
+        else:
+            box = self.conversations.get(thread_id)
+            if box is None:
+                return None
+            queue = box["queue"]
+        return queue.popleft() if queue else None
+
+    async def receive(self, behaviour, thread_id=None, timeout=1.0):
+        """
+        Espera por uma mensagem da conversa `thread_id` (None = caixa geral),
+        no máximo `timeout` ticks. Vai buscar mensagens ao behaviour e
+        encaminha as das outras conversas para as respetivas caixas, sem as perder.
+        """
+        self.expire()
+        deadline = self.clock() + timeout
+
+        while True:
+            msg = self.pop(thread_id)
+            if msg is not None:
+                return msg
+
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                return None
+
+            incoming = await behaviour.receive(timeout=remaining)
+            if incoming is None:
+                return None
+            self.put(incoming)
@@ -1,11 +1,19 @@
 # environment.py
 # -*- coding: utf-8 -*-
 import asyncio
-import random
+import heapq
+import itertools
+import math
+from collections import deque
+
+from orders import Backlog
+from rng import RandomStreams
+from termination import TerminationDetector
+from tracing import JobTracer
 
 class FactoryEnvironment:
 
-    def __init__(self):
+    def __init__(self, seed=None):
         self.time = 0
         self.metrics = {
             "requests_ok": 0,
@@ -19,18 +27,77 @@ class FactoryEnvironment:
             "machine_downtime_ticks": 0,
             "cnp_cfp": 0,
             "cnp_accepts": 0,
+            "cfp_messages": 0,
             "jobs_completed": 0,
+            "units_completed": 0,
             "jobs_delegated": 0,
             "jobs_lost": 0,
+            "jobs_stolen": 0,
+            "changeovers": 0,
+            "changeover_ticks": 0,
+            "transport_retries": 0,
+            "deliveries_lost": 0,
+            "robot_travel_distance": 0,
+            "deliveries": 0,
+            "delivery_latency_ticks": 0,
         }
 
         self.agents = []
+        self.machines = []  # máquinas registadas
         self.maintenance_agent = None
         self.external_failure_rate = 0.0
         self.global_job_id = 0
+        self._conversation_seq = {}  # prefixo → contador
+        # geradores aleatórios por agente/subsistema (mesma seed → mesmos eventos)
+        self.random_streams = RandomStreams(seed)
+        self.layout = None  # FactoryLayout opcional (distâncias reais)
+        self.termination = TerminationDetector()
+        self.tracer = JobTracer()
+        self.faults = None  # FaultInjector opcional (campanhas de falhas)
+
+        # produção por encomenda (opcional): OrderStream → Backlog global
+        self.order_stream = None
+        self.backlog = None
+
+        # janelas de avaria [máquina, início, fim] (fim None = ainda avariada)
+        self.failure_windows = deque(maxlen=10000)
+        self._open_windows = {}  # máquina → janela ainda aberta
+
+        # máquinas avariadas, em reparação ou com jobs: as únicas visitadas em cada tick
+        self.active_machines = {}  # máquina → None (conjunto ordenado)
+
+        # falhas por skip-ahead: heap de (tick, seq, máquina, época, tipo), com
+        # tipo "internal" (failure_rate da máquina) ou "external" (external_failure_rate);
+        # a época invalida entradas de máquinas que entretanto avariaram
+        # (compactado quando as obsoletas passam as vivas, no máximo duas por máquina)
+        self._failure_heap = []
+        self._failure_epoch = {}
+        self._failure_seq = itertools.count()
+        self._scheduled_rate = 0.0
+
+        # pausa no fim de cada tick (s); 0 em execuções headless (memprofile.py)
+        self.tick_delay = 0.1
+
+        # limpeza periódica de estado por conversa (ticks)
+        self.housekeeping_every = 100
+        self.conversation_ttl = 500
 
     def register_agent(self, agent):
         self.agents.append(agent)
+        if getattr(agent, "is_machine", False):
+            self.machines.append(agent)
+            self._schedule_failures(agent)
+
+    def set_layout(self, layout):
+        self.layout = layout
+        layout.build()
+
+    def set_order_stream(self, stream, backlog=None):
+        self.order_stream = stream
+        self.backlog = backlog or Backlog()
+
+    def set_fault_injector(self, injector):
+        self.faults = injector
 
     def set_maintenance_agent(self, agent):
         self.maintenance_agent = agent
@@ -39,16 +106,172 @@ class FactoryEnvironment:
         self.global_job_id += 1
         return self.global_job_id
 
+    def new_conversation_id(self, prefix):
+        """
+        Thread ID único na simulação (contador por prefixo, nunca repete).
+        O prefixo inclui o agente, por isso os IDs não dependem da ordem
+        em que os agentes correm.
+        """
+        seq = self._conversation_seq.get(prefix)
+        if seq is None:
+            seq = self._conversation_seq[prefix] = itertools.count(1)
+        return f"{prefix}-{next(seq)}"
+
+    async def fail_machine(self, m, reason="falha externa"):
+        """
+        Avaria uma máquina: delega o job atual e a fila e chama a manutenção.
+        Devolve False se a máquina já estava avariada.
+        """
+        if m.is_failed:
+            return False
+
+        m.is_failed = True
+        self.metrics["machine_failures"] += 1
+        window = [m.agent_name, self.time, None]
+        self.failure_windows.append(window)
+        self._open_windows[m] = window
+        self.watch_machine(m)
+        await m.log(f"[FAILURE] {m.agent_name} falhou ({reason}). A tentar delegar jobs...")
+
+        # delegação opcional
+        if hasattr(m, "try_delegate_current_job"):
+            await m.try_delegate_current_job()
+        if hasattr(m, "try_delegate_queued_jobs"):
+            await m.try_delegate_queued_jobs()
+
+        # notificar manutenção
+        maintenance = getattr(m, "maintenance", None) or self.maintenance_agent
+        if maintenance:
+            await maintenance.receive_failure(m)
+        return True
+
+    def is_quiescent(self):
+        """
+        True quando nada mais pode acontecer na simulação:
+        - nenhuma conversa CNP em aberto
+        - nenhuma máquina com jobs, avariada ou em reparação
+        - nenhum robot com entregas por fazer
+        - nenhum fornecedor com stock para novos pedidos, nem refill previsto
+          (com backlog de encomendas: nenhuma encomenda em aberto ou por chegar)
+        """
+        if not self.termination.is_idle():
+            return False
+
+        # encomendas por satisfazer ou ainda por chegar
+        if self.backlog is not None and not self.backlog.is_idle():
+            return False
+        if self.order_stream is not None and not self.order_stream.exhausted(self.time):
+            return False
+
+        # ainda há falhas programadas por injetar
+        if self.faults is not None and self.faults.pending:
+            return False
+
+        if self.maintenance_agent is not None and self.maintenance_agent.repair_queue:
+            return False
+
+        # com encomendas, stock sem procura não mantém a simulação viva
+        supply_driven = self.backlog is None
+
+        for a in self.agents:
+            if getattr(a, "is_machine", False) and a.has_work():
+                return False
+            if getattr(a, "is_robot", False) and (a.busy or a.route):
+                return False
+            if supply_driven and getattr(a, "is_supplier", False) and a.can_supply():
+                return False
+            if supply_driven and getattr(a, "is_supervisor", False) and a.refill_pending():
+                return False
+
+        return True
+
+    def watch_machine(self, m):
+        """Passa a visitar a máquina em cada tick (avariada ou em reparação)."""
+        self.active_machines[m] = None
+        # as falhas agendadas deixam de valer; novas amostras após a reparação
+        self._failure_epoch[m] = self._failure_epoch.get(m, 0) + 1
+
+    def activate_machine(self, m):
+        """Passa a visitar a máquina em cada tick (recebeu jobs)."""
+        self.active_machines[m] = None
+
+    def _schedule_failures(self, m, start=None):
+        """Agenda as falhas (interna e externa) de uma máquina saudável."""
+        if getattr(m, "failure_rate", 0) > 0:
+            self._schedule_failure(m, "internal", start)
+        if self._scheduled_rate > 0:
+            self._schedule_failure(m, "external", start)
+
+    def _schedule_failure(self, m, kind, start=None):
+        """
+        Próxima falha de uma máquina saudável: com probabilidade p por tick,
+        o número de ticks até à falha é geométrico (uma só amostra em vez
+        de uma por tick). `start` é o primeiro tick em que pode falhar.
+        """
+        if kind == "internal":
+            p = m.failure_rate
+            rng = m.random_stream("failures")
+        else:
+            p = self.external_failure_rate
+            rng = self.random_streams.stream(f"environment/failures/{m.agent_name}")
+        start = self.time + 1 if start is None else start
+        if p >= 1:
+            gap = 0
+        else:
+            gap = int(math.log(1.0 - rng.random()) / math.log(1.0 - p))
+        epoch = self._failure_epoch.get(m, 0)
+        if len(self._failure_heap) >= 4 * max(1, len(self.machines)):
+            self._compact_failure_heap()
+        heapq.heappush(self._failure_heap, (start + gap, next(self._failure_seq), m, epoch, kind))
+
+    def _compact_failure_heap(self):
+        """Remove as entradas obsoletas (época antiga ou máquina avariada)."""
+        self._failure_heap = [
+            e for e in self._failure_heap
+            if e[3] == self._failure_epoch.get(e[2], 0) and not e[2].is_failed
+        ]
+        heapq.heapify(self._failure_heap)
+
+    def _reschedule_external_failures(self):
+        """(Re)agenda as falhas externas das máquinas saudáveis quando external_failure_rate muda."""
+        self._failure_heap = [e for e in self._failure_heap if e[4] == "internal"]
+        heapq.heapify(self._failure_heap)
+        self._scheduled_rate = self.external_failure_rate
+        if self.external_failure_rate <= 0:
+            return
+        for m in self.machines:
+            if not m.is_failed:
+                self._schedule_failure(m, "external", start=self.time)
 
     async def tick(self):
-        """Avança 1 tick no tempo e processa reparações."""
+        """
+        Avança 1 tick no tempo: o único relógio da simulação.
+        Reparações, falhas, início de reparações (manutenção) e
+        progresso das etapas/estações das máquinas avançam aqui.
+        Só visita as máquinas avariadas, em reparação ou com jobs
+        (active_machines) e as falhas que vencem neste tick.
+        """
         self.time += 1
 
-        for m in self.agents:
+        # conversas esquecidas (mensagens perdidas) não ficam em memória para sempre
+        if self.time % self.housekeeping_every == 0:
+            self.termination.expire(self.time, self.conversation_ttl)
+            self.tracer.expire(self.time)
+
+        # encomendas que chegam neste tick
+        if self.order_stream is not None:
+            for units, product in self.order_stream.arrivals(self.time):
+                self.backlog.add(units, self.time, product)
+            self.backlog.sample(self.time)
+
+        # falhas programadas deste tick
+        if self.faults is not None:
+            await self.faults.on_tick(self)
+
+        if self.external_failure_rate != self._scheduled_rate:
+            self._reschedule_external_failures()
 
-            # 🔥 IGNORAR agentes que não são máquinas
-            if not getattr(m, "is_machine", False):
-                continue
+        for m in list(self.active_machines):
 
             # downtime se falhada
             if getattr(m, "is_failed", False):
@@ -61,30 +284,34 @@ class FactoryEnvironment:
                 if m.repair_ticks_remaining == 0:
                     # Reparação concluída
                     m.is_failed = False
+                    window = self._open_windows.pop(m, None)
+                    if window is not None:
+                        window[2] = self.time
                     await m.log(
                         f"[MAINTENANCE] Reparação concluída — {m.agent_name} operacional."
                     )
                     self.metrics["repairs_finished"] += 1
+                    # pode voltar a falhar já neste tick (como antes)
+                    self._schedule_failures(m, start=self.time)
 
-            # Falhas externas opcionais
-            if (
-                self.external_failure_rate > 0
-                and not m.is_failed
-                and random.random() < self.external_failure_rate
-            ):
-                m.is_failed = True
-                self.metrics["machine_failures"] += 1
+            # saudável e sem jobs: deixa de ser visitada até receber trabalho
+            if not m.has_work():
+                del self.active_machines[m]
 
-                await m.log(
-                    f"[FAILURE] {m.agent_name} falhou (detetado pelo ambiente)."
-                )
+        # Falhas (só as que vencem agora)
+        heap = self._failure_heap
+        while heap and heap[0][0] <= self.time:
+            _, _, m, epoch, kind = heapq.heappop(heap)
+            if epoch != self._failure_epoch.get(m, 0) or m.is_failed:
+                continue  # entrada obsoleta (a máquina avariou entretanto)
+            await self.fail_machine(m, "avaria aleatória" if kind == "internal" else "detetado pelo ambiente")
 
-                # delegação opcional
-                if hasattr(m, "try_delegate_current_job"):
-                    await m.try_delegate_current_job()
+        # manutenção: inicia as reparações pedidas
+        if self.maintenance_agent is not None and hasattr(self.maintenance_agent, "on_tick"):
+            await self.maintenance_agent.on_tick()
 
-                # notificar manutenção
-                if self.maintenance_agent:
-                    await self.maintenance_agent.receive_failure(m)
+        # produção: cada máquina com jobs avança um tick nas suas etapas/estações
+        for m in list(self.active_machines):
+            await m.on_tick()
 
-        await asyncio.sleep(0.1)
+        await asyncio.sleep(self.tick_delay)
@@ -0,0 +1,168 @@
+# faults.py
+# -*- coding: utf-8 -*-
+import json
+
+
+class FaultInjector:
+    """
+    Campanhas de falhas programadas (além das falhas aleatórias das máquinas).
+
+    Cada evento é um dict com o tick e o tipo de falha:
+
+        {"tick": 20, "kind": "machine_failure", "target": "M1"}
+        {"tick": 40, "kind": "stage_failure", "stage": "baking"}
+        {"tick": 60, "kind": "stock_out", "target": "A"}
+        {"tick": 80, "kind": "robot_outage", "target": "R1", "duration": 15}
+        {"tick": 90, "kind": "message_loss", "target": "M2", "rate": 0.5, "duration": 10}
+
+    Os alvos são identificados pelo agent_name. Para cada falha injetada mede:
+    - recovery_ticks: ticks até o alvo voltar a estar operacional e o
+      throughput (unidades/tick numa janela de `window` ticks) voltar a
+      `recover_ratio` do valor anterior à falha;
+    - jobs_lost: jobs e entregas perdidos entre a falha e a recuperação;
+    - throughput_dip: queda máxima do throughput (fração do valor anterior).
+    """
+
+    KINDS = ("machine_failure", "stage_failure", "stock_out", "robot_outage", "message_loss")
+
+    def __init__(self, events, window=10, recover_ratio=0.9):
+        for ev in events:
+            if ev.get("kind") not in self.KINDS:
+                raise ValueError(f"Tipo de falha desconhecido: {ev.get('kind')!r}")
+        self.pending = sorted(events, key=lambda ev: ev["tick"])
+        self.window = window
+        self.recover_ratio = recover_ratio
+
+        self.units = []     # unidades completadas (acumulado) em cada tick
+        self.active = []    # falhas injetadas ainda não recuperadas
+        self.results = []   # falhas já recuperadas (ou por recuperar no fim)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Carrega uma campanha de um JSON (lista de eventos ou {"events": [...]})."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            kwargs.setdefault("window", data.get("window", 10))
+            data = data["events"]
+        return cls(data, **kwargs)
+
+    # ------------------------- injeção -------------------------
+
+    def _agents(self, env, flag, name=None):
+        return [
+            a for a in env.agents
+            if getattr(a, flag, False) and (name is None or a.agent_name == name)
+        ]
+
+    async def _inject(self, env, ev):
+        """Aplica a falha e devolve a função que diz se o alvo já recuperou."""
+        kind = ev["kind"]
+
+        if kind in ("machine_failure", "stage_failure"):
+            if kind == "machine_failure":
+                machines = self._agents(env, "is_machine", ev["target"])
+            else:
+                machines = [m for m in self._agents(env, "is_machine") if ev["stage"] in m.capabilities]
+            for m in machines:
+                await env.fail_machine(m, f"falha injetada: {kind}")
+            return lambda: not any(m.is_failed for m in machines)
+
+        if kind == "stock_out":
+            suppliers = self._agents(env, "is_supplier", ev["target"])
+            for s in suppliers:
+                s.stock = {k: 0 for k in s.stock}
+            return lambda: all(s.can_supply() for s in suppliers)
+
+        until = env.time + ev.get("duration", 10)
+        if kind == "robot_outage":
+            robots = self._agents(env, "is_robot", ev["target"])
+            for r in robots:
+                r.out_of_service_until = until
+            return lambda: env.time >= until and not any(r.route for r in robots)
+
+        # message_loss: o agente descarta uma fração das mensagens que recebe
+        agents = [a for a in env.agents if getattr(a, "agent_name", None) == ev["target"]]
+        for a in agents:
+            a.loss_rate = ev.get("rate", 1.0)
+            a.lossy_until = until
+        return lambda: env.time >= until
+
+    # ------------------------- medição -------------------------
+
+    def _lost(self, env):
+        return env.metrics["jobs_lost"] + env.metrics["deliveries_lost"]
+
+    def _throughput(self, end=None):
+        """Unidades/tick na janela que termina no tick `end` (último, por omissão)."""
+        end = len(self.units) if end is None else end
+        start = max(0, end - self.window)
+        if end - start <= 0:
+            return 0.0
+        before = self.units[start - 1] if start > 0 else 0
+        return (self.units[end - 1] - before) / (end - start)
+
+    async def on_tick(self, env):
+        """Chamado pelo ambiente em cada tick (depois de avançar o tempo)."""
+        self.units.append(env.metrics["units_completed"])
+
+        while self.pending and self.pending[0]["tick"] <= env.time:
+            ev = self.pending.pop(0)
+            print(f"[FAULT] tick {env.time}: {ev}")
+            self.active.append({
+                "event": ev,
+                "injected_at": env.time,
+                "baseline": self._throughput(),
+                "lost_at_start": self._lost(env),
+                "min_throughput": None,
+                "healthy": await self._inject(env, ev),
+            })
+
+        throughput = self._throughput()
+        for fault in list(self.active):
+            if env.time > fault["injected_at"]:
+                if fault["min_throughput"] is None or throughput < fault["min_throughput"]:
+                    fault["min_throughput"] = throughput
+
+            recovered = fault["healthy"]() and throughput >= self.recover_ratio * fault["baseline"]
+            if recovered:
+                self.active.remove(fault)
+                self.results.append(self._result(env, fault, recovered=True))
+
+    def _result(self, env, fault, recovered):
+        baseline = fault["baseline"]
+        low = fault["min_throughput"]
+        dip = (1 - low / baseline) if baseline and low is not None else 0.0
+        return {
+            "kind": fault["event"]["kind"],
+            "target": fault["event"].get("target") or fault["event"].get("stage"),
+            "tick": fault["injected_at"],
+            "recovered": recovered,
+            "recovery_ticks": env.time - fault["injected_at"],
+            "jobs_lost": self._lost(env) - fault["lost_at_start"],
+            "throughput_before": baseline,
+            "throughput_dip": max(0.0, dip),
+        }
+
+    # ------------------------- relatório -------------------------
+
+    def report(self, env):
+        """Resultados por falha; as que não recuperaram contam até ao tick atual."""
+        rows = self.results + [self._result(env, f, recovered=False) for f in self.active]
+        return sorted(rows, key=lambda r: r["tick"])
+
+    def format_report(self, env):
+        rows = self.report(env)
+        lines = ["=== FALHAS INJETADAS ==="]
+        if not rows:
+            lines.append("(nenhuma)")
+        for r in rows:
+            status = f"recuperou em {r['recovery_ticks']} ticks" if r["recovered"] else \
+                f"NÃO recuperou ({r['recovery_ticks']} ticks)"
+            lines.append(
+                f"tick {r['tick']:>4} {r['kind']:<15} {str(r['target']):<8} {status}, "
+                f"jobs perdidos={r['jobs_lost']}, "
+                f"throughput {r['throughput_before']:.2f}/tick (queda {r['throughput_dip']:.0%})"
+            )
+        return "\n".join(lines)
+
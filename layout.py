@@ -0,0 +1,68 @@
+# layout.py
+# -*- coding: utf-8 -*-
+import math
+
+
+class FactoryLayout:
+    """
+    Layout físico da fábrica.
+
+    - Cada local (fornecedor, máquina, robot) tem uma posição (x, y) numa grelha.
+    - As distâncias são Manhattan (os robots andam pelos corredores)
+      e ficam numa matriz pré-calculada.
+    - Os locais são identificados pelo JID do agente (sem resource).
+    """
+
+    def __init__(self, positions=None, ticks_per_unit=1.0):
+        self.positions = {}
+        self.ticks_per_unit = ticks_per_unit
+
+        self._index = {}
+        self._matrix = []
+
+        for name, pos in (positions or {}).items():
+            self.add(name, *pos)
+
+    @staticmethod
+    def key(name):
+        """Normaliza um JID ('a@b/resource' → 'a@b')."""
+        return str(name).split("/")[0]
+
+    def add(self, name, x, y):
+        self.positions[self.key(name)] = (x, y)
+        self._matrix = []  # invalida a matriz; recalculada no próximo acesso
+
+    def build(self):
+        """Pré-calcula a matriz de distâncias entre todos os locais."""
+        names = list(self.positions)
+        self._index = {n: i for i, n in enumerate(names)}
+        coords = [self.positions[n] for n in names]
+        self._matrix = [
+            [abs(ax - bx) + abs(ay - by) for (bx, by) in coords]
+            for (ax, ay) in coords
+        ]
+
+    def distance(self, a, b):
+        """Distância entre dois locais (1 se algum não estiver no layout)."""
+        if not self._matrix:
+            self.build()
+        ia = self._index.get(self.key(a))
+        ib = self._index.get(self.key(b))
+        if ia is None or ib is None:
+            return 1
+        return self._matrix[ia][ib]
+
+    def route_distance(self, stops):
+        """Distância total de uma sequência de locais."""
+        return sum(self.distance(a, b) for a, b in zip(stops, stops[1:]))
+
+    def travel_ticks(self, distance, speed=1.0):
+        """Ticks (env.time) para percorrer `distance` à velocidade `speed` (mínimo 1)."""
+        return max(1, math.ceil(distance * self.ticks_per_unit / speed))
+
+    def nearest(self, origin, candidates):
+        """Candidato mais próximo de `origin` (ou None se não houver)."""
+        candidates = list(candidates)
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: self.distance(origin, c))
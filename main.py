@@ -1,6 +1,15 @@
 # main.py
 import asyncio
+from batching import AdaptiveBatchPolicy
+from bootstrap import AgentBootstrapper
 from environment import FactoryEnvironment
+from faults import FaultInjector
+from layout import FactoryLayout
+from memprofile import MemoryProfiler, watch_bounded
+from metrics_server import MetricsServer
+from oracle import ScheduleOracle, record_run, save_run
+from orders import OrderStream
+from recipes import RecipeBook
 from agents.supply_cnp_agent import SupplyCNPAgent
 from agents.machine_cnp_agent import MachineCNPAgent
 from agents.supervisor_agent import SupervisorAgent
@@ -10,11 +19,81 @@ from agents.robot_agent import RobotAgent
 DOMAIN = "192.168.68.106"
 PWD = "12345"
 
+# Endpoint local de métricas (None = desligado), ex.: 9100
+METRICS_PORT = None
+
+# Máquinas com uma estação por capability (vários jobs em pipeline)
+STATION_MODE = False
+
+# Encomendas com tamanho adaptativo (stock, fila e latência de entrega)
+ADAPTIVE_BATCHING = True
+
+# CFP só aos k fornecedores com melhor reputação (+ desconhecidos e exploração); None = todos
+SUPPLIER_TOP_K = 1
+
+# Máximo de agentes a arrancar/parar em simultâneo
+BOOT_CONCURRENCY = 50
+
+# Guardar o registo da execução (JSON) e comparar com o oráculo de escalonamento; None = não
+RUN_RECORD = None
+
+# Produção por encomenda: taxa de chegada (encomendas/tick, Poisson) ou ficheiro JSON
+# de encomendas; None = produção pelas rondas de abastecimento (comportamento original)
+ORDER_RATE = None
+ORDER_FILE = None
+
+# Produtos (JSON com receitas, tempos e changeovers, ver recipes.py); None = produto único
+RECIPES_FILE = None
+
+# Campanha de falhas programadas (JSON, ver faults.py); None = só falhas aleatórias
+FAULT_SCENARIO = None
+
+# Duração de um tick (s): o env.time é o único relógio (etapas, reparações,
+# viagens dos robots, prazos e métricas contam todos em ticks)
+TICK_SECONDS = 0.2
+
+# Semente dos geradores aleatórios (falhas, ofertas, reparações, encomendas...);
+# None = aleatória (é impressa no arranque para se poder repetir a execução)
+SEED = None
+
+# Perfil de memória (RSS + tracemalloc) a cada N ticks; None = desligado.
+# Com perfil a execução dura MEMORY_PROFILE_TICKS ticks (sem parar na quiescência).
+# Para execuções longas sem XMPP ver memprofile.py
+MEMORY_PROFILE_EVERY = None
+MEMORY_PROFILE_TICKS = 50000
+MEMORY_BUDGET_KB = None  # crescimento máximo por 10k ticks (só reportado)
+
 async def main():
     print("\nMulti-Machine Coordination iniciada.\n")
 
     # === Environment ===
-    env = FactoryEnvironment()
+    env = FactoryEnvironment(seed=SEED)
+    env.tick_delay = TICK_SECONDS
+    print(f"Seed: {env.random_streams.seed}\n")
+    if FAULT_SCENARIO is not None:
+        env.set_fault_injector(FaultInjector.from_file(FAULT_SCENARIO))
+    recipes = RecipeBook.from_file(RECIPES_FILE) if RECIPES_FILE is not None else None
+    if ORDER_FILE is not None:
+        env.set_order_stream(OrderStream.from_file(ORDER_FILE))
+    elif ORDER_RATE is not None:
+        env.set_order_stream(OrderStream(
+            "poisson", rate=ORDER_RATE, products=recipes.mix if recipes else None,
+            rng=env.random_streams.stream("orders"),
+        ))
+    if recipes is not None and env.order_stream is not None:
+        unknown = env.order_stream.product_names() - set(recipes.products)
+        if unknown:
+            raise ValueError(f"Encomendas com produtos sem receita: {sorted(unknown)}")
+
+    # === Layout (posições na grelha da fábrica) ===
+    env.set_layout(FactoryLayout({
+        f"supplierA@{DOMAIN}": (0, 0),
+        f"supplierB@{DOMAIN}": (0, 8),
+        f"machine1@{DOMAIN}": (6, 2),
+        f"machine2@{DOMAIN}": (6, 6),
+        f"robot1@{DOMAIN}": (3, 0),
+        f"robot2@{DOMAIN}": (3, 8),
+    }))
 
     env.robots = []
 
@@ -24,9 +103,6 @@ async def main():
     env.robots.append(robot1.jid)
     env.robots.append(robot2.jid)
 
-    await robot1.start(auto_register=True)
-    await robot2.start(auto_register=True)
-
     # === Suppliers ===
     supplierA = SupplyCNPAgent(
         f"supplierA@{DOMAIN}", PWD, env=env,
@@ -40,14 +116,11 @@ async def main():
         stock_init={"flour": 45, "sugar": 50, "butter": 25},
         capacity={"flour": 50, "sugar": 30, "butter": 20}
     )
-    await supplierA.start(auto_register=True)
-    await supplierB.start(auto_register=True)
 
     # === Maintenance Agent ===
     maintenance = MaintenanceAgent(
         f"maintenance@{DOMAIN}", PWD, env=env
     )
-    await maintenance.start(auto_register=True)
 
     # 🔹 IMPORTANTE: dizer ao ambiente quem é o maintenance agent
     env.set_maintenance_agent(maintenance)
@@ -62,7 +135,11 @@ async def main():
         name="M1",
         maintenance=maintenance,
         failure_rate=0.05,
-        capabilities=["cutting", "mixing", "baking"]
+        capabilities=["cutting", "mixing", "baking"],
+        station_mode=STATION_MODE,
+        batch_policy=AdaptiveBatchPolicy() if ADAPTIVE_BATCHING else None,
+        supplier_top_k=SUPPLIER_TOP_K,
+        recipes=recipes,
     )
     machine2 = MachineCNPAgent(
         f"machine2@{DOMAIN}", PWD, env=env,
@@ -71,12 +148,13 @@ async def main():
         name="M2",
         maintenance=maintenance,
         failure_rate=0.04,
-        capabilities=["mixing", "baking", "packaging"]
+        capabilities=["mixing", "baking", "packaging"],
+        station_mode=STATION_MODE,
+        batch_policy=AdaptiveBatchPolicy() if ADAPTIVE_BATCHING else None,
+        supplier_top_k=SUPPLIER_TOP_K,
+        recipes=recipes,
     )
 
-    await machine1.start(auto_register=True)
-    await machine2.start(auto_register=True)
-
     # === Supervisor ===
     supervisor = SupervisorAgent(
         f"supervisor@{DOMAIN}", PWD, env=env,
@@ -84,56 +162,82 @@ async def main():
         refill_amount={"flour": 30, "sugar": 20, "butter": 10},
         supply_agent_ref=supplierA
     )
-    await supervisor.start(auto_register=True)
 
+    # === Arranque em paralelo, por fases ===
+    # participantes primeiro, para que as primeiras CFPs das máquinas tenham resposta
+    boot = AgentBootstrapper(concurrency=BOOT_CONCURRENCY)
+    await boot.start([robot1, robot2, supplierA, supplierB, maintenance], "participantes")
+    await boot.start([machine1, machine2], "máquinas")
+    await boot.start([supervisor], "supervisor")
+
+    metrics_server = None
+    if METRICS_PORT is not None:
+        metrics_server = MetricsServer(env, port=METRICS_PORT)
+        await metrics_server.start()
 
     # === Simulation Loop ===
+    # O main é o único relógio: só aqui se chama env.tick().
+    # A simulação termina assim que o sistema fica quiescente
+    # (sem conversas em aberto, jobs, reparações, entregas nem stock/refills).
     MAX_TICKS = 500
-    idle_ticks = 0
 
-    # lista de máquinas, para verificarmos se há jobs ativos
-    machines = [machine1, machine2]
+    profiler = None
+    if MEMORY_PROFILE_EVERY is not None:
+        MAX_TICKS = MEMORY_PROFILE_TICKS
+        profiler = MemoryProfiler(every=MEMORY_PROFILE_EVERY, warmup=MEMORY_PROFILE_TICKS // 5)
+        watch_bounded(profiler, env)
+        profiler.start()
+        profiler.sample(env.time)
 
     while env.time < MAX_TICKS:
         # avança o tempo global
         await env.tick()
+        if profiler is not None:
+            profiler.maybe_sample(env.time)
 
-        # há algum job ainda a ser processado ou em fila?
-        active_jobs = any(
-            (m.current_job is not None) or (len(m.job_queue) > 0)
-            for m in machines
-        )
-
-        # critério de "inatividade":
-        # - não há CNP pendentes (cnp_cfp == cnp_accepts)
-        # - E não há jobs em processamento
-        if env.metrics["cnp_cfp"] == env.metrics["cnp_accepts"] and not active_jobs:
-            idle_ticks += 1
-        else:
-            idle_ticks = 0
-
-        if idle_ticks >= 10:
-            print("Nenhum novo contrato nem jobs ativos nos últimos 10 ticks. Terminando simulação.")
+        if profiler is None and env.is_quiescent():
+            print(f"Sistema quiescente no tick {env.time}. Terminando simulação.")
             break
 
-        await asyncio.sleep(0.1)
-
     print("Execução terminada (Multi-Machine CNP + Pipeline + Manutenção).")
 
     # === Mostrar métricas finais (útil para relatório) ===
     print("\n=== MÉTRICAS FINAIS ===")
     for k, v in env.metrics.items():
         print(f"{k}: {v}")
+    if env.metrics["deliveries"]:
+        print(
+            f"latência média de entrega: "
+            f"{env.metrics['delivery_latency_ticks'] / env.metrics['deliveries']:.2f} ticks"
+        )
+    print()
+    print(env.tracer.format_report())
+    if env.faults is not None:
+        print()
+        print(env.faults.format_report(env))
+    if env.backlog is not None:
+        print()
+        print(env.backlog.format_report())
+    if RUN_RECORD is not None:
+        record = record_run(env)
+        save_run(record, RUN_RECORD)
+        print()
+        print(ScheduleOracle(record).format_report())
+    if profiler is not None:
+        profiler.sample(env.time)
+        profiler.stop()
+        print()
+        print(profiler.format_report(
+            MEMORY_BUDGET_KB * 1024 if MEMORY_BUDGET_KB is not None else None
+        ))
+
+    if metrics_server is not None:
+        await metrics_server.stop()
 
     # === Stop Agents ===
-    await robot1.stop()
-    await robot2.stop()
-    await machine1.stop()
-    await machine2.stop()
-    await supplierA.stop()
-    await supplierB.stop()
-    await maintenance.stop()
-    await supervisor.stop()
+    await boot.stop(
+        [robot1, robot2, machine1, machine2, supplierA, supplierB, maintenance, supervisor]
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,557 @@
+# memprofile.py
+# -*- coding: utf-8 -*-
+"""
+Perfil de memória em execuções longas: a memória cresce com o tempo?
+
+MemoryProfiler amostra, a cada `every` ticks, o RSS do processo e a
+memória alocada por Python (tracemalloc), guardando snapshots para
+atribuir o crescimento às linhas de código que o alocaram. O
+crescimento é medido por 10k ticks (declive dos mínimos quadrados)
+depois do aquecimento, descontando o tamanho dos deques limitados
+(tracer, janelas de avaria, amostras do backlog) que ainda estejam a
+encher, e comparado com um orçamento.
+
+Pode ser usado dentro do main.py (MEMORY_PROFILE_EVERY) ou em modo
+headless (sem XMPP): um cenário com semente em que os agentes reais
+(MachineCNPAgent com delegação, SupplyCNPAgent com pending_transports,
+RobotAgent, MaintenanceAgent com a repair_queue) são criados sem
+arrancar o SPADE, trocam mensagens por um MessageBus em memória e são
+conduzidos tick a tick pelo ambiente real.
+
+Uso:
+    python memprofile.py --ticks 100000 --every 10000 --budget-kb 256
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tracemalloc
+from collections import deque
+
+from agents.machine_cnp_agent import MachineCNPAgent
+from agents.maintenance_agent import MaintenanceAgent
+from agents.robot_agent import RobotAgent
+from agents.supply_cnp_agent import SupplyCNPAgent
+from environment import FactoryEnvironment
+from orders import Backlog, OrderStream
+from recipes import FULL_PIPELINE
+from tracing import JobTracer
+
+PER_TICKS = 10000  # unidade do crescimento reportado
+
+
+def rss_bytes():
+    """RSS atual do processo (Linux: /proc; senão o pico via resource; None se indisponível)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def deep_size(obj, seen=None):
+    """Bytes de um objeto e do que contém (dicts, listas, tuplos, conjuntos, deques)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+
+def slope(points):
+    """Declive (mínimos quadrados) de [(x, y)]; 0.0 com menos de 2 pontos."""
+    if len(points) < 2:
+        return 0.0
+    n = len(points)
+    mx = sum(x for x, _ in points) / n
+    my = sum(y for _, y in points) / n
+    var = sum((x - mx) ** 2 for x, _ in points)
+    if not var:
+        return 0.0
+    return sum((x - mx) * (y - my) for x, y in points) / var
+
+
+class MemoryProfiler:
+    """
+    Amostras (tick, RSS, bytes do tracemalloc, bytes dos deques limitados)
+    e snapshots de alocação.
+
+    - `warmup`: ticks iniciais ignorados no crescimento;
+    - `frames`: profundidade das stack traces guardadas pelo tracemalloc;
+    - `top`: número de linhas de alocação no relatório.
+    Estruturas limitadas (deques com maxlen, ou outro contentor com o
+    limite dado a watch()) registadas com watch() só
+    deixam de crescer quando enchem: o seu tamanho é descontado em cada
+    amostra, para que a janela de crescimento (da primeira amostra depois
+    do aquecimento em diante) não conte o enchimento como fuga.
+    """
+
+    def __init__(self, every=1000, warmup=0, frames=1, top=10):
+        self.every = every
+        self.warmup = warmup
+        self.frames = frames
+        self.top = top
+
+        self.samples = []  # (tick, rss, traced, bytes dos deques limitados)
+        self.baseline = None  # (tick, snapshot) no início da janela de crescimento
+        self.last = None      # (tick, snapshot) mais recente
+        self._started_tracing = False
+
+        self.bounded = {}        # nome → (contentor, limite de entradas)
+        self.bounded_full = {}   # nome → tick da primeira amostra em que estava cheio
+        self.window_start = None  # tick do início da janela de crescimento
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def watch(self, name, container, maxlen=None):
+        self.bounded[name] = (container, container.maxlen if maxlen is None else maxlen)
+
+    def maybe_sample(self, tick):
+        if tick % self.every == 0:
+            self.sample(tick)
+
+    def sample(self, tick):
+        bounded = sum(deep_size(c) for c, _ in self.bounded.values())
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        # bytes do snapshot filtrado: os próprios snapshots guardados (alocados
+        # em tracemalloc.py) crescem com o número de blocos e não contam
+        traced = sum(stat.size for stat in snapshot.statistics("filename"))
+        self.samples.append((tick, rss_bytes(), traced, bounded))
+        for name, (container, maxlen) in self.bounded.items():
+            if name not in self.bounded_full and len(container) >= maxlen:
+                self.bounded_full[name] = tick
+
+        # só se guardam o snapshot de referência e o último
+        if self.window_start is None:
+            self.baseline = (tick, snapshot)
+            if tick >= self.warmup:
+                self.window_start = tick
+        else:
+            self.last = (tick, snapshot)
+
+    # ------------------------- relatório -------------------------
+
+    def window(self):
+        """Amostras da janela de crescimento (vazia durante o aquecimento)."""
+        if self.window_start is None:
+            return []
+        return [s for s in self.samples if s[0] >= self.window_start]
+
+    def measured(self):
+        """True se a janela tem amostras suficientes (2) para um declive."""
+        return len(self.window()) >= 2
+
+    def growth(self, per=PER_TICKS):
+        """
+        Crescimento (bytes por `per` ticks) do tracemalloc e do RSS na janela de
+        crescimento, sem os deques limitados; sem medição é 0.0/None.
+        """
+        steady = self.window()
+        if len(steady) < 2:
+            return {"traced": 0.0, "rss": None}
+        traced = slope([(t, b - d) for t, _, b, d in steady]) * per
+        rss = [(t, r - d) for t, r, _, d in steady if r is not None]
+        return {"traced": traced, "rss": slope(rss) * per if rss else None}
+
+    def top_sites(self):
+        """Linhas que mais cresceram entre o fim do aquecimento e o último snapshot."""
+        if self.last is None:
+            return []
+        (t0, first), (t1, last) = self.baseline, self.last
+        sites = []
+        for stat in last.compare_to(first, "lineno")[:self.top]:
+            frame = stat.traceback[0]
+            sites.append({
+                "site": f"{frame.filename}:{frame.lineno}",
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+                "size": stat.size,
+                "per_10k": stat.size_diff * PER_TICKS / max(1, t1 - t0),
+            })
+        return sites
+
+    def report(self, budget=None):
+        growth = self.growth()
+        first, last = (self.samples[0], self.samples[-1]) if self.samples else ((0, None, 0, 0),) * 2
+        measured = self.measured()
+        return {
+            "ticks": last[0],
+            "samples": len(self.samples),
+            "rss_start": first[1],
+            "rss_end": last[1],
+            "traced_start": first[2],
+            "traced_end": last[2],
+            "window_start": self.window_start,
+            "measured": measured,
+            "bounded_bytes": last[3],
+            "bounded": {
+                name: {"size": len(c), "maxlen": maxlen, "full_at": self.bounded_full.get(name)}
+                for name, (c, maxlen) in self.bounded.items()
+            },
+            "growth_per_10k": growth["traced"],
+            "rss_growth_per_10k": growth["rss"],
+            "budget_per_10k": budget,
+            "over_budget": measured and budget is not None and growth["traced"] > budget,
+            "top_sites": self.top_sites(),
+        }
+
+    def format_report(self, budget=None):
+        r = self.report(budget)
+
+        def kb(v):
+            return "n/d" if v is None else f"{v / 1024:.1f} KB"
+
+        lines = [
+            "=== MEMÓRIA ===",
+            f"ticks={r['ticks']} amostras={r['samples']}",
+            f"RSS: {kb(r['rss_start'])} → {kb(r['rss_end'])} "
+            f"(crescimento {kb(r['rss_growth_per_10k'])}/10k ticks)",
+            f"tracemalloc: {kb(r['traced_start'])} → {kb(r['traced_end'])} "
+            f"(crescimento {kb(r['growth_per_10k'])}/10k ticks)",
+        ]
+        for name, b in r["bounded"].items():
+            full = f"cheio no tick {b['full_at']}" if b["full_at"] is not None else "a encher"
+            lines.append(f"  {name}: {b['size']}/{b['maxlen']} ({full})")
+        if r["bounded"]:
+            lines.append(f"deques limitados: {kb(r['bounded_bytes'])} (descontados do crescimento)")
+        if not r["measured"]:
+            lines.append("sem janela de crescimento: execução curta demais para o aquecimento e a amostragem")
+        else:
+            lines.append(f"janela de crescimento desde o tick {r['window_start']}")
+        if budget is not None:
+            status = "sem medição" if not r["measured"] else "EXCEDIDO" if r["over_budget"] else "ok"
+            lines.append(f"orçamento: {kb(budget)}/10k ticks — {status}")
+        if r["top_sites"]:
+            lines.append("linhas com maior crescimento:")
+        for s in r["top_sites"]:
+            lines.append(
+                f"  {s['size_diff'] / 1024:+9.1f} KB ({s['count_diff']:+d} blocos, "
+                f"{s['per_10k'] / 1024:+.1f} KB/10k ticks) {s['site']}"
+            )
+        return "\n".join(lines)
+
+
+# ------------------------- cenário headless -------------------------
+
+class MessageBus:
+    """
+    Entrega de mensagens em memória entre os agentes reais (sem XMPP).
+    Cada agente tem uma caixa lida pelo seu Loopback; quem tem handler
+    (robots, máquinas) recebe a mensagem logo à chegada.
+    """
+
+    def __init__(self):
+        self.inboxes = {}
+        self.handlers = {}
+
+    @staticmethod
+    def bare(jid):
+        return str(jid).split("/")[0]
+
+    def register(self, agent, handler=None):
+        jid = self.bare(agent.jid)
+        self.inboxes[jid] = deque()
+        if handler is not None:
+            self.handlers[jid] = handler
+        return Loopback(agent, self)
+
+    async def deliver(self, sender, msg):
+        msg.sender = str(sender.jid)
+        to = self.bare(msg.to)
+        handler = self.handlers.get(to)
+        if handler is not None:
+            await handler(msg)
+        elif to in self.inboxes:
+            self.inboxes[to].append(msg)
+
+
+class Loopback:
+    """Behaviour em memória: send() pelo MessageBus e receive() sem esperar."""
+
+    def __init__(self, agent, bus):
+        self.agent = agent
+        self.bus = bus
+        self.inbox = bus.inboxes[bus.bare(agent.jid)]
+
+    async def send(self, msg):
+        await self.bus.deliver(self.agent, msg)
+
+    async def receive(self, timeout=None):
+        return self.inbox.popleft() if self.inbox else None
+
+
+async def quiet(msg):
+    pass
+
+
+class HeadlessProcurement:
+    """
+    CNPInitiator do MachineCNPAgent real, um passo por tick: os mesmos
+    passos da ronda (prepare_round, open_round, receive_proposals,
+    award_round, receive_delivery, close_round), com as esperas do
+    behaviour (propostas, INFORM, backoff) como prazos verificados em
+    cada tick.
+    """
+
+    def __init__(self, machine, bus):
+        self.machine = machine
+        # as mensagens entram logo na caixa por conversa (como no receive do SPADE)
+        self.behaviour = bus.register(machine, handler=self._put)
+        self.round = None
+        self.deadline = 0
+        self.resume_at = 0
+
+    async def _put(self, msg):
+        self.machine.mailbox.put(msg)
+
+    async def step(self):
+        agent, env = self.machine, self.machine.env
+        if agent.is_failed or env.time < self.resume_at:
+            return
+        if self.round is not None:
+            await self._advance()
+            return
+        if not await agent.prepare_round(self.behaviour):
+            return
+        self.round = await agent.open_round(self.behaviour)
+        self.deadline = env.time + agent.cfp_timeout
+
+    async def _advance(self):
+        agent, env, rnd = self.machine, self.machine.env, self.round
+
+        if rnd["winner"] is None:
+            done = await agent.receive_proposals(self.behaviour, rnd, timeout=0)
+            if not done and env.time < self.deadline:
+                return
+            if not await agent.award_round(self.behaviour, rnd):
+                self.round = None
+                self.resume_at = env.time + agent.random_stream("backoff").randint(5, 8)
+                return
+            self.deadline = env.time + agent.inform_timeout
+            return
+
+        reply = await agent.receive_delivery(self.behaviour, rnd, timeout=0)
+        if reply is None and env.time < self.deadline:
+            return
+        await agent.close_round(rnd, reply)
+        self.round = None
+        self.resume_at = env.time + agent.random_stream("backoff").randint(3, 6)
+
+
+class HeadlessSupplier:
+    """
+    Participant do SupplyCNPAgent real (pending_transports, leilões de
+    robots, re-leilões, QUERY-REF), a tratar em cada tick as mensagens
+    que chegaram; refill periódico como o SupervisorAgent.
+    """
+
+    def __init__(self, supplier, bus, refill_every=10, refill_amount=None):
+        self.supplier = supplier
+        self.refill_every = refill_every
+        self.refill_amount = refill_amount or {"flour": 30, "sugar": 20, "butter": 10}
+        loopback = bus.register(supplier)
+        self.inbox = loopback.inbox
+        self.behaviour = supplier.Participant()
+        self.behaviour.agent = supplier
+        self.behaviour.send = loopback.send
+        self.behaviour.receive = loopback.receive
+
+    async def step(self):
+        supplier = self.supplier
+        if supplier.env.time % self.refill_every == 0:
+            for k, v in self.refill_amount.items():
+                supplier.stock[k] += v
+        await self.behaviour.run()
+        while self.inbox or supplier.mailbox.default:
+            await self.behaviour.run()
+
+
+class HeadlessRobot:
+    """
+    TransportManagerBehaviour + DeliveryBehaviour do RobotAgent real:
+    responde a CFP/ACCEPT/CANCEL à chegada (o fornecedor recebe todas as
+    propostas no mesmo tick) e faz as viagens da rota a contar ticks.
+    """
+
+    def __init__(self, robot, bus):
+        self.robot = robot
+        self.behaviour = bus.register(robot, handler=self.handle)
+        self.delivery = None  # (entrada da rota, distância, tick de chegada)
+
+    async def handle(self, msg):
+        pf = msg.metadata.get("performative")
+        if pf == "cfp":
+            reply = await self.robot.build_proposal(msg)
+            if reply is not None:
+                await self.behaviour.send(reply)
+        elif pf == "accept-proposal":
+            await self.robot.enqueue_task(msg)
+        elif pf == "cancel":
+            self.robot.cancel_task(msg.metadata.get("thread"))
+
+    async def step(self):
+        robot, env = self.robot, self.robot.env
+        if self.delivery is None:
+            if robot.route and not robot.is_down():
+                entry, distance = robot.start_next_delivery()
+                self.delivery = (entry, distance, env.time + robot.travel_ticks(distance))
+            return
+        entry, distance, due = self.delivery
+        if env.time >= due:
+            self.delivery = None
+            for inform in await robot.finish_delivery(entry, distance):
+                await self.behaviour.send(inform)
+
+
+def watch_bounded(profiler, env):
+    """Estruturas limitadas do ambiente e dos fornecedores registados seguidas pelo profiler."""
+    profiler.watch("tracer.finished", env.tracer.finished)
+    profiler.watch("failure_windows", env.failure_windows)
+    if env.backlog is not None:
+        profiler.watch("backlog.samples", env.backlog.samples)
+        profiler.watch("backlog.lead_times", env.backlog.lead_times)
+    for a in env.agents:
+        if getattr(a, "is_supplier", False):
+            profiler.watch(f"{a.agent_name}.delivered", a.delivered, a.max_delivered)
+
+
+async def run_headless(ticks, profiler, seed=0, machines=2, order_rate=0.1, failure_rate=0.02,
+                       suppliers=2, robots=2, bounded_size=None):
+    """
+    Executa o cenário headless durante `ticks` ticks, amostrando com `profiler`.
+    Os agentes são os reais (MachineCNPAgent, SupplyCNPAgent, RobotAgent,
+    MaintenanceAgent), criados sem arrancar o SPADE e ligados por um
+    MessageBus em memória. `bounded_size` muda o maxlen dos deques
+    limitados do ambiente (None = tamanhos normais).
+    """
+    env = FactoryEnvironment(seed=seed)
+    env.tick_delay = 0
+    env.external_failure_rate = failure_rate
+    if bounded_size is not None:
+        env.tracer = JobTracer(max_finished=bounded_size)
+        env.failure_windows = deque(maxlen=bounded_size)
+    env.set_order_stream(
+        OrderStream("poisson", rate=order_rate, rng=env.random_streams.stream("orders")),
+        Backlog(max_samples=bounded_size) if bounded_size is not None else None,
+    )
+    env.robots = []
+    bus = MessageBus()
+
+    maintenance = MaintenanceAgent("maintenance@headless", "", env=env)
+    maintenance.log = quiet
+    env.set_maintenance_agent(maintenance)
+
+    drivers = []
+    supplier_jids = []
+    for i in range(suppliers):
+        supplier = SupplyCNPAgent(f"supplier{i + 1}@headless", "", env=env, name=chr(ord("A") + i))
+        supplier.log = quiet
+        env.register_agent(supplier)
+        supplier_jids.append(f"supplier{i + 1}@headless")
+        drivers.append(HeadlessSupplier(supplier, bus))
+
+    for i in range(robots):
+        robot = RobotAgent(f"robot{i + 1}@headless", "", env=env, name=f"R{i + 1}")
+        robot.log = quiet
+        env.register_agent(robot)
+        env.robots.append(robot.jid)
+        drivers.append(HeadlessRobot(robot, bus))
+
+    capabilities = [FULL_PIPELINE[:3], FULL_PIPELINE[1:]]
+    for i in range(machines):
+        machine = MachineCNPAgent(
+            f"machine{i + 1}@headless", "", env=env, suppliers=supplier_jids, name=f"M{i + 1}",
+            maintenance=maintenance, failure_rate=0.0, capabilities=capabilities[i % 2],
+        )
+        machine.log = quiet
+        env.register_agent(machine)
+        drivers.append(HeadlessProcurement(machine, bus))
+
+    watch_bounded(profiler, env)
+    profiler.start()
+    profiler.sample(0)
+    for _ in range(ticks):
+        await env.tick()
+        for driver in drivers:
+            await driver.step()
+        profiler.maybe_sample(env.time)
+    if env.time % profiler.every:
+        profiler.sample(env.time)
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfil de memória de execuções longas (headless).")
+    parser.add_argument("--ticks", type=int, default=100000)
+    parser.add_argument("--every", type=int, default=10000, help="ticks entre amostras")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--machines", type=int, default=2)
+    parser.add_argument("--order-rate", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--suppliers", type=int, default=2)
+    parser.add_argument("--robots", type=int, default=2)
+    parser.add_argument(
+        "--bounded-size", type=int, default=0,
+        help="maxlen dos deques limitados do ambiente (0 = tamanhos normais)",
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=0.2,
+        help="fração inicial da execução ignorada no crescimento",
+    )
+    parser.add_argument("--frames", type=int, default=1, help="profundidade das stack traces")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--budget-kb", type=float, default=None,
+        help="crescimento máximo (KB por 10k ticks); acima disto termina com código 1 "
+             "(código 2 se não houver janela de crescimento)",
+    )
+    parser.add_argument("--json", action="store_true", help="imprimir o resultado em JSON")
+    args = parser.parse_args()
+
+    profiler = MemoryProfiler(
+        every=args.every, warmup=int(args.ticks * args.warmup), frames=args.frames, top=args.top
+    )
+    asyncio.run(run_headless(
+        args.ticks, profiler, seed=args.seed, machines=args.machines,
+        order_rate=args.order_rate, failure_rate=args.failure_rate,
+        suppliers=args.suppliers, robots=args.robots, bounded_size=args.bounded_size or None,
+    ))
+    profiler.stop()
+
+    budget = args.budget_kb * 1024 if args.budget_kb is not None else None
+    report = profiler.report(budget)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(profiler.format_report(budget))
+    if report["over_budget"]:
+        sys.exit(1)
+    sys.exit(2 if budget is not None and not report["measured"] else 0)
+
+
+if __name__ == "__main__":
+    main()
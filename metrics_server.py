@@ -0,0 +1,172 @@
+# metrics_server.py
+# -*- coding: utf-8 -*-
+import asyncio
+import ipaddress
+import json
+
+
+def snapshot(env):
+    """Estado atual da simulação (métricas, máquinas, fornecedores, robots)."""
+    machines, suppliers, robots = {}, {}, {}
+
+    for a in env.agents:
+        name = getattr(a, "agent_name", str(getattr(a, "jid", a)))
+
+        if getattr(a, "is_machine", False):
+            running = [job["id"] for job, _ in a.running_jobs()]
+            machines[name] = {
+                "failed": bool(a.is_failed),
+                "repairing": a.repair_ticks_remaining > 0,
+                "current_job": running[0] if running else None,
+                "running_jobs": running,
+                "queue_length": len(a.job_queue),
+            }
+        elif getattr(a, "is_supplier", False):
+            suppliers[name] = dict(a.stock)
+        elif getattr(a, "is_robot", False):
+            robots[name] = {
+                "busy": bool(a.busy),
+                "route_length": len(getattr(a, "route", [])),
+            }
+
+    return {
+        "time": env.time,
+        "metrics": dict(env.metrics),
+        "machines": machines,
+        "suppliers": suppliers,
+        "robots": robots,
+    }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def to_prometheus(snap):
+    """Converte um snapshot para o formato de texto do Prometheus."""
+    lines = [
+        "# TYPE factory_time gauge",
+        f"factory_time {snap['time']}",
+    ]
+
+    # env.metrics só cresce: contadores (sufixo _total)
+    for k, v in snap["metrics"].items():
+        lines.append(f"# TYPE factory_{k}_total counter")
+        lines.append(f"factory_{k}_total {v}")
+
+    machine_fields = [
+        ("failed", "factory_machine_failed"),
+        ("repairing", "factory_machine_repairing"),
+        ("queue_length", "factory_machine_queue_length"),
+    ]
+    for field, metric in machine_fields:
+        lines.append(f"# TYPE {metric} gauge")
+        for name, m in snap["machines"].items():
+            lines.append(f'{metric}{{machine="{_label(name)}"}} {int(m[field])}')
+
+    lines.append("# TYPE factory_machine_busy gauge")
+    for name, m in snap["machines"].items():
+        busy = int(m["current_job"] is not None)
+        lines.append(f'factory_machine_busy{{machine="{_label(name)}"}} {busy}')
+
+    lines.append("# TYPE factory_supplier_stock gauge")
+    for name, stock in snap["suppliers"].items():
+        for ingredient, qty in stock.items():
+            lines.append(
+                f'factory_supplier_stock{{supplier="{_label(name)}",ingredient="{_label(ingredient)}"}} {qty}'
+            )
+
+    lines.append("# TYPE factory_robot_busy gauge")
+    for name, r in snap["robots"].items():
+        lines.append(f'factory_robot_busy{{robot="{_label(name)}"}} {int(r["busy"])}')
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Endpoint HTTP local (só loopback, opt-in) para acompanhar uma simulação.
+
+    - GET /metrics → formato de texto do Prometheus
+    - GET /state   → snapshot JSON
+    - GET /stream  → stream JSON (uma linha por tick) até o cliente fechar
+    """
+
+    def __init__(self, env, host="127.0.0.1", port=8000, stream_interval=0.5):
+        if not ipaddress.ip_address(host).is_loopback:
+            raise ValueError(f"MetricsServer só aceita endereços loopback (recebido {host}).")
+
+        self.env = env
+        self.host = host
+        self.port = port
+        self.stream_interval = stream_interval
+        self._server = None
+        self._clients = set()  # tasks dos pedidos em curso (ex.: /stream)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"[METRICS] Endpoint ativo em http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # wait_closed espera pelos handlers: fechar antes os /stream abertos
+            for task in list(self._clients):
+                task.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            request_line = await reader.readline()
+            # descartar cabeçalhos
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else "/"
+
+            if path == "/metrics":
+                body = to_prometheus(snapshot(self.env)).encode()
+                self._respond(writer, "200 OK", "text/plain; version=0.0.4", body)
+            elif path == "/state":
+                body = json.dumps(snapshot(self.env)).encode()
+                self._respond(writer, "200 OK", "application/json", body)
+            elif path == "/stream":
+                await self._stream(writer)
+            else:
+                self._respond(writer, "404 Not Found", "text/plain", b"not found\n")
+
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            self._clients.discard(task)
+
+    def _respond(self, writer, status, content_type, body):
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode()
+        )
+        writer.write(body)
+
+    async def _stream(self, writer):
+        """Envia um snapshot JSON por linha sempre que o tempo avança."""
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/x-ndjson\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        last_time = None
+        while not writer.is_closing():
+            if self.env.time != last_time:
+                last_time = self.env.time
+                writer.write(json.dumps(snapshot(self.env)).encode() + b"\n")
+                await writer.drain()
+            await asyncio.sleep(self.stream_interval)
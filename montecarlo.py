@@ -0,0 +1,356 @@
+# montecarlo.py
+# -*- coding: utf-8 -*-
+"""
+Estimador Monte Carlo (sem agentes) da fábrica.
+
+Simula milhares de réplicas em simultâneo com NumPy, usando a mesma
+dinâmica da simulação com agentes:
+  - falha por tick com probabilidade `failure_rate` (CNPInitiator)
+  - reparação de 3–8 ticks (MaintenanceAgent.on_tick)
+  - `stage_times` e pipeline por capability (MachineCNPAgent)
+  - stock dos fornecedores (10 de cada por pedido) e refill periódico
+  - delegação do job de uma máquina avariada para a máquina compatível
+    menos carregada (perdido se nenhuma puder)
+  - opcional (`arrival_rate`): produção por encomenda, como com
+    OrderStream/Backlog — encomendas de Poisson num backlog e as máquinas
+    só compram material para encomendas; o lead time médio é estimado
+    pela lei de Little (encomendas em aberto / taxa de chegada)
+
+Serve para fazer triagem de configurações; as escolhidas devem depois
+ser validadas com a simulação completa (main.py).
+
+Uso:
+    python montecarlo.py --reps 5000 --ticks 500
+    python montecarlo.py --arrival-rates 0.05,0.1,0.2,0.4
+"""
+import argparse
+import json
+
+import numpy as np
+
+from recipes import DEFAULT_STAGE_TIMES, FULL_PIPELINE
+
+# Espelha a configuração do main.py
+DEFAULT_CONFIG = {
+    "ticks": 500,
+    "machines": [
+        {"name": "M1", "failure_rate": 0.05, "capabilities": ["cutting", "mixing", "baking"]},
+        {"name": "M2", "failure_rate": 0.04, "capabilities": ["mixing", "baking", "packaging"]},
+    ],
+    "suppliers": [
+        {"name": "A", "stock": {"flour": 60, "sugar": 40, "butter": 30}},
+        {"name": "B", "stock": {"flour": 45, "sugar": 50, "butter": 25}},
+    ],
+    "refill": {"every": 10, "amount": {"flour": 30, "sugar": 20, "butter": 10}, "supplier": 0},
+    "order_amount": 10,         # stock retirado por pedido aceite (de cada ingrediente)
+    "repair_time": (3, 8),      # ticks, inclusive
+    "delivery_ticks": (2, 6),   # do accept até o job entrar na fila, inclusive
+    "backoff_ticks": (5, 8),    # espera após ronda sem propostas, inclusive
+    "cost": (15, 22),           # custo proposto pelos fornecedores, inclusive
+    "arrival_rate": None,       # encomendas/tick (Poisson); None = produção pelo abastecimento
+}
+
+
+class MonteCarloFactory:
+    """Modelo vetorizado: arrays com forma (réplicas, máquinas)."""
+
+    def __init__(self, config=None, reps=1000, seed=None, rng=None):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.reps = reps
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+
+        cfg = self.config
+        self.machines = cfg["machines"]
+        self.ingredients = list(cfg["suppliers"][0]["stock"])
+
+        # pipeline e tempos por máquina
+        self.pipelines = []
+        for m in self.machines:
+            stage_times = {**DEFAULT_STAGE_TIMES, **m.get("stage_times", {})}
+            stages = [s for s in FULL_PIPELINE if s in m["capabilities"]]
+            self.pipelines.append([(s, stage_times[s]) for s in stages])
+
+        self.work = np.array([sum(t for _, t in p) for p in self.pipelines])
+        self.failure_rate = np.array([m["failure_rate"] for m in self.machines])
+
+    def _randint(self, bounds, size):
+        lo, hi = bounds
+        return self.rng.integers(lo, hi + 1, size=size)
+
+    def _stage_at(self, m, done):
+        """Etapa em que está um job da máquina m após `done` ticks de trabalho."""
+        cum = np.cumsum([t for _, t in self.pipelines[m]])
+        idx = np.minimum(np.searchsorted(cum, done, side="right"), len(cum) - 1)
+        return idx
+
+    def _remaining_on(self, k, stage):
+        """Ticks para terminar na máquina k um job que está na etapa `stage`."""
+        names = [s for s, _ in self.pipelines[k]]
+        if stage not in names:
+            return None
+        i = names.index(stage)
+        return sum(t for _, t in self.pipelines[k][i:])
+
+    def run(self, ticks=None):
+        cfg = self.config
+        ticks = ticks or cfg["ticks"]
+        R, M = self.reps, len(self.machines)
+        rows = np.arange(R)
+
+        stock = np.array(
+            [[s["stock"][i] for i in self.ingredients] for s in cfg["suppliers"]],
+            dtype=np.int64,
+        )
+        stock = np.broadcast_to(stock, (R,) + stock.shape).copy()  # (R, S, I)
+        refill = cfg.get("refill")
+        refill_amount = (
+            np.array([refill["amount"].get(i, 0) for i in self.ingredients]) if refill else None
+        )
+        amount = cfg["order_amount"]
+
+        failed = np.zeros((R, M), dtype=bool)
+        repair_left = np.zeros((R, M), dtype=np.int64)
+        job_left = np.zeros((R, M), dtype=np.int64)     # ticks até acabar o job atual
+        queue = np.zeros((R, M), dtype=np.int64)        # jobs completos em fila
+        arrival = np.zeros((R, M), dtype=np.int64)      # entrega a caminho (ticks)
+        backoff = np.zeros((R, M), dtype=np.int64)
+
+        out = {k: np.zeros(R, dtype=np.int64) for k in (
+            "jobs_completed", "jobs_delegated", "jobs_lost",
+            "machine_failures", "machine_downtime_ticks", "cnp_accepts",
+        )}
+
+        # produção por encomenda: encomendas por reclamar e em aberto (por réplica)
+        rate = cfg.get("arrival_rate")
+        backlog = np.zeros(R, dtype=np.int64)
+        open_orders = np.zeros(R, dtype=np.int64)
+        open_area = np.zeros(R, dtype=np.int64)
+        if rate is not None:
+            out["orders_arrived"] = np.zeros(R, dtype=np.int64)
+
+        for t in range(1, ticks + 1):
+            # encomendas que chegam
+            if rate is not None:
+                arrived = self.rng.poisson(rate, R)
+                backlog += arrived
+                open_orders += arrived
+                out["orders_arrived"] += arrived
+
+            # refill periódico
+            if refill and t % refill["every"] == 0:
+                stock[:, refill["supplier"], :] += refill_amount
+
+            # reparações
+            repairing = failed & (repair_left > 0)
+            repair_left[repairing] -= 1
+            failed &= ~(repairing & (repair_left == 0))
+            out["machine_downtime_ticks"] += failed.sum(axis=1)
+
+            # falhas
+            new_fail = ~failed & (self.rng.random((R, M)) < self.failure_rate)
+            if new_fail.any():
+                failed |= new_fail
+                repair_left[new_fail] = self._randint(cfg["repair_time"], new_fail.sum())
+                out["machine_failures"] += new_fail.sum(axis=1)
+                lost_before = out["jobs_lost"].copy()
+                for m in range(M):
+                    self._delegate(m, new_fail[:, m], failed, job_left, queue, out, rows)
+                # job perdido → a encomenda volta ao backlog
+                backlog += out["jobs_lost"] - lost_before
+
+            healthy = ~failed
+
+            # entregas que chegam → job em fila
+            arriving = arrival > 0
+            arrival[arriving] -= 1
+            landed = arriving & (arrival == 0)
+            queue += landed
+            out["cnp_accepts"] += landed.sum(axis=1)
+
+            # processamento
+            working = healthy & (job_left > 0)
+            job_left[working] -= 1
+            finished = working & (job_left == 0)
+            out["jobs_completed"] += finished.sum(axis=1)
+            open_orders -= finished.sum(axis=1)
+            open_area += open_orders
+
+            starting = healthy & ~working & (job_left == 0) & (queue > 0)
+            queue[starting] -= 1
+            job_left[starting] = np.broadcast_to(self.work, (R, M))[starting]
+
+            # ronda CNP para máquinas livres
+            backoff[backoff > 0] -= 1
+            idle = healthy & ~working & ~starting & (job_left == 0) & (queue == 0) \
+                & (arrival == 0) & (backoff == 0)
+            for m in range(M):
+                want = idle[:, m] if rate is None else idle[:, m] & (backlog > 0)
+                backlog -= self._procure(m, want, stock, amount, arrival, backoff, rows)
+
+        if rate is not None:
+            out["backlog_final"] = open_orders
+            # lei de Little: tempo médio em sistema = encomendas em aberto médias / taxa
+            out["order_lead_ticks"] = open_area / ticks / rate if rate > 0 else open_area * 0.0
+        return out
+
+    def _delegate(self, m, mask, failed, job_left, queue, out, rows):
+        """Delegação do job atual (e fila) de m para a máquina compatível menos carregada."""
+        with_job = mask & (job_left[:, m] > 0)
+        if with_job.any():
+            done = self.work[m] - job_left[:, m]
+            stage_idx = self._stage_at(m, done)
+            for si, (stage, _) in enumerate(self.pipelines[m]):
+                sel = with_job & (stage_idx == si)
+                if sel.any():
+                    self._hand_over(m, stage, sel, failed, job_left, queue, out, rows, count_lost=True)
+
+        with_queue = mask & (queue[:, m] > 0)
+        if with_queue.any():
+            first_stage = self.pipelines[m][0][0]
+            self._hand_over(m, first_stage, with_queue, failed, job_left, queue, out, rows, count_lost=False)
+
+    def _hand_over(self, m, stage, sel, failed, job_left, queue, out, rows, count_lost):
+        M = len(self.machines)
+        load = np.full((len(rows), M), np.inf)
+        remaining = {}
+        for k in range(M):
+            if k == m:
+                continue
+            rem = self._remaining_on(k, stage)
+            if rem is None:
+                continue
+            remaining[k] = rem
+            ok = ~failed[:, k]
+            load[ok, k] = job_left[ok, k] + queue[ok, k] * self.work[k]
+
+        target = np.argmin(load, axis=1)
+        has_target = sel & np.isfinite(load[rows, target])
+
+        if count_lost:
+            lost = sel & ~has_target
+            out["jobs_lost"] += lost
+            job_left[lost, m] = 0
+            for k, rem in remaining.items():
+                to_k = has_target & (target == k)
+                idle_k = to_k & (job_left[:, k] == 0)
+                job_left[idle_k, k] = rem
+                queue[to_k & ~idle_k, k] += 1
+            out["jobs_delegated"] += has_target
+            job_left[has_target, m] = 0
+        else:
+            # jobs em fila: passam todos; sem alvo ficam à espera da reparação
+            for k in remaining:
+                to_k = has_target & (target == k)
+                queue[to_k, k] += queue[to_k, m]
+                out["jobs_delegated"] += np.where(to_k, queue[:, m], 0)
+                queue[to_k, m] = 0
+
+    def _procure(self, m, mask, stock, amount, arrival, backoff, rows):
+        """
+        Ronda CNP: fornecedor mais barato com stock; sem propostas → backoff.
+        Devolve a máscara (por réplica) das máquinas servidas.
+        """
+        if not mask.any():
+            return mask
+        cfg = self.config
+        available = (stock >= amount).all(axis=2)              # (R, S)
+        cost = self._randint(cfg["cost"], available.shape).astype(float)
+        cost[~available] = np.inf
+        winner = np.argmin(cost, axis=1)
+        served = mask & available.any(axis=1)
+        refused = mask & ~served
+
+        stock[served, winner[served], :] -= amount
+        arrival[served, m] = self._randint(cfg["delivery_ticks"], served.sum())
+        backoff[refused, m] = self._randint(cfg["backoff_ticks"], refused.sum())
+        return served
+
+
+def summarize(results, ticks):
+    """Média, desvio e percentis de cada métrica (mais throughput por tick)."""
+    summary = {}
+    for k, v in results.items():
+        summary[k] = {
+            "mean": float(v.mean()),
+            "std": float(v.std()),
+            "p5": float(np.percentile(v, 5)),
+            "p50": float(np.percentile(v, 50)),
+            "p95": float(np.percentile(v, 95)),
+        }
+    throughput = results["jobs_completed"] / ticks
+    summary["throughput_per_tick"] = {
+        "mean": float(throughput.mean()),
+        "std": float(throughput.std()),
+        "p5": float(np.percentile(throughput, 5)),
+        "p50": float(np.percentile(throughput, 50)),
+        "p95": float(np.percentile(throughput, 95)),
+    }
+    return summary
+
+
+def sweep(config, rates, args):
+    """Throughput, crescimento do backlog e lead time para taxas de chegada crescentes."""
+    rows = []
+    for rate in rates:
+        model = MonteCarloFactory({**(config or {}), "arrival_rate": rate}, reps=args.reps, seed=args.seed)
+        s = summarize(model.run(args.ticks), args.ticks)
+        rows.append({
+            "arrival_rate": rate,
+            "throughput_per_tick": s["throughput_per_tick"]["mean"],
+            "backlog_growth_per_tick": s["backlog_final"]["mean"] / args.ticks,
+            "order_lead_ticks": s["order_lead_ticks"]["mean"],
+            "order_lead_ticks_p95": s["order_lead_ticks"]["p95"],
+        })
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"=== MONTE CARLO: TAXA DE CHEGADA ({args.reps} réplicas × {args.ticks} ticks) ===")
+    for r in rows:
+        print(
+            f"taxa={r['arrival_rate']:.3f}/tick: throughput={r['throughput_per_tick']:.3f}/tick "
+            f"backlog +{r['backlog_growth_per_tick']:.3f}/tick "
+            f"lead time≈{r['order_lead_ticks']:.1f} (p95 {r['order_lead_ticks_p95']:.1f}) ticks"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimador Monte Carlo da fábrica (sem agentes).")
+    parser.add_argument("--reps", type=int, default=5000)
+    parser.add_argument("--ticks", type=int, default=DEFAULT_CONFIG["ticks"])
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--config", help="ficheiro JSON que sobrepõe DEFAULT_CONFIG")
+    parser.add_argument("--json", action="store_true", help="imprimir o resumo em JSON")
+    parser.add_argument(
+        "--arrival-rates",
+        help="taxas de chegada de encomendas separadas por vírgulas (ex.: 0.05,0.1,0.2)",
+    )
+    args = parser.parse_args()
+
+    config = None
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = json.load(f)
+
+    if args.arrival_rates:
+        sweep(config, [float(r) for r in args.arrival_rates.split(",")], args)
+        return
+
+    model = MonteCarloFactory(config, reps=args.reps, seed=args.seed)
+    summary = summarize(model.run(args.ticks), args.ticks)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"=== MONTE CARLO ({args.reps} réplicas × {args.ticks} ticks) ===")
+    for k, s in summary.items():
+        print(
+            f"{k}: média={s['mean']:.3f} dp={s['std']:.3f} "
+            f"p5={s['p5']:.3f} p50={s['p50']:.3f} p95={s['p95']:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# oracle.py
+# -*- coding: utf-8 -*-
+"""
+Oráculo offline de escalonamento: quão longe do ótimo ficam os agentes?
+
+A partir do registo de uma execução (jobs concluídos e quando ficaram
+disponíveis, `capabilities`/`stage_times` das máquinas e janelas de
+avaria) procura um escalonamento com tempo de fluxo médio próximo do
+ótimo e compara-o com o que a fábrica descentralizada conseguiu. Em
+execuções contínuas (encomendas a chegar até ao fim) o makespan é
+praticamente o tick da última chegada, por isso o gap principal é o do
+tempo de fluxo; o do makespan fica como informação secundária.
+
+Modelo (flexible job shop):
+  - cada job tem as etapas do pipeline com que foi criado, por ordem;
+  - cada etapa pode correr em qualquer máquina com essa capability,
+    com duração (ticks por unidade) × unidades; os ticks por unidade são
+    a média observada no tracer para essa máquina/etapa (etapas não
+    interrompidas nem retomadas), ou stage_times[etapa] se a máquina
+    nunca a fez;
+  - uma máquina faz uma etapa de cada vez e não trabalha durante as
+    janelas de avaria (as avarias são conhecidas de antemão);
+  - o job só existe a partir da entrega dos materiais (o abastecimento
+    não é otimizado) e as delegações não têm custo de transporte.
+
+Solver: list scheduling (cada operação vai para a máquina onde acaba
+mais cedo) sobre uma ordem de operações melhorada por pesquisa local
+(trocas e reinserções aleatórias, aceitando movimentos não piores em
+(tempo de fluxo, makespan)).
+
+Uso:
+    python oracle.py run.json --iterations 5000
+"""
+import argparse
+import json
+import random
+
+
+def record_run(env):
+    """Registo de uma execução (serializável em JSON) a partir do ambiente."""
+    traces = list(env.tracer.finished) + list(env.tracer.jobs.values())
+
+    # ticks por unidade observados (env.time) em cada máquina/etapa; uma etapa
+    # retomada (depois de delegação ou reparação) só conta os ticks que faltavam
+    observed = {}
+    for trace in traces:
+        units = trace.get("units", 1) or 1
+        previous = None
+        for s in trace["stages"]:
+            resumed = previous is not None and previous["stage"] == s["stage"] and previous.get("interrupted")
+            previous = s
+            if s["end"] is None or s.get("interrupted") or resumed:
+                continue
+            observed.setdefault(s["machine"], {}).setdefault(s["stage"], []).append((s["end"] - s["start"]) / units)
+
+    machines = {
+        a.agent_name: {
+            "capabilities": list(a.pipeline_stages),
+            "stage_times": dict(a.stage_times),
+            "observed_times": {
+                stage: sum(v) / len(v) for stage, v in observed.get(a.agent_name, {}).items()
+            },
+        }
+        for a in env.agents if getattr(a, "is_machine", False)
+    }
+
+    jobs = []
+    for trace in traces:
+        ev = trace["events"]
+        if "created" not in ev or not trace.get("pipeline"):
+            continue
+        jobs.append({
+            "release": ev["created"],
+            "stages": trace["pipeline"],
+            "units": trace.get("units", 1),
+            "completed": ev.get("completed"),
+        })
+
+    return {
+        "horizon": env.time,
+        "machines": machines,
+        "failures": [list(w) for w in env.failure_windows],
+        "jobs": jobs,
+    }
+
+
+def save_run(record, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+
+
+def load_run(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ScheduleOracle:
+    """Pesquisa local sobre a ordem das operações (só jobs concluídos na execução)."""
+
+    def __init__(self, record, iterations=2000, seed=0):
+        self.record = record
+        self.iterations = iterations
+        self.rng = random.Random(seed)
+
+        self.machines = record["machines"]
+        self.jobs = [j for j in record["jobs"] if j.get("completed") is not None]
+
+        # máquina → janelas [início, fim) ordenadas; fim None = até ao fim da execução
+        horizon = record.get("horizon", 0)
+        self.windows = {name: [] for name in self.machines}
+        for name, start, end in record.get("failures", []):
+            if name in self.windows:
+                self.windows[name].append((start, max(start + 1, horizon) if end is None else end))
+        for w in self.windows.values():
+            w.sort()
+
+        # etapa → máquinas capazes
+        self.capable = {}
+        for name, m in self.machines.items():
+            for stage in m["capabilities"]:
+                self.capable.setdefault(stage, []).append(name)
+
+        missing = {s for j in self.jobs for s in j["stages"] if s not in self.capable}
+        if missing:
+            raise ValueError(f"Nenhuma máquina com as etapas {sorted(missing)}")
+
+    # ------------------------- modelo -------------------------
+
+    def duration(self, machine, stage, units):
+        m = self.machines[machine]
+        per_unit = m.get("observed_times", {}).get(stage, m["stage_times"][stage])
+        return max(1, round(per_unit * units))
+
+    def earliest_start(self, machine, ready, duration):
+        """Primeiro instante ≥ ready em que a etapa cabe fora das avarias."""
+        t = ready
+        for start, end in self.windows[machine]:
+            if t < end and t + duration > start:
+                t = end
+        return t
+
+    def decode(self, order):
+        """
+        Escalonamento de uma ordem de operações (cada job aparece uma vez
+        por etapa). Devolve (makespan, soma dos tempos de fluxo, operações).
+        """
+        free = {name: 0 for name in self.machines}
+        job_ready = [j["release"] for j in self.jobs]
+        next_stage = [0] * len(self.jobs)
+        ops = []
+
+        for i in order:
+            job = self.jobs[i]
+            stage = job["stages"][next_stage[i]]
+            next_stage[i] += 1
+
+            best = None
+            for name in self.capable[stage]:
+                d = self.duration(name, stage, job["units"])
+                start = self.earliest_start(name, max(free[name], job_ready[i]), d)
+                if best is None or start + d < best[2]:
+                    best = (name, start, start + d)
+
+            name, start, end = best
+            free[name] = end
+            job_ready[i] = end
+            ops.append({"job": i, "stage": stage, "machine": name, "start": start, "end": end})
+
+        makespan = max(job_ready, default=0)
+        flow = sum(end - j["release"] for end, j in zip(job_ready, self.jobs))
+        return makespan, flow, ops
+
+    def initial_orders(self):
+        """Ordens de partida: FIFO por job e por etapa (intercalando jobs)."""
+        by_release = sorted(range(len(self.jobs)), key=lambda i: self.jobs[i]["release"])
+        fifo = [i for i in by_release for _ in self.jobs[i]["stages"]]
+        depth = max((len(j["stages"]) for j in self.jobs), default=0)
+        staged = [i for k in range(depth) for i in by_release if k < len(self.jobs[i]["stages"])]
+        return [fifo, staged]
+
+    # ------------------------- solver -------------------------
+
+    def solve(self):
+        """Melhor escalonamento encontrado: {"makespan", "flow_time", "ops"}."""
+        if not self.jobs:
+            return {"makespan": 0, "flow_time": 0, "ops": []}
+
+        candidates = [(self.decode(o), o) for o in self.initial_orders()]
+        (makespan, flow, ops), order = min(candidates, key=lambda c: (c[0][1], c[0][0]))
+        best = (flow, makespan)
+
+        n = len(order)
+        for _ in range(self.iterations if n > 1 else 0):
+            new = list(order)
+            a, b = self.rng.sample(range(n), 2)
+            if self.rng.random() < 0.5:
+                new[a], new[b] = new[b], new[a]
+            else:
+                new.insert(b, new.pop(a))
+
+            result = self.decode(new)
+            if (result[1], result[0]) <= best:
+                best, order, ops = (result[1], result[0]), new, result[2]
+
+        return {"makespan": best[1], "flow_time": best[0], "ops": ops}
+
+    def lower_bound(self):
+        """Limite inferior do makespan (caminho crítico de cada job e carga total)."""
+        if not self.jobs:
+            return 0
+
+        def fastest(stage, units):
+            return min(self.duration(m, stage, units) for m in self.capable[stage])
+
+        job_bound = max(
+            j["release"] + sum(fastest(s, j["units"]) for s in j["stages"]) for j in self.jobs
+        )
+        work = sum(fastest(s, j["units"]) for j in self.jobs for s in j["stages"])
+        first = min(j["release"] for j in self.jobs)
+        load_bound = first + -(-work // len(self.machines))
+        return max(job_bound, load_bound)
+
+    # ------------------------- relatório -------------------------
+
+    def compare(self):
+        """Makespan e tempo de fluxo dos agentes vs. oráculo (e gap relativo)."""
+        solution = self.solve()
+        actual = max((j["completed"] for j in self.jobs), default=0)
+        actual_flow = sum(j["completed"] - j["release"] for j in self.jobs)
+        oracle = solution["makespan"]
+        actual_mean = actual_flow / len(self.jobs) if self.jobs else 0.0
+        oracle_mean = solution["flow_time"] / len(self.jobs) if self.jobs else 0.0
+        return {
+            "jobs": len(self.jobs),
+            "actual_makespan": actual,
+            "oracle_makespan": oracle,
+            "lower_bound": self.lower_bound(),
+            "makespan_gap": (actual - oracle) / oracle if oracle else 0.0,
+            "actual_mean_flow": actual_mean,
+            "oracle_mean_flow": oracle_mean,
+            "flow_gap": (actual_mean - oracle_mean) / oracle_mean if oracle_mean else 0.0,
+        }
+
+    def format_report(self):
+        r = self.compare()
+        return "\n".join([
+            "=== ORÁCULO DE ESCALONAMENTO (ticks) ===",
+            f"jobs concluídos: {r['jobs']}",
+            f"tempo de fluxo médio agentes: {r['actual_mean_flow']:.2f}  "
+            f"oráculo: {r['oracle_mean_flow']:.2f}",
+            f"gap de otimalidade (tempo de fluxo): {r['flow_gap']:.1%}",
+            f"makespan agentes: {r['actual_makespan']}  oráculo: {r['oracle_makespan']}  "
+            f"limite inferior: {r['lower_bound']} (gap {r['makespan_gap']:.1%})",
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oráculo offline de escalonamento.")
+    parser.add_argument("run", help="registo JSON de uma execução (main.py RUN_RECORD)")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="imprimir o resultado em JSON")
+    args = parser.parse_args()
+
+    oracle = ScheduleOracle(load_run(args.run), iterations=args.iterations, seed=args.seed)
+
+    if args.json:
+        print(json.dumps(oracle.compare(), indent=2))
+        return
+    print(oracle.format_report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# orders.py
+# -*- coding: utf-8 -*-
+import json
+import math
+import random
+from collections import deque
+
+from tracing import percentile
+
+
+class OrderStream:
+    """
+    Chegada de encomendas de clientes, tick a tick.
+
+    - "file": encomendas lidas de um JSON [{"tick": 3, "units": 2, "product": "cake"}, ...]
+    - "poisson": chegadas de Poisson com `rate` encomendas por tick
+    - "bursty": rajadas de Poisson (rate / burst_mean por tick), cada uma com
+      um número geométrico de encomendas de média `burst_mean` (mesma
+      taxa média que "poisson", mas com picos)
+
+    `products` ({nome: peso}) sorteia o produto de cada encomenda gerada
+    (None = sem produto). `until` (tick) termina o fluxo; None = sem fim.
+    """
+
+    def __init__(self, mode="poisson", rate=0.1, units=1, burst_mean=5,
+                 schedule=None, until=None, products=None, rng=None):
+        if mode not in ("file", "poisson", "bursty"):
+            raise ValueError(f"Modo de chegada desconhecido: {mode!r}")
+        self.mode = mode
+        self.rate = rate
+        self.units = units
+        self.burst_mean = burst_mean
+        self.until = until
+        self.products = products
+        self.rng = rng or random.Random()
+
+        # modo "file": tick → [(unidades, produto) de cada encomenda]
+        self.schedule = {}
+        for order in schedule or []:
+            self.schedule.setdefault(order["tick"], []).append(
+                (order.get("units", 1), order.get("product"))
+            )
+        if mode == "file" and until is None:
+            self.until = max(self.schedule, default=0)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls("file", schedule=json.load(f), **kwargs)
+
+    def _poisson(self, lam):
+        """Amostra de Poisson (método de Knuth; lam pequeno por tick)."""
+        limit, k, p = math.exp(-lam), 0, self.rng.random()
+        while p > limit:
+            k += 1
+            p *= self.rng.random()
+        return k
+
+    def _geometric(self, mean):
+        """Geométrica em {1, 2, ...} com a média dada."""
+        if mean <= 1:
+            return 1
+        return 1 + int(math.log(1 - self.rng.random()) / math.log(1 - 1 / mean))
+
+    def product_names(self):
+        """Produtos que esta fonte pode gerar (para validar contra o RecipeBook)."""
+        names = set(self.products or ())
+        for orders in self.schedule.values():
+            names.update(product for _, product in orders if product is not None)
+        return names
+
+    def _product(self):
+        if not self.products:
+            return None
+        names = list(self.products)
+        return self.rng.choices(names, weights=[self.products[n] for n in names])[0]
+
+    def arrivals(self, tick):
+        """(unidades, produto) de cada encomenda que chega neste tick."""
+        if self.until is not None and tick > self.until:
+            return []
+        if self.mode == "file":
+            return self.schedule.get(tick, [])
+        if self.mode == "poisson":
+            n = self._poisson(self.rate)
+        else:
+            bursts = self._poisson(self.rate / self.burst_mean)
+            n = sum(self._geometric(self.burst_mean) for _ in range(bursts))
+        return [(self.units, self._product()) for _ in range(n)]
+
+    def exhausted(self, tick):
+        return self.until is not None and tick >= self.until
+
+
+class Backlog:
+    """
+    Backlog global de encomendas (FIFO), partilhado pelas máquinas.
+
+    Uma máquina livre reclama unidades da encomenda mais antiga (claim),
+    procura os ingredientes só para essas unidades e, se o abastecimento
+    falhar, devolve-as (release). A encomenda fica concluída quando todas
+    as unidades saem da linha; o lead time vai da chegada à conclusão.
+    """
+
+    def __init__(self, max_orders=None, window=50, max_samples=10000):
+        self.max_orders = max_orders
+        self.window = window
+
+        self.queue = deque()  # encomendas com unidades por reclamar
+        self.open = {}        # order_id → encomenda (chegada e ainda não concluída)
+        self._next_id = 1
+
+        self.arrived = 0
+        self.rejected = 0
+        self.completed = 0
+        self.units_done = 0
+        self.lead_times = deque(maxlen=max_samples)
+        self.samples = deque(maxlen=max_samples)  # (tick, encomendas em aberto, unidades concluídas)
+
+    # ------------------------- encomendas -------------------------
+
+    def add(self, units, time, product=None):
+        if self.max_orders is not None and len(self.open) >= self.max_orders:
+            self.rejected += 1
+            return None
+        order = {
+            "id": self._next_id, "units": units, "unclaimed": units, "done": 0,
+            "arrived": time, "product": product,
+        }
+        self._next_id += 1
+        self.queue.append(order)
+        self.open[order["id"]] = order
+        self.arrived += 1
+        return order
+
+    def claim(self, max_units=None, accept=None):
+        """
+        Reclama unidades da encomenda mais antiga (que `accept(order)` aceite,
+        se indicado): (order_id, unidades) ou None.
+        """
+        for pos, order in enumerate(self.queue):
+            if accept is None or accept(order):
+                break
+        else:
+            return None
+        units = order["unclaimed"] if max_units is None else min(max_units, order["unclaimed"])
+        order["unclaimed"] -= units
+        if order["unclaimed"] == 0:
+            del self.queue[pos]
+        return order["id"], units
+
+    def product_of(self, order_id):
+        order = self.open.get(order_id)
+        return order["product"] if order else None
+
+    def release(self, order_id, units):
+        """Devolve unidades reclamadas (abastecimento falhou); voltam à frente da fila."""
+        order = self.open.get(order_id)
+        if order is None or units <= 0:
+            return
+        if order["unclaimed"] == 0:
+            self.queue.appendleft(order)
+        order["unclaimed"] += units
+
+    def complete(self, order_id, units, time):
+        order = self.open.get(order_id)
+        if order is None:
+            return
+        order["done"] += units
+        self.units_done += units
+        if order["done"] >= order["units"]:
+            del self.open[order_id]
+            self.completed += 1
+            self.lead_times.append(time - order["arrived"])
+
+    # ------------------------- relatório -------------------------
+
+    def sample(self, time):
+        self.samples.append((time, len(self.open), self.units_done))
+
+    def is_idle(self):
+        return not self.open
+
+    def report(self):
+        """
+        Throughput sustentado (unidades/tick nos últimos `window` ticks),
+        crescimento do backlog (encomendas/tick, declive entre a primeira e
+        a segunda metade da execução) e lead time das encomendas.
+        """
+        throughput = growth = 0.0
+        samples = list(self.samples)
+        if len(samples) >= 2:
+            (t0, _, u0), (t1, _, u1) = samples[-self.window:][0], samples[-1]
+            throughput = (u1 - u0) / max(1, t1 - t0)
+
+            # (tick médio, encomendas em aberto médias) de cada metade
+            half = len(samples) // 2
+            (ta, na), (tb, nb) = [
+                (sum(r[0] for r in rows) / len(rows), sum(r[1] for r in rows) / len(rows))
+                for rows in (samples[:half], samples[half:])
+            ]
+            if tb > ta:
+                growth = (nb - na) / (tb - ta)
+
+        lead = list(self.lead_times)
+        return {
+            "arrived": self.arrived,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "open": len(self.open),
+            "throughput": throughput,
+            "backlog_growth": growth,
+            "lead_time": {
+                "n": len(lead),
+                "p50": percentile(lead, 50),
+                "p95": percentile(lead, 95),
+                "p99": percentile(lead, 99),
+            },
+        }
+
+    def format_report(self):
+        r = self.report()
+        lt = r["lead_time"]
+        return "\n".join([
+            "=== ENCOMENDAS ===",
+            f"chegadas={r['arrived']} concluídas={r['completed']} em aberto={r['open']} "
+            f"rejeitadas={r['rejected']}",
+            f"throughput sustentado: {r['throughput']:.3f} unidades/tick",
+            f"crescimento do backlog: {r['backlog_growth']:+.3f} encomendas/tick",
+            f"lead time (ticks): n={lt['n']} p50={lt['p50']} p95={lt['p95']} p99={lt['p99']}",
+        ])
@@ -0,0 +1,132 @@
+# recipes.py
+# -*- coding: utf-8 -*-
+import json
+import random
+
+# pipeline completo da fábrica (referência universal) e tempos por omissão
+FULL_PIPELINE = ["cutting", "mixing", "baking", "packaging"]
+
+DEFAULT_STAGE_TIMES = {
+    "cutting": 2,
+    "mixing": 3,
+    "baking": 4,
+    "packaging": 2,
+}
+
+
+class Product:
+    """
+    Receita de um produto:
+    - ingredients: quantidades por unidade (vão no CFP e no batch do job)
+    - stages: sequência de etapas (subconjunto ordenado do pipeline)
+    - stage_times: ticks por unidade em cada etapa
+    - machine_times: exceções por máquina {agent_name: {etapa: ticks}}
+    """
+
+    def __init__(self, name, ingredients, stages=None, stage_times=None, machine_times=None):
+        self.name = name
+        self.ingredients = dict(ingredients)
+        self.stages = list(stages or FULL_PIPELINE)
+        self.stage_times = {**DEFAULT_STAGE_TIMES, **(stage_times or {})}
+        self.machine_times = machine_times or {}
+
+
+class RecipeBook:
+    """
+    Produtos da fábrica e tempos de mudança de produto (changeover).
+
+    changeovers[de][para] = ticks para reconfigurar uma máquina que passa
+    do produto `de` para `para` (default_changeover se não estiver na matriz;
+    0 para o mesmo produto). `mix` dá o peso de cada produto quando as
+    máquinas escolhem o que produzir (sem backlog de encomendas).
+    """
+
+    def __init__(self, products, changeovers=None, default_changeover=0, mix=None):
+        self.products = {p.name: p for p in products}
+        self.changeovers = changeovers or {}
+        self.default_changeover = default_changeover
+        self.mix = mix or {name: 1 for name in self.products}
+
+    @classmethod
+    def from_dict(cls, data):
+        products = [
+            Product(
+                name,
+                p["ingredients"],
+                stages=p.get("stages"),
+                stage_times=p.get("stage_times"),
+                machine_times=p.get("machine_times"),
+            )
+            for name, p in data["products"].items()
+        ]
+        return cls(
+            products,
+            changeovers=data.get("changeovers"),
+            default_changeover=data.get("default_changeover", 0),
+            mix=data.get("mix"),
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def product(self, name):
+        return self.products[name]
+
+    def pipeline(self, name, capabilities):
+        """Etapas do produto que uma máquina com `capabilities` faz, por ordem."""
+        return [s for s in self.products[name].stages if s in capabilities]
+
+    def stage_time(self, name, machine, stage):
+        p = self.products[name]
+        return p.machine_times.get(machine, {}).get(stage, p.stage_times[stage])
+
+    def changeover(self, from_product, to_product):
+        if from_product is None or to_product is None or from_product == to_product:
+            return 0
+        return self.changeovers.get(from_product, {}).get(to_product, self.default_changeover)
+
+    def choose(self, capabilities, rng=None):
+        """Produto a produzir (pesos de `mix`, só produtos com etapas nesta máquina)."""
+        names = [n for n in self.products if self.pipeline(n, capabilities) and self.mix.get(n, 0) > 0]
+        if not names:
+            return None
+        return (rng or random).choices(names, weights=[self.mix[n] for n in names])[0]
+
+
+class ChangeoverScheduler:
+    """
+    Escolhe o próximo job da fila de uma máquina agrupando produtos:
+    prefere o job mais antigo do produto para que a máquina já está
+    configurada (sem changeover). Para não adiar jobs indefinidamente,
+    um job ultrapassado `max_bypass` vezes passa obrigatoriamente à frente.
+    """
+
+    def __init__(self, recipes, max_bypass=4):
+        self.recipes = recipes
+        self.max_bypass = max_bypass
+
+    def select(self, queue, setup_of, can_start):
+        """
+        Índice do job a iniciar (ou None); can_start(job) diz se pode começar já
+        e setup_of(job) o produto para que está configurada a estação onde começaria.
+        """
+        startable = [i for i, job in enumerate(queue) if can_start(job)]
+        if not startable:
+            return None
+
+        head = startable[0]
+        if queue[head].get("bypassed", 0) >= self.max_bypass:
+            choice = head
+        else:
+            # menor changeover; empate → o mais antigo
+            choice = min(
+                startable,
+                key=lambda i: (self.recipes.changeover(setup_of(queue[i]), queue[i].get("product")), i),
+            )
+
+        for i in startable:
+            if i < choice:
+                queue[i]["bypassed"] = queue[i].get("bypassed", 0) + 1
+        return choice
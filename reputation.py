@@ -0,0 +1,99 @@
+# reputation.py
+# -*- coding: utf-8 -*-
+import random
+
+
+class SupplierReputation:
+    """
+    Cache de reputação dos fornecedores, do lado de uma máquina.
+
+    Por fornecedor guarda (médias exponenciais) o custo por unidade e o
+    lead time propostos, se a última resposta foi uma recusa, e quantas
+    entregas correram bem ou falharam. Cada entrada expira `ttl` ticks
+    depois da última observação; um fornecedor sem entrada volta a ser
+    "desconhecido".
+
+    Em cada ronda a CFP vai para:
+      - todos os fornecedores desconhecidos (nunca vistos ou expirados);
+      - os `top_k` melhores entre os conhecidos (menor custo esperado,
+        penalizado pelas entregas falhadas), excluindo os que recusaram;
+      - a cada `explore_every` rondas (ou se não sobrar nenhum), mais um
+        fornecedor ao acaso dos restantes, para que um fornecedor
+        reabastecido não fique esquecido.
+    top_k=None envia a todos (comportamento original).
+    """
+
+    def __init__(self, top_k=None, ttl=50, explore_every=5, alpha=0.3, rng=None):
+        self.top_k = top_k
+        self.ttl = ttl
+        self.explore_every = explore_every
+        self.alpha = alpha
+        self.rng = rng or random.Random()
+
+        self.entries = {}  # fornecedor → estatísticas
+        self.rounds = 0
+
+    # ------------------------- observações -------------------------
+
+    def _entry(self, supplier, now):
+        entry = self.entries.get(supplier)
+        if entry is None:
+            entry = {"cost": None, "lead": None, "refused": False, "delivered": 0, "failed": 0}
+            self.entries[supplier] = entry
+        entry["updated_at"] = now
+        return entry
+
+    def _ema(self, old, value):
+        return float(value) if old is None else old + self.alpha * (value - old)
+
+    def observe_proposal(self, supplier, cost_per_unit, lead_time, now):
+        entry = self._entry(supplier, now)
+        entry["cost"] = self._ema(entry["cost"], cost_per_unit)
+        entry["lead"] = self._ema(entry["lead"], lead_time)
+        entry["refused"] = False
+
+    def observe_refusal(self, supplier, now):
+        """REFUSE ou sem resposta dentro do cfp_timeout."""
+        self._entry(supplier, now)["refused"] = True
+
+    def observe_delivery(self, supplier, success, now):
+        entry = self._entry(supplier, now)
+        entry["delivered" if success else "failed"] += 1
+
+    # ------------------------- seleção -------------------------
+
+    def expire(self, now):
+        stale = [s for s, e in self.entries.items() if now - e["updated_at"] > self.ttl]
+        for s in stale:
+            del self.entries[s]
+        return len(stale)
+
+    def score(self, supplier):
+        """Custo esperado por unidade entregue (menor é melhor; None se sem dados)."""
+        entry = self.entries.get(supplier)
+        if entry is None or entry["refused"] or entry["cost"] is None:
+            return None
+        success = (entry["delivered"] + 1) / (entry["delivered"] + entry["failed"] + 1)
+        return entry["cost"] / success
+
+    def select(self, suppliers, now):
+        """Fornecedores a quem enviar a CFP nesta ronda (pela ordem de `suppliers`)."""
+        self.rounds += 1
+        self.expire(now)
+        if self.top_k is None:
+            return list(suppliers)
+
+        unknown = [s for s in suppliers if s not in self.entries]
+        ranked = sorted(
+            (s for s in suppliers if self.score(s) is not None),
+            key=self.score,
+        )
+        chosen = set(unknown) | set(ranked[:self.top_k])
+
+        explore = self.explore_every and self.rounds % self.explore_every == 0
+        if explore or not chosen:
+            rest = [s for s in suppliers if s not in chosen]
+            if rest:
+                chosen.add(self.rng.choice(rest))
+
+        return [s for s in suppliers if s in chosen]
@@ -0,0 +1,49 @@
+# rng.py
+# -*- coding: utf-8 -*-
+import hashlib
+import random
+
+
+class RandomStreams:
+    """
+    Registo de geradores aleatórios com semente, um por nome.
+
+    Cada agente/subsistema pede o seu stream pelo nome (ex.:
+    "M1/failures", "environment/failures/M2", "orders") e recebe um
+    random.Random independente, com semente derivada de (seed, nome).
+    Assim a sequência de cada stream não depende da ordem em que os
+    agentes correm: a mesma seed dá os mesmos eventos em qualquer
+    escalonamento concorrente.
+
+    generator(nome) dá um numpy.random.Generator para sorteios em lote
+    (componentes vetorizados); o NumPy só é necessário se for usado.
+    seed=None escolhe uma seed ao acaso (guardada em `seed` para repetir).
+    """
+
+    def __init__(self, seed=None):
+        self.seed = seed if seed is not None else random.SystemRandom().getrandbits(63)
+        self.streams = {}
+        self.generators = {}
+
+    def _key(self, name):
+        """Inteiro de 256 bits derivado de (seed, nome) — estável entre execuções."""
+        digest = hashlib.sha256(f"{self.seed}:{name}".encode("utf-8")).digest()
+        return int.from_bytes(digest, "big")
+
+    def stream(self, name):
+        rng = self.streams.get(name)
+        if rng is None:
+            rng = random.Random(self._key(name))
+            self.streams[name] = rng
+        return rng
+
+    def generator(self, name):
+        gen = self.generators.get(name)
+        if gen is None:
+            import numpy as np
+
+            key = self._key(name)
+            words = [(key >> (32 * i)) & 0xFFFFFFFF for i in range(8)]
+            gen = np.random.Generator(np.random.PCG64(np.random.SeedSequence(words)))
+            self.generators[name] = gen
+        return gen
@@ -0,0 +1,35 @@
+# termination.py
+# -*- coding: utf-8 -*-
+
+
+class TerminationDetector:
+    """
+    Deteção de terminação por conversas em aberto.
+
+    Cada conversa (thread ID) é aberta quando o iniciador envia o pedido
+    e fechada quando o protocolo resolve (entrega, timeout, sem propostas).
+    Enquanto houver conversas em aberto, o sistema não está quiescente.
+    """
+
+    def __init__(self):
+        # thread_id → (dono, tick de abertura)
+        self.conversations = {}
+
+    def begin(self, thread_id, owner, time=0):
+        self.conversations[thread_id] = (owner, time)
+
+    def end(self, thread_id):
+        self.conversations.pop(thread_id, None)
+
+    def outstanding(self):
+        return len(self.conversations)
+
+    def is_idle(self):
+        return not self.conversations
+
+    def expire(self, now, ttl):
+        """Esquece conversas abertas há mais de `ttl` ticks. Devolve quantas."""
+        stale = [t for t, (_, opened) in self.conversations.items() if now - opened > ttl]
+        for t in stale:
+            del self.conversations[t]
+        return len(stale)
@@ -0,0 +1,148 @@
+# tracing.py
+# -*- coding: utf-8 -*-
+import math
+from collections import deque
+
+
+def percentile(values, p):
+    """Percentil por nearest-rank (values não precisa de estar ordenado)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[k]
+
+
+class JobTracer:
+    """
+    Ciclo de vida de cada job, em ticks do ambiente.
+
+    Antes de o job existir, os eventos ficam na conversa CNP (thread ID):
+        cfp_issued → proposal_accepted → robot_dispatched → delivered
+    Quando a máquina cria o job, a conversa é associada ao job ID (bind)
+    e passam a registar-se: queued, início/fim de cada etapa,
+    delegações (hops) e completed/lost.
+
+    Memória limitada: jobs terminados passam para `finished` (só os
+    últimos `max_finished`) e conversas nunca associadas a um job
+    expiram após `conversation_ttl` ticks.
+    """
+
+    def __init__(self, max_finished=10000, conversation_ttl=500):
+        self.conversations = {}  # thread_id → {evento: tick}
+        self.jobs = {}           # job_id → trace (jobs ativos)
+        self.finished = deque(maxlen=max_finished)
+        self.conversation_ttl = conversation_ttl
+
+    # ------------------------- registo -------------------------
+
+    def conversation_event(self, thread_id, event, time):
+        if thread_id is None:
+            return
+        self.conversations.setdefault(thread_id, {}).setdefault(event, time)
+
+    def bind(self, thread_id, job_id, time, keep=False, units=1, pipeline=None):
+        """
+        Associa a conversa CNP ao job criado após a entrega.
+        keep=True mantém a conversa (entrega dividida em vários jobs).
+        units/pipeline descrevem o job (usados pelo oráculo de escalonamento).
+        """
+        trace = self._trace(job_id)
+        trace["units"] = units
+        trace["pipeline"] = list(pipeline or [])
+        if keep:
+            trace["events"].update(self.conversations.get(thread_id, {}))
+        else:
+            trace["events"].update(self.conversations.pop(thread_id, {}))
+        trace["events"].setdefault("created", time)
+
+    def job_event(self, job_id, event, time):
+        trace = self._trace(job_id)
+        trace["events"][event] = time
+        if event == "queued":
+            trace["queued_at"] = time
+        elif event in ("completed", "lost"):
+            self.finished.append(self.jobs.pop(job_id))
+
+    def stage_start(self, job_id, stage, machine, time):
+        trace = self._trace(job_id)
+        if trace["queued_at"] is not None:
+            trace["queue_wait"] += time - trace["queued_at"]
+            trace["queued_at"] = None
+        trace["stages"].append({"stage": stage, "machine": machine, "start": time, "end": None})
+
+    def stage_end(self, job_id, time, interrupted=False):
+        trace = self._trace(job_id)
+        if trace["stages"] and trace["stages"][-1]["end"] is None:
+            trace["stages"][-1]["end"] = time
+            trace["stages"][-1]["interrupted"] = interrupted
+
+    def hop(self, job_id, src, dst, time):
+        self._trace(job_id)["hops"].append((time, src, dst))
+
+    def expire(self, now):
+        """Descarta conversas sem job há mais de conversation_ttl ticks."""
+        stale = [
+            t for t, ev in self.conversations.items()
+            if now - min(ev.values()) > self.conversation_ttl
+        ]
+        for t in stale:
+            del self.conversations[t]
+        return len(stale)
+
+    def _trace(self, job_id):
+        trace = self.jobs.get(job_id)
+        if trace is None:
+            trace = {"events": {}, "stages": [], "hops": [], "queue_wait": 0, "queued_at": None}
+            self.jobs[job_id] = trace
+        return trace
+
+    # ------------------------- relatório -------------------------
+
+    def report(self):
+        """p50/p95/p99 de lead time, espera em fila e tempo por etapa (jobs concluídos)."""
+        lead, queue_wait, supply, hops = [], [], [], []
+        per_stage = {}
+
+        for trace in self.finished:
+            ev = trace["events"]
+            if "completed" not in ev:
+                continue
+            start = ev.get("cfp_issued", ev.get("created"))
+            lead.append(ev["completed"] - start)
+            queue_wait.append(trace["queue_wait"])
+            hops.append(len(trace["hops"]))
+            if "cfp_issued" in ev and "delivered" in ev:
+                supply.append(ev["delivered"] - ev["cfp_issued"])
+            for s in trace["stages"]:
+                if s["end"] is not None:
+                    per_stage.setdefault(s["stage"], []).append(s["end"] - s["start"])
+
+        def stats(values):
+            return {
+                "n": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+
+        return {
+            "lead_time": stats(lead),
+            "supply_time": stats(supply),
+            "queue_wait": stats(queue_wait),
+            "hops": stats(hops),
+            "stages": {stage: stats(v) for stage, v in per_stage.items()},
+        }
+
+    def format_report(self):
+        rep = self.report()
+        lines = ["=== LATÊNCIAS POR JOB (ticks) ==="]
+
+        def line(name, s):
+            return f"{name}: n={s['n']} p50={s['p50']} p95={s['p95']} p99={s['p99']}"
+
+        for key in ("lead_time", "supply_time", "queue_wait", "hops"):
+            lines.append(line(key, rep[key]))
+        for stage, s in rep["stages"].items():
+            lines.append(line(f"etapa {stage}", s))
+        return "\n".join(lines)